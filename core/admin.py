@@ -1,6 +1,6 @@
 
 from django.contrib import admin
-from .models import Phong, DichVu, KhachHang, NhanVien, LichLamViec, DonDatPhong, DonDatDichVu, YeuCau, HoaDon
+from .models import Phong, DichVu, KhachHang, NhanVien, LichLamViec, DonDatPhong, DonDatDichVu, YeuCau, HoaDon, PhongNgay, BaoCaoNgay, SlaNgay
 
 # Đăng ký các model của bạn ở đây
 admin.site.register(Phong)
@@ -11,4 +11,7 @@ admin.site.register(LichLamViec)
 admin.site.register(DonDatPhong)
 admin.site.register(DonDatDichVu)
 admin.site.register(YeuCau)
-admin.site.register(HoaDon)
\ No newline at end of file
+admin.site.register(HoaDon)
+admin.site.register(PhongNgay)
+admin.site.register(BaoCaoNgay)
+admin.site.register(SlaNgay)
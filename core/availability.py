@@ -0,0 +1,212 @@
+# QLCSKH_LTW/core/availability.py
+# Bộ máy kiểm tra phòng trống theo khoảng ngày.
+# Mỗi phòng giữ một bitmap theo đêm (bit i = đêm EPOCH + i đã có khách),
+# được dựng từ các DonDatPhong đang giữ phòng và cập nhật qua signals khi đơn đổi trạng thái.
+import logging
+import threading
+from datetime import date, timedelta
+
+from django.core.cache import cache
+
+from .cache_backend import new_version, shared_cache
+from .models import DonDatPhong
+
+logger = logging.getLogger(__name__)
+
+# Các trạng thái đơn đang chiếm phòng (cùng điều kiện với bảng PhongNgay)
+ACTIVE_BOOKING_STATUSES = DonDatPhong.TRANG_THAI_GIU_PHONG
+
+EPOCH = date(2020, 1, 1)
+VERSION_CACHE_KEY = 'availability:version'
+ROOM_VERSION_KEY = 'availability:room:{}'
+MATRIX_CACHE_KEY = 'availability:matrix:{}:{}:{}:{}'
+MATRIX_CACHE_TIMEOUT = 60 * 60
+
+
+def _night_index(day):
+    return max((day - EPOCH).days, 0)
+
+
+def nights_mask(date_in, date_out):
+    """Bitmask các đêm trong khoảng [date_in, date_out)."""
+    start = _night_index(date_in)
+    end = _night_index(date_out)
+    if end <= start:
+        return 0
+    return ((1 << (end - start)) - 1) << start
+
+
+class RoomAvailabilityIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._intervals = {}  # ma_p -> {ma_ddp: (ngay_nhan, ngay_tra)}
+        self._bitmaps = {}  # ma_p -> int
+        self._version = None
+
+    # ---- Dựng / đồng bộ chỉ mục ----
+
+    def rebuild(self):
+        intervals = {}
+        rows = DonDatPhong.objects.filter(
+            trang_thai__in=ACTIVE_BOOKING_STATUSES
+        ).values_list('ma_ddp', 'phong_id', 'ngay_nhan', 'ngay_tra')
+        for ma_ddp, phong_id, ngay_nhan, ngay_tra in rows.iterator():
+            intervals.setdefault(phong_id, {})[ma_ddp] = (ngay_nhan, ngay_tra)
+
+        with self._lock:
+            self._intervals = intervals
+            self._bitmaps = {phong_id: self._compute_bitmap(bookings) for phong_id, bookings in intervals.items()}
+            self._version = shared_cache.get_or_set(VERSION_CACHE_KEY, new_version, None)
+        logger.debug(f"Availability index rebuilt: {len(intervals)} rooms, version {self._version}")
+
+    def _ensure_fresh(self):
+        # Worker khác đã đổi dữ liệu (version trong cache thay đổi) thì dựng lại
+        current = shared_cache.get(VERSION_CACHE_KEY)
+        if self._version is None or current != self._version:
+            self.rebuild()
+
+    @staticmethod
+    def _compute_bitmap(bookings):
+        bitmap = 0
+        for ngay_nhan, ngay_tra in bookings.values():
+            bitmap |= nights_mask(ngay_nhan, ngay_tra)
+        return bitmap
+
+    def apply_booking(self, ma_ddp, phong_id, ngay_nhan, ngay_tra, trang_thai):
+        """Cập nhật chỉ mục khi một đơn được tạo/đổi trạng thái/đổi ngày."""
+        with self._lock:
+            if self._version is None:
+                return
+            # Đơn có thể đã chuyển phòng: bỏ khỏi mọi phòng đang giữ nó
+            touched = {pid for pid, bookings in self._intervals.items() if ma_ddp in bookings}
+            for pid in touched:
+                del self._intervals[pid][ma_ddp]
+            if trang_thai in ACTIVE_BOOKING_STATUSES:
+                self._intervals.setdefault(phong_id, {})[ma_ddp] = (ngay_nhan, ngay_tra)
+                touched.add(phong_id)
+            for pid in touched:
+                self._bitmaps[pid] = self._compute_bitmap(self._intervals.get(pid, {}))
+            new_version = self._bump_version()
+            # Có worker khác ghi xen giữa thì lần truy vấn sau sẽ dựng lại toàn bộ
+            self._version = new_version if new_version == self._version + 1 else None
+
+    def remove_booking(self, ma_ddp):
+        self.apply_booking(ma_ddp, None, None, None, None)
+
+    def invalidate(self):
+        """Sau khi đổi nhiều đơn bằng update() (không có signal): mọi worker dựng lại ở lượt truy vấn sau."""
+        with self._lock:
+            self._bump_version()
+            self._version = None
+
+    @staticmethod
+    def _bump_version():
+        try:
+            return shared_cache.incr(VERSION_CACHE_KEY)
+        except ValueError:
+            version = new_version()
+            shared_cache.set(VERSION_CACHE_KEY, version, None)
+            return version
+
+    # ---- Truy vấn ----
+
+    def is_available(self, phong_id, date_in, date_out):
+        self._ensure_fresh()
+        return not (self._bitmaps.get(phong_id, 0) & nights_mask(date_in, date_out))
+
+    def available_room_ids(self, room_ids, date_in, date_out):
+        """Lọc danh sách ma_p còn trống cả khoảng [date_in, date_out) - không truy vấn DB mỗi phòng."""
+        self._ensure_fresh()
+        mask = nights_mask(date_in, date_out)
+        bitmaps = self._bitmaps
+        return [phong_id for phong_id in room_ids if not (bitmaps.get(phong_id, 0) & mask)]
+
+    def occupancy(self, phong_id, date_from, days):
+        """Danh sách bool theo ngày (True = đã có khách) bắt đầu từ date_from."""
+        self._ensure_fresh()
+        bitmap = self._bitmaps.get(phong_id, 0) >> _night_index(date_from)
+        return [bool((bitmap >> i) & 1) for i in range(days)]
+
+
+availability_index = RoomAvailabilityIndex()
+
+
+def find_available_rooms(rooms, date_in, date_out, guests=None):
+    """Trả về danh sách phòng (từ queryset `rooms`) còn trống trong khoảng ngày và đủ sức chứa."""
+    if guests:
+        rooms = rooms.filter(suc_chua__gte=guests)
+    rooms = list(rooms)
+    free_ids = set(availability_index.available_room_ids([room.ma_p for room in rooms], date_in, date_out))
+    return [room for room in rooms if room.ma_p in free_ids]
+
+
+
+# ---- Ma trận phòng x ngày cho lịch đặt phòng ----
+
+def room_versions(room_ids):
+    """Version theo từng phòng, tăng mỗi khi một đơn của phòng thay đổi (xem signals)."""
+    keys = {ROOM_VERSION_KEY.format(room_id): room_id for room_id in room_ids}
+    found = shared_cache.get_many(keys.keys())
+    # Key chưa có/bị xóa khỏi cache: mốc thời gian (không trùng version cũ), ghi cả lô một lượt.
+    # Ghi đè một version vừa được worker khác tạo cũng an toàn: giá trị vẫn mới, chỉ làm dựng lại thêm một lần.
+    missing = {key: new_version() for key in keys if key not in found}
+    if missing:
+        shared_cache.set_many(missing, None)
+        found.update(missing)
+    return {room_id: found[key] for key, room_id in keys.items()}
+
+
+def bump_room_version(room_id):
+    key = ROOM_VERSION_KEY.format(room_id)
+    try:
+        shared_cache.incr(key)
+    except ValueError:
+        shared_cache.set(key, new_version(), None)
+
+
+def _encode_bits(bits, encoding):
+    if encoding == 'rle':
+        # Độ dài các đoạn xen kẽ trống/đã đặt, luôn bắt đầu bằng đoạn trống (có thể = 0)
+        runs, current, length = [], '0', 0
+        for bit in bits:
+            if bit == current:
+                length += 1
+            else:
+                runs.append(length)
+                current, length = bit, 1
+        runs.append(length)
+        return runs
+    return bits
+
+
+def availability_matrix(room_ids, start, days, encoding='rle', versions=None):
+    """Trả về {ma_p: bitstring/rle} cho `days` ngày từ `start`; '1' = đêm đã có khách."""
+    if versions is None:
+        versions = room_versions(room_ids)
+    keys = {MATRIX_CACHE_KEY.format(room_id, versions[room_id], start.isoformat(), days): room_id
+            for room_id in room_ids}
+    cached = cache.get_many(keys.keys())
+    bits = {keys[key]: value for key, value in cached.items()}
+
+    missing = [room_id for room_id in room_ids if room_id not in bits]
+    if missing:
+        end = start + timedelta(days=days)
+        computed = {room_id: bytearray(b'0' * days) for room_id in missing}
+        # Một truy vấn cho mọi phòng còn thiếu, nhóm theo phòng khi duyệt kết quả
+        rows = DonDatPhong.objects.filter(
+            phong_id__in=missing,
+            trang_thai__in=ACTIVE_BOOKING_STATUSES,
+            ngay_nhan__lt=end,
+            ngay_tra__gt=start,
+        ).order_by('phong_id').values_list('phong_id', 'ngay_nhan', 'ngay_tra')
+        for phong_id, ngay_nhan, ngay_tra in rows:
+            first = max((ngay_nhan - start).days, 0)
+            last = min((ngay_tra - start).days, days)
+            computed[phong_id][first:last] = b'1' * (last - first)
+        to_cache = {}
+        for room_id, value in computed.items():
+            bits[room_id] = value.decode()
+            to_cache[MATRIX_CACHE_KEY.format(room_id, versions[room_id], start.isoformat(), days)] = bits[room_id]
+        cache.set_many(to_cache, MATRIX_CACHE_TIMEOUT)
+
+    return {room_id: _encode_bits(bits[room_id], encoding) for room_id in room_ids}
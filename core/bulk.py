@@ -0,0 +1,230 @@
+# QLCSKH_LTW/core/bulk.py
+# Chuyển trạng thái hàng loạt từ trang danh sách (bulk_requests, bulk_bookings): cùng quy tắc quyền và điều kiện trạng thái
+# như process_request/process_booking, nhưng đọc mọi mục bằng một truy vấn và ghi bằng UPDATE theo tập trong một transaction.
+# update() không gửi signal nên phần việc của signals (bộ đếm, chỉ mục phòng trống, luồng sự kiện, số việc của nhân viên)
+# được làm một lần cho cả lô sau commit. Kết quả trả về theo từng mục để hiển thị báo cáo.
+from collections import Counter, defaultdict, namedtuple
+
+from django.db import IntegrityError, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from . import counters, dispatch, events, page_cache, rollups, sla
+from .availability import availability_index, bump_room_version
+from .inventory import claim_nights
+from .models import DonDatDichVu, DonDatPhong, HoaDon, Phong, PhongNgay, YeuCau
+
+MAX_ITEMS = 500
+
+ItemResult = namedtuple('ItemResult', 'pk ok message')
+
+REQUEST_ACTIONS = {
+    'assign': 'Phân công',
+    'processing': 'Bắt đầu xử lý',
+    'complete': 'Hoàn thành',
+    'cancel': 'Hủy',
+}
+BOOKING_ACTIONS = {
+    'confirm': 'Xác nhận',
+    'checkin': 'Check-in',
+    'checkout': 'Check-out',
+    'cancel': 'Hủy',
+}
+# Hành động nhân viên (không phải admin) được làm, như ở trang xử lý từng mục
+STAFF_REQUEST_ACTIONS = ('processing', 'complete', 'cancel')
+STAFF_BOOKING_ACTIONS = ('confirm',)
+REQUEST_STATUS_LABELS = dict(YeuCau.TINH_TRANG_CHOICES)
+
+
+def _counter_changes(model, transitions):
+    """{tên bộ đếm: chênh lệch} từ [(trạng thái cũ, trạng thái mới)]."""
+    name = counters.TRACKED_MODELS[model][0]
+    changes = Counter()
+    for old_status, new_status in transitions:
+        changes[counters.counter_name(name, old_status)] -= 1
+        changes[counters.counter_name(name, new_status)] += 1
+    return {key: value for key, value in changes.items() if value}
+
+
+# ---- Yêu cầu ----
+
+def _request_change(row, action, role, staff_id, assignee_id):
+    """(tình trạng mới, nhân viên mới) hoặc chuỗi lý do bỏ qua."""
+    status, current_staff = row['tinh_trang'], row['nhan_vien_id']
+    if role == 'nhan_vien' and current_staff and staff_id and current_staff != staff_id:
+        return "Yêu cầu đã giao cho nhân viên khác."
+    if action == 'assign':
+        if (status, current_staff) == ('da_phan_cong', assignee_id):
+            return "Không có thay đổi."
+        return 'da_phan_cong', assignee_id
+    target = {'processing': 'dang_xu_ly', 'complete': 'da_xu_ly', 'cancel': 'da_huy'}[action]
+    if status == target:
+        return "Không có thay đổi."
+    if action == 'processing' and role == 'nhan_vien' and not current_staff and staff_id:
+        return target, staff_id
+    return target, current_staff
+
+
+def transition_requests(ids, action, role, staff_id=None, assignee_id=None, now=None):
+    """Áp dụng action cho các YeuCau trong ids; trả về [ItemResult] theo thứ tự ids."""
+    now = now or timezone.now()
+    results = {}
+    with transaction.atomic():
+        rows = {
+            row['ma_yc']: row
+            for row in YeuCau.objects.select_for_update().filter(pk__in=ids).values(
+                'ma_yc', 'tinh_trang', 'nhan_vien_id', 'loai_yc', 'ngay_tao',
+            )
+        }
+        groups = defaultdict(list)  # (tình trạng mới, nhân viên mới) -> [dòng]
+        for pk in ids:
+            row = rows.get(pk)
+            change = _request_change(row, action, role, staff_id, assignee_id) if row else "Không tìm thấy yêu cầu."
+            if isinstance(change, str):
+                results[pk] = ItemResult(pk, False, change)
+            else:
+                groups[change].append(row)
+
+        sla_deltas = defaultdict(sla.QuantileSketch)
+        for (new_status, new_staff), group in groups.items():
+            fields = {'tinh_trang': new_status, 'nhan_vien_id': new_staff, 'ngay_cap_nhat': now}
+            if new_status == 'da_xu_ly':
+                fields['thoi_gian_hoan_thanh'] = now
+            YeuCau.objects.filter(pk__in=[row['ma_yc'] for row in group]).update(**fields)
+            for row in group:
+                sla.add_transition(sla_deltas, row['loai_yc'], new_staff, row['ngay_tao'], row['tinh_trang'], new_status,
+                                   now, now)
+                results[row['ma_yc']] = ItemResult(row['ma_yc'], True, f"{REQUEST_STATUS_LABELS[new_status]}.")
+        sla.apply_deltas(sla_deltas)
+        transaction.on_commit(lambda: _after_requests(groups))
+    return [results[pk] for pk in ids]
+
+
+def _after_requests(groups):
+    transitions, loads, published = [], Counter(), defaultdict(list)
+    for (new_status, new_staff), group in groups.items():
+        for row in group:
+            old_status, old_staff = row['tinh_trang'], row['nhan_vien_id']
+            transitions.append((old_status, new_status))
+            if old_staff and old_status in dispatch.ACTIVE_STATUSES:
+                loads[old_staff] -= 1
+            if new_staff and new_status in dispatch.ACTIVE_STATUSES:
+                loads[new_staff] += 1
+            published[(new_status, new_staff, old_status, old_staff)].append(row['ma_yc'])
+    counters.adjust_many(_counter_changes(YeuCau, transitions))
+    for ma_nv, delta in loads.items():
+        if delta:
+            dispatch.dispatcher.adjust(ma_nv, delta)
+    for (new_status, new_staff, old_status, old_staff), pks in published.items():
+        events.event_broker.publish(events.make_event('yeu_cau', pks, new_status, old_status, new_staff, old_staff))
+
+
+# ---- Đặt phòng ----
+
+BOOKING_GUARDS = {
+    # action -> (trạng thái đích, trạng thái được phép, lý do khi không được)
+    'confirm': ('da_xac_nhan', ('cho_xac_nhan',), "Đơn đặt phòng không ở trạng thái chờ xác nhận."),
+    'checkin': ('da_checkin', ('da_xac_nhan',), "Đơn đặt phòng phải ở trạng thái đã xác nhận để check-in."),
+    'checkout': ('da_checkout', ('da_checkin',), "Đơn đặt phòng phải ở trạng thái đã check-in để check-out."),
+    'cancel': ('da_huy', ('cho_xac_nhan', 'da_xac_nhan', 'da_checkin'), "Không thể hủy đơn đã check-out hoặc đã hủy."),
+}
+# Trạng thái phòng sau hành động (như process_booking)
+ROOM_STATUS = {'checkin': 'dang_su_dung', 'checkout': 'trong'}
+
+
+def _sync_nights(bookings, new_status, results):
+    """sync_nights cho cả lô: cập nhật/xóa PhongNgay theo tập; đơn cũ chưa có PhongNgay thì giữ từng đêm (có thể trùng lịch)."""
+    ids = [row['ma_ddp'] for row in bookings]
+    if new_status not in DonDatPhong.TRANG_THAI_GIU_PHONG:
+        PhongNgay.objects.filter(don_dat_phong__in=ids).delete()
+        return bookings
+    with_nights = set(PhongNgay.objects.filter(don_dat_phong__in=ids).values_list('don_dat_phong_id', flat=True).distinct())
+    PhongNgay.objects.filter(don_dat_phong__in=with_nights).update(trang_thai=new_status)
+    claimed = []
+    for row in bookings:
+        if row['ma_ddp'] not in with_nights:
+            booking = DonDatPhong(ma_ddp=row['ma_ddp'], phong_id=row['phong_id'], ngay_nhan=row['ngay_nhan'],
+                                  ngay_tra=row['ngay_tra'], trang_thai=new_status)
+            try:
+                claim_nights(booking)
+            except IntegrityError:
+                results[row['ma_ddp']] = ItemResult(row['ma_ddp'], False,
+                                                    "Phòng đã có đơn khác giữ trong khoảng thời gian này.")
+                continue
+        claimed.append(row)
+    return claimed
+
+
+def _checkout_invoices(bookings, results):
+    """Ghi BaoCaoNgay (dịch vụ theo ngày sử dụng) và tạo hóa đơn theo tong_tien của đơn cho các đơn check-out."""
+    ids = [row['ma_ddp'] for row in bookings]
+    service_rows = list(DonDatDichVu.objects.filter(don_dat_phong__in=ids).order_by().values_list(
+        'don_dat_phong_id', 'ngay_su_dung').annotate(total=Sum('thanh_tien')))
+    loai_p = {row['ma_ddp']: row['phong__loai_p'] for row in bookings}
+    rollups.record_bulk(
+        checkouts=[(row['phong__loai_p'], row['ngay_nhan'], row['ngay_tra'], row['gia_ddp']) for row in bookings],
+        services=[(ngay_su_dung, loai_p[ma_ddp], total) for ma_ddp, ngay_su_dung, total in service_rows],
+    )
+    invoiced = set(HoaDon.objects.filter(don_dat_phong__in=ids).values_list('don_dat_phong_id', flat=True))
+    HoaDon.objects.bulk_create([
+        HoaDon(don_dat_phong_id=row['ma_ddp'], tong_tien=row['tong_tien'], da_thanh_toan=False)
+        for row in bookings if row['ma_ddp'] not in invoiced
+    ], batch_size=500)
+    for row in bookings:
+        message = "Đã check-out. Hóa đơn đã tồn tại." if row['ma_ddp'] in invoiced else "Đã check-out và tạo hóa đơn."
+        results[row['ma_ddp']] = ItemResult(row['ma_ddp'], True, message)
+
+
+def transition_bookings(ids, action, now=None):
+    """Áp dụng action cho các DonDatPhong trong ids (quyền theo vai trò đã kiểm tra ở view); trả về [ItemResult]."""
+    new_status, allowed, reason = BOOKING_GUARDS[action]
+    results = {}
+    with transaction.atomic():
+        rows = {
+            row['ma_ddp']: row
+            for row in DonDatPhong.objects.select_for_update(of=('self',)).filter(pk__in=ids).values(
+                'ma_ddp', 'trang_thai', 'phong_id', 'phong__loai_p', 'ngay_nhan', 'ngay_tra', 'gia_ddp', 'tong_tien',
+            )
+        }
+        valid = []
+        for pk in ids:
+            row = rows.get(pk)
+            if row is None:
+                results[pk] = ItemResult(pk, False, "Không tìm thấy đơn đặt phòng.")
+            elif row['trang_thai'] not in allowed:
+                results[pk] = ItemResult(pk, False, reason)
+            else:
+                valid.append(row)
+
+        valid = _sync_nights(valid, new_status, results)
+        if valid:
+            DonDatPhong.objects.filter(pk__in=[row['ma_ddp'] for row in valid]).update(trang_thai=new_status, canh_bao='')
+            if action in ROOM_STATUS:
+                Phong.objects.filter(pk__in={row['phong_id'] for row in valid if row['phong_id']}).update(
+                    trang_thai=ROOM_STATUS[action])
+            if action == 'checkout':
+                _checkout_invoices(valid, results)
+            elif action == 'cancel':
+                rollups.record_bulk(cancellations=[
+                    (row['phong__loai_p'], row['ngay_nhan'], row['ngay_tra'], row['gia_ddp']) for row in valid
+                ])
+        for row in valid:
+            results.setdefault(row['ma_ddp'], ItemResult(row['ma_ddp'], True, f"{BOOKING_ACTIONS[action]} thành công."))
+        transaction.on_commit(lambda: _after_bookings(valid, new_status, action in ROOM_STATUS))
+    return [results[pk] for pk in ids]
+
+
+def _after_bookings(bookings, new_status, rooms_changed=False):
+    if not bookings:
+        return
+    if rooms_changed:
+        page_cache.bump(Phong)
+    counters.adjust_many(_counter_changes(DonDatPhong, [(row['trang_thai'], new_status) for row in bookings]))
+    availability_index.invalidate()
+    for phong_id in {row['phong_id'] for row in bookings}:
+        bump_room_version(phong_id)
+    by_old_status = defaultdict(list)
+    for row in bookings:
+        by_old_status[row['trang_thai']].append(row['ma_ddp'])
+    for old_status, pks in by_old_status.items():
+        events.event_broker.publish(events.make_event('don_dat_phong', pks, new_status, old_status))
@@ -0,0 +1,91 @@
+# QLCSKH_LTW/core/cache_backend.py
+# Cache 'shared' (settings.CACHES): version, bộ đếm và các khóa mà mọi worker lẫn lệnh quản trị chạy từ cron
+# phải thấy như nhau. Dữ liệu lớn dựng từ version (trang, ma trận phòng, chỉ mục trong bộ nhớ) vẫn ở cache 'default'
+# của từng tiến trình: version đổi thì khóa đổi, nên bản cũ ở tiến trình khác không còn được đọc.
+# Mặc định 'shared' là bảng core_cache trong CSDL chính. incr mặc định của DatabaseCache là get + set (không nguyên tử,
+# và đặt lại hạn của key theo TIMEOUT mặc định), trong khi các version dựa vào incr để biết có tiến trình khác ghi
+# xen giữa, nên ở đây incr khóa dòng trước khi đọc và giữ nguyên hạn.
+import base64
+import pickle
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.db import DatabaseCache as BaseDatabaseCache
+from django.db import connections, models, router, transaction
+from django.utils.connection import ConnectionProxy
+from django.utils.timezone import now as tz_now
+
+shared_cache = ConnectionProxy(caches, 'shared')
+
+
+def new_version():
+    """Version cho key chưa có/bị xóa khỏi cache: mốc thời gian (ms) để không trùng version cũ mà worker khác còn giữ."""
+    return int(time.time() * 1000)
+
+
+class DatabaseCache(BaseDatabaseCache):
+    BATCH_SIZE = 300  # SQLite giới hạn 999 tham số mỗi câu lệnh
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        db = router.db_for_write(self.cache_model_class)
+        connection = connections[db]
+        quote_name = connection.ops.quote_name
+        table, cache_key, value, expires = map(quote_name, (self._table, 'cache_key', 'value', 'expires'))
+        with transaction.atomic(using=db), connection.cursor() as cursor:
+            # Ghi trước khi đọc: giữ khóa ghi (SQLite) / khóa dòng (CSDL khác) tới hết transaction,
+            # nên hai tiến trình incr cùng lúc không đọc cùng một giá trị cũ
+            cursor.execute(f"UPDATE {table} SET {expires} = {expires} WHERE {cache_key} = %s", [key])
+            cursor.execute(f"SELECT {value}, {expires} FROM {table} WHERE {cache_key} = %s", [key])
+            row = cursor.fetchone()
+            if row is not None:
+                expression = models.Expression(output_field=models.DateTimeField())
+                expiry = row[1]
+                for converter in connection.ops.get_db_converters(expression) + expression.get_db_converters(connection):
+                    expiry = converter(expiry, expression, connection)
+                if expiry < tz_now():
+                    row = None
+            if row is None:
+                raise ValueError(f"Key '{key}' not found.")
+            new_value = pickle.loads(base64.b64decode(connection.ops.process_clob(row[0]).encode())) + delta
+            encoded = base64.b64encode(pickle.dumps(new_value, self.pickle_protocol)).decode('latin1')
+            cursor.execute(f"UPDATE {table} SET {value} = %s WHERE {cache_key} = %s", [encoded, key])
+        return new_value
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        """Ghi cả lô bằng một DELETE + một INSERT mỗi BATCH_SIZE key (mặc định mỗi key 3 truy vấn)."""
+        if not data:
+            return []
+        keys = {self.make_and_validate_key(key, version=version): value for key, value in data.items()}
+        timeout = self.get_backend_timeout(timeout)
+        db = router.db_for_write(self.cache_model_class)
+        connection = connections[db]
+        quote_name = connection.ops.quote_name
+        table, cache_key, value, expires = map(quote_name, (self._table, 'cache_key', 'value', 'expires'))
+        if timeout is None:
+            exp = datetime.max
+        else:
+            exp = datetime.fromtimestamp(timeout, tz=timezone.utc if settings.USE_TZ else None)
+        exp = connection.ops.adapt_datetimefield_value(exp.replace(microsecond=0))
+        rows = [
+            (key, base64.b64encode(pickle.dumps(item, self.pickle_protocol)).decode('latin1'), exp)
+            for key, item in keys.items()
+        ]
+        with transaction.atomic(using=db), connection.cursor() as cursor:
+            cursor.execute(f"SELECT COUNT(*) FROM {table}")
+            num = cursor.fetchone()[0]
+            if num > self._max_entries:
+                self._cull(db, cursor, tz_now().replace(microsecond=0), num)
+            for start in range(0, len(rows), self.BATCH_SIZE):
+                batch = rows[start:start + self.BATCH_SIZE]
+                cursor.execute(f"DELETE FROM {table} WHERE {cache_key} IN ({', '.join(['%s'] * len(batch))})",
+                               [row[0] for row in batch])
+                cursor.execute(
+                    f"INSERT INTO {table} ({cache_key}, {value}, {expires}) VALUES "
+                    + ', '.join(['(%s, %s, %s)'] * len(batch)),
+                    [field for row in batch for field in row],
+                )
+        return []
@@ -0,0 +1,95 @@
+# QLCSKH_LTW/core/counters.py
+# Bộ đếm tổng số phòng/đơn/khách hàng/dịch vụ và số đơn, số yêu cầu theo trạng thái.
+# Giá trị nằm trong cache 'shared' (mọi worker và lệnh quản trị cùng thấy), được cộng/trừ qua signals (core/signals.py) nên trang chủ và dashboard
+# không phải chạy COUNT(*). Thiếu key thì đếm lại từ DB; lệnh reconcile_counters sửa sai lệch định kỳ.
+import logging
+
+from django.db.models import Count
+
+from .cache_backend import shared_cache
+from .models import Phong, DichVu, KhachHang, DonDatPhong, YeuCau
+
+logger = logging.getLogger(__name__)
+
+COUNTER_KEY = 'counters:{}'
+
+# model -> (tên bộ đếm, trường trạng thái cần đếm riêng)
+TRACKED_MODELS = {
+    Phong: ('phong', None),
+    DichVu: ('dich_vu', None),
+    KhachHang: ('khach_hang', None),
+    DonDatPhong: ('don_dat_phong', 'trang_thai'),
+    YeuCau: ('yeu_cau', 'tinh_trang'),
+}
+
+
+def counter_name(name, status=None):
+    return f"{name}:{status}" if status else name
+
+
+def all_counter_names():
+    names = []
+    for model, (name, status_field) in TRACKED_MODELS.items():
+        names.append(name)
+        if status_field:
+            names.extend(counter_name(name, status) for status, _ in model._meta.get_field(status_field).choices)
+    return names
+
+
+def recount():
+    """Đếm lại toàn bộ từ DB (một COUNT cho model thường, một GROUP BY cho model có trạng thái)."""
+    values = {}
+    for model, (name, status_field) in TRACKED_MODELS.items():
+        if status_field:
+            by_status = dict(model.objects.order_by().values_list(status_field).annotate(total=Count('pk')))
+            for status, _ in model._meta.get_field(status_field).choices:
+                values[counter_name(name, status)] = by_status.get(status, 0)
+            values[name] = sum(by_status.values())
+        else:
+            values[name] = model.objects.count()
+    return values
+
+
+def reconcile():
+    """Ghi đè bộ đếm bằng số đếm thật, trả về {tên: (giá trị cũ, giá trị đúng)} của các bộ đếm lệch."""
+    values = recount()
+    current = shared_cache.get_many([COUNTER_KEY.format(name) for name in values])
+    drift = {}
+    for name, value in values.items():
+        old = current.get(COUNTER_KEY.format(name))
+        if old != value:
+            drift[name] = (old, value)
+    shared_cache.set_many({COUNTER_KEY.format(name): value for name, value in values.items()}, None)
+    return drift
+
+
+def get_counters():
+    keys = {COUNTER_KEY.format(name): name for name in all_counter_names()}
+    found = shared_cache.get_many(keys.keys())
+    if len(found) < len(keys):
+        logger.debug("Counters missing from cache, recounting")
+        values = recount()
+        found = {COUNTER_KEY.format(name): value for name, value in values.items()}
+        shared_cache.set_many(found, None)
+    return {name: found.get(key, 0) for key, name in keys.items()}
+
+
+def adjust(name, delta):
+    try:
+        shared_cache.incr(COUNTER_KEY.format(name), delta)
+    except ValueError:
+        # Chưa có trong cache: lần đọc tiếp theo sẽ đếm lại từ DB
+        pass
+
+
+def adjust_many(changes):
+    for name, delta in changes.items():
+        adjust(name, delta)
+
+
+def status_counts(counters, model):
+    name, status_field = TRACKED_MODELS[model]
+    return {
+        status: counters[counter_name(name, status)]
+        for status, _ in model._meta.get_field(status_field).choices
+    }
@@ -0,0 +1,226 @@
+# QLCSKH_LTW/core/dispatch.py
+# Tự động phân công YeuCau cho nhân viên đang trong ca.
+# loai_yc -> vi_tri (LOAI_YC_VI_TRI); chỉ xét nhân viên 'dang_lam' có LichLamViec đúng ca hiện tại.
+# Mỗi vi_tri giữ một heap (số yêu cầu đang xử lý, ma_nv) trong bộ nhớ, chọn người ít việc nhất bằng heappop.
+# Heap dựng lại khi sang ca mới hoặc version trong cache đổi (đổi lịch/nhân viên, worker khác phân công);
+# số việc được cộng/trừ qua signals khi yêu cầu được giao, hoàn thành hoặc hủy (core/signals.py).
+import heapq
+import logging
+import threading
+from collections import defaultdict
+from datetime import time, timedelta
+
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from . import counters, events
+from .cache_backend import new_version, shared_cache
+from .models import NhanVien, YeuCau
+
+logger = logging.getLogger(__name__)
+
+VERSION_CACHE_KEY = 'dispatch:version'
+DRAIN_LIMIT = 1000
+
+# Yêu cầu loại nào giao cho bộ phận nào
+LOAI_YC_VI_TRI = {
+    'buong_phong': 'buong_phong',
+    'ky_thuat': 'ky_thuat',
+    'phuc_vu': 'phuc_vu',
+    'le_tan': 'le_tan',
+    'khac': 'le_tan',
+}
+# Trạng thái tính vào khối lượng việc của nhân viên
+ACTIVE_STATUSES = ('da_phan_cong', 'dang_xu_ly')
+
+
+def current_shift(now=None):
+    """(ngay_lam, ca_lam) của ca đang diễn ra; ca tối 23h-7h thuộc ngày bắt đầu ca."""
+    now = timezone.localtime(now)
+    clock = now.time()
+    if time(7) <= clock < time(15):
+        return now.date(), 'sang'
+    if time(15) <= clock < time(23):
+        return now.date(), 'chieu'
+    return (now.date() if clock >= time(23) else now.date() - timedelta(days=1)), 'toi'
+
+
+def bump_version():
+    try:
+        return shared_cache.incr(VERSION_CACHE_KEY)
+    except ValueError:
+        version = new_version()
+        shared_cache.set(VERSION_CACHE_KEY, version, None)
+        return version
+
+
+class RequestDispatcher:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._heaps = {}  # vi_tri -> [(số việc, ma_nv)], có thể chứa mục cũ (bỏ qua khi lấy ra)
+        self._loads = {}  # ma_nv -> số việc hiện tại
+        self._positions = {}  # ma_nv -> vi_tri
+        self._shift = None
+        self._version = None
+
+    # ---- Dựng / đồng bộ ----
+
+    def rebuild(self, now=None):
+        shift = current_shift(now)
+        ngay_lam, ca_lam = shift
+        positions = dict(NhanVien.objects.filter(
+            trang_thai='dang_lam', lichlamviec__ngay_lam=ngay_lam, lichlamviec__ca_lam=ca_lam,
+        ).values_list('ma_nv', 'vi_tri').distinct())
+        loads = dict.fromkeys(positions, 0)
+        if loads:
+            loads.update(YeuCau.objects.filter(
+                nhan_vien_id__in=list(loads), tinh_trang__in=ACTIVE_STATUSES,
+            ).order_by().values_list('nhan_vien_id').annotate(total=Count('pk')))
+        heaps = defaultdict(list)
+        for ma_nv, vi_tri in positions.items():
+            heaps[vi_tri].append((loads[ma_nv], ma_nv))
+        for heap in heaps.values():
+            heapq.heapify(heap)
+
+        with self._lock:
+            self._heaps = dict(heaps)
+            self._loads = loads
+            self._positions = positions
+            self._shift = shift
+            self._version = shared_cache.get_or_set(VERSION_CACHE_KEY, new_version, None)
+        logger.debug(f"Dispatcher rebuilt for {ngay_lam} {ca_lam}: {len(positions)} staff on shift")
+
+    def _ensure_fresh(self, now=None):
+        if self._version is None or self._shift != current_shift(now) or shared_cache.get(VERSION_CACHE_KEY) != self._version:
+            self.rebuild(now)
+
+    def invalidate(self):
+        """Bỏ trạng thái trong bộ nhớ (transaction lỗi, phân công bị tranh): lần sau dựng lại từ DB."""
+        with self._lock:
+            self._version = None
+
+    def adjust(self, ma_nv, delta):
+        """Cộng/trừ số việc của một nhân viên (sau commit: giao tay, hoàn thành, hủy, đổi người)."""
+        with self._lock:
+            if self._version is None:
+                return
+            if ma_nv in self._loads:
+                self._loads[ma_nv] = max(self._loads[ma_nv] + delta, 0)
+                heapq.heappush(self._heaps[self._positions[ma_nv]], (self._loads[ma_nv], ma_nv))
+            self.publish()
+
+    def publish(self):
+        """Tăng version chung sau khi đổi số việc, để các worker khác dựng lại."""
+        with self._lock:
+            if self._version is None:
+                bump_version()
+                return
+            new_version = bump_version()
+            # Có worker khác ghi xen giữa thì lần phân công sau sẽ dựng lại toàn bộ
+            self._version = new_version if new_version == self._version + 1 else None
+
+    # ---- Chọn nhân viên ----
+
+    def pick(self, loai_yc, now=None, refresh=True):
+        """ma_nv ít việc nhất của bộ phận xử lý loai_yc (đã tính thêm việc này), None nếu không ai trong ca.
+
+        refresh=False khi vừa kiểm tra version ngay trước đó (drain kiểm tra một lần cho cả lô).
+        """
+        if refresh:
+            self._ensure_fresh(now)
+        with self._lock:
+            heap = self._heaps.get(LOAI_YC_VI_TRI.get(loai_yc, 'le_tan'))
+            while heap:
+                load, ma_nv = heapq.heappop(heap)
+                if self._loads.get(ma_nv) != load:
+                    continue  # mục cũ, số việc đã thay đổi
+                self._loads[ma_nv] = load + 1
+                heapq.heappush(heap, (load + 1, ma_nv))
+                return ma_nv
+        return None
+
+    def on_shift(self, now=None):
+        """{vi_tri: [(số việc, ma_nv)]} của nhân viên đang trong ca, ít việc trước (để hiển thị)."""
+        self._ensure_fresh(now)
+        with self._lock:
+            result = defaultdict(list)
+            for ma_nv, vi_tri in self._positions.items():
+                result[vi_tri].append((self._loads[ma_nv], ma_nv))
+            return {vi_tri: sorted(rows) for vi_tri, rows in result.items()}
+
+
+dispatcher = RequestDispatcher()
+
+
+def _assign(assignments):
+    """Ghi {ma_nv: [ma_yc]} bằng một UPDATE cho mỗi nhân viên; chỉ đổi yêu cầu còn 'cho_phan_cong'."""
+    assigned = 0
+    for ma_nv, request_ids in assignments.items():
+        updated = YeuCau.objects.filter(
+            pk__in=request_ids, tinh_trang='cho_phan_cong', nhan_vien__isnull=True,
+        ).update(nhan_vien_id=ma_nv, tinh_trang='da_phan_cong', ngay_cap_nhat=timezone.now())
+        if updated:
+            # Một sự kiện cho mỗi nhân viên thay vì mỗi yêu cầu (bỏ sót vài mã đã bị tranh cũng chỉ làm trang tải lại)
+            event = events.make_event('yeu_cau', request_ids, 'da_phan_cong', 'cho_phan_cong', ma_nv, None)
+            transaction.on_commit(lambda event=event: events.event_broker.publish(event))
+        assigned += updated
+    if assigned:
+        # update() không gửi signal: tự cập nhật bộ đếm trạng thái và báo các worker khác
+        changes = {
+            counters.counter_name('yeu_cau', 'cho_phan_cong'): -assigned,
+            counters.counter_name('yeu_cau', 'da_phan_cong'): assigned,
+        }
+        transaction.on_commit(lambda: counters.adjust_many(changes))
+        transaction.on_commit(dispatcher.publish)
+    return assigned
+
+
+def dispatch_request(yeu_cau, now=None):
+    """Giao một yêu cầu 'cho_phan_cong' cho nhân viên phù hợp; trả về ma_nv hoặc None."""
+    if yeu_cau.tinh_trang != 'cho_phan_cong' or yeu_cau.nhan_vien_id:
+        return None
+    ma_nv = dispatcher.pick(yeu_cau.loai_yc, now)
+    if ma_nv is None:
+        return None
+    try:
+        with transaction.atomic():
+            assigned = _assign({ma_nv: [yeu_cau.pk]})
+    except Exception:
+        dispatcher.invalidate()
+        raise
+    if not assigned:
+        # Đã có người phân công trước: trả lại số việc
+        dispatcher.invalidate()
+        return None
+    yeu_cau.nhan_vien_id = ma_nv
+    yeu_cau.tinh_trang = 'da_phan_cong'
+    yeu_cau._request_state = ('da_phan_cong', ma_nv)
+    logger.info(f"Request {yeu_cau.pk} ({yeu_cau.loai_yc}) dispatched to staff {ma_nv}")
+    return ma_nv
+
+
+def drain(limit=DRAIN_LIMIT, now=None):
+    """Phân công tối đa `limit` yêu cầu chờ lâu nhất trong một transaction; trả về (đã giao, còn chờ không ai nhận)."""
+    pending = list(YeuCau.objects.filter(
+        tinh_trang='cho_phan_cong', nhan_vien__isnull=True,
+    ).order_by('ngay_tao', 'ma_yc').values_list('ma_yc', 'loai_yc')[:limit])
+    assignments = defaultdict(list)
+    unassigned = 0
+    dispatcher._ensure_fresh(now)
+    for ma_yc, loai_yc in pending:
+        ma_nv = dispatcher.pick(loai_yc, now, refresh=False)
+        if ma_nv is None:
+            unassigned += 1
+        else:
+            assignments[ma_nv].append(ma_yc)
+    try:
+        with transaction.atomic():
+            assigned = _assign(assignments)
+    except Exception:
+        dispatcher.invalidate()
+        raise
+    if assigned != len(pending) - unassigned:
+        dispatcher.invalidate()
+    logger.info(f"Dispatch drain: {assigned} assigned, {unassigned} without staff on shift")
+    return assigned, unassigned
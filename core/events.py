@@ -0,0 +1,180 @@
+# QLCSKH_LTW/core/events.py
+# Đẩy thay đổi trạng thái YeuCau/DonDatPhong tới nhân viên đang mở bảng điều khiển (Server-Sent Events, request_events).
+# signals -> publish() sau commit -> backend (settings.EVENTS_BACKEND) -> broker.deliver() -> hàng đợi asyncio của từng kết nối.
+# Mỗi kết nối chỉ là một coroutine chờ trên hàng đợi của nó (không giữ thread, không truy vấn DB), nên một worker ASGI
+# giữ được hàng trăm kết nối rảnh. Mặc định LocalBackend chỉ giao trong tiến trình; chạy nhiều worker thì thay bằng
+# backend dùng chung (vd. Redis pub/sub) có cùng giao diện: __init__(deliver) và publish(event), gọi deliver(event)
+# ở mọi worker khi nhận được sự kiện.
+import asyncio
+import itertools
+import json
+import logging
+import threading
+import uuid
+from collections import deque
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .models import DonDatPhong, YeuCau
+
+logger = logging.getLogger(__name__)
+
+QUEUE_SIZE = 100
+HISTORY_SIZE = 500
+HEARTBEAT_SECONDS = 25
+RETRY_MS = 5000
+
+STATUS_LABELS = {
+    'yeu_cau': dict(YeuCau.TINH_TRANG_CHOICES),
+    'don_dat_phong': dict(DonDatPhong.TRANG_THAI_CHOICES),
+}
+# Gửi khi kết nối không theo kịp hoặc không nối tiếp được Last-Event-ID: trình duyệt tải lại trang
+RELOAD = {'type': 'reload'}
+
+
+def make_event(kind, pks, status, old_status=None, nhan_vien_id=None, old_nhan_vien_id=None):
+    return {
+        'type': kind,
+        'pks': list(pks),
+        'status': status,
+        'label': STATUS_LABELS[kind].get(status, status),
+        'old_status': old_status,
+        'nhan_vien_id': nhan_vien_id,
+        'old_nhan_vien_id': old_nhan_vien_id,
+    }
+
+
+def visible(event, role, ma_nv=None):
+    """Admin thấy mọi sự kiện; nhân viên thấy đặt phòng và yêu cầu của mình hoặc chưa ai nhận (trước hoặc sau thay đổi)."""
+    if role == 'admin' or event['type'] != 'yeu_cau':
+        return True
+    return bool({event['nhan_vien_id'], event['old_nhan_vien_id']} & {ma_nv, None})
+
+
+def format_event(event):
+    lines = [f"id: {event['id']}"] if 'id' in event else []
+    lines += [f"event: {event['type']}", f"data: {json.dumps(event, ensure_ascii=False)}"]
+    return '\n'.join(lines) + '\n\n'
+
+
+class LocalBackend:
+    """Chỉ giao trong tiến trình hiện tại (một worker, môi trường dev/test)."""
+
+    def __init__(self, deliver):
+        self.deliver = deliver
+
+    def publish(self, event):
+        self.deliver(event)
+
+
+class Subscription:
+    def __init__(self, loop, accepts):
+        self.loop = loop
+        self.accepts = accepts
+        self.queue = asyncio.Queue(QUEUE_SIZE)
+        self.overflowed = False
+
+    def offer(self, event):
+        # Chạy trên event loop của kết nối; đầy hàng đợi thì đánh dấu để stream gửi RELOAD và đóng
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+class EventBroker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._history = deque(maxlen=HISTORY_SIZE)  # [(số thứ tự, sự kiện)] để nối lại theo Last-Event-ID
+        self._sequence = itertools.count(1)
+        self._backend = None
+        # id sự kiện gắn với lần khởi động của worker: kết nối lại vào worker khác thì không replay nhầm
+        self.boot = uuid.uuid4().hex[:8]
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = import_string(getattr(settings, 'EVENTS_BACKEND', 'core.events.LocalBackend'))(self.deliver)
+        return self._backend
+
+    def publish(self, event):
+        try:
+            self.backend.publish(event)
+        except Exception:
+            # Không để lỗi đẩy sự kiện làm hỏng thao tác đã commit
+            logger.exception(f"Could not publish {event['type']} event for {event['pks']}")
+
+    def deliver(self, event):
+        with self._lock:
+            sequence = next(self._sequence)
+            event = dict(event, id=f"{self.boot}-{sequence}")
+            self._history.append((sequence, event))
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            if not subscription.accepts(event):
+                continue
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.offer, event)
+            except RuntimeError:
+                # Event loop đã đóng (worker tắt) mà kết nối chưa kịp hủy đăng ký
+                self.unsubscribe(subscription)
+        return event
+
+    def subscribe(self, accepts):
+        subscription = Subscription(asyncio.get_running_loop(), accepts)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    @property
+    def connections(self):
+        return len(self._subscribers)
+
+    def since(self, last_event_id):
+        """Các sự kiện sau last_event_id; None nếu không nối tiếp được (id của worker khác hoặc đã trôi khỏi lịch sử)."""
+        boot, _, sequence = (last_event_id or '').partition('-')
+        if boot != self.boot or not (sequence.isascii() and sequence.isdigit()):
+            return None
+        sequence = int(sequence)
+        with self._lock:
+            history = list(self._history)
+        if history and history[0][0] > sequence + 1:
+            return None
+        return [event for number, event in history if number > sequence]
+
+
+event_broker = EventBroker()
+
+
+async def stream(accepts, last_event_id=None):
+    """Nội dung text/event-stream cho một kết nối: replay theo Last-Event-ID, sau đó chờ sự kiện mới; ping định kỳ."""
+    subscription = event_broker.subscribe(accepts)
+    try:
+        yield f"retry: {RETRY_MS}\n\n"
+        if last_event_id:
+            missed = event_broker.since(last_event_id)
+            if missed is None:
+                yield format_event(RELOAD)
+                return
+            for event in missed:
+                if accepts(event):
+                    yield format_event(event)
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                # Giữ kết nối qua proxy và phát hiện client đã đóng
+                yield ': ping\n\n'
+                continue
+            if subscription.overflowed:
+                yield format_event(RELOAD)
+                return
+            yield format_event(event)
+    finally:
+        event_broker.unsubscribe(subscription)
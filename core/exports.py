@@ -0,0 +1,105 @@
+# QLCSKH_LTW/core/exports.py
+# Xuất CSV dạng stream cho các trang danh sách admin (?export=...).
+# Đọc bằng values_list(...).iterator(chunk_size) nên bộ nhớ không tăng theo số dòng,
+# dòng tiêu đề được gửi ngay trước khi chạy truy vấn.
+import csv
+from datetime import datetime
+
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .models import DonDatPhong, YeuCau
+
+CHUNK_SIZE = 2000
+ROWS_PER_WRITE = 500
+# Ô bắt đầu bằng các ký tự này bị Excel/LibreOffice hiểu là công thức (CSV injection): thêm ' phía trước
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+class _Echo:
+    """File giả cho csv.writer: write() trả lại chuỗi thay vì ghi ra đâu cả."""
+
+    def write(self, value):
+        return value
+
+
+def _format(value):
+    if isinstance(value, datetime):
+        if timezone.is_aware(value):
+            value = timezone.localtime(value)
+        return value.strftime('%Y-%m-%d %H:%M')
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return '' if value is None else value
+
+
+def _stream(header, rows):
+    writer = csv.writer(_Echo())
+    # BOM để Excel nhận đúng UTF-8 tiếng Việt
+    yield '\ufeff' + writer.writerow(header)
+    buffer = []
+    for row in rows:
+        buffer.append(writer.writerow([_format(value) for value in row]))
+        if len(buffer) >= ROWS_PER_WRITE:
+            yield ''.join(buffer)
+            buffer = []
+    if buffer:
+        yield ''.join(buffer)
+
+
+def csv_response(filename, header, rows):
+    response = StreamingHttpResponse(_stream(header, rows), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{filename}_{timezone.now():%Y%m%d}.csv"'
+    return response
+
+
+def _with_labels(rows, labels):
+    """Thay mã lựa chọn ở các cột trong `labels` ({chỉ số cột: {mã: nhãn}}) bằng nhãn hiển thị."""
+    for row in rows:
+        row = list(row)
+        for index, choices in labels.items():
+            row[index] = choices.get(row[index], row[index])
+        yield row
+
+
+def export_bookings(bookings):
+    rows = bookings.values_list(
+        'ma_ddp', 'khach_hang__ten_kh', 'khach_hang__sdt', 'phong__ten_p', 'phong__loai_p',
+        'ngay_dat', 'ngay_nhan', 'ngay_tra', 'gia_ddp', 'trang_thai', 'ghi_chu',
+    ).iterator(chunk_size=CHUNK_SIZE)
+    header = ['Mã đơn', 'Khách hàng', 'SĐT', 'Phòng', 'Loại phòng', 'Ngày đặt', 'Ngày nhận', 'Ngày trả',
+              'Giá', 'Trạng thái', 'Ghi chú']
+    labels = {9: dict(DonDatPhong.TRANG_THAI_CHOICES)}
+    return csv_response('don_dat_phong', header, _with_labels(rows, labels))
+
+
+def export_invoices(invoices):
+    rows = invoices.values_list(
+        'ma_hd', 'don_dat_phong_id', 'don_dat_phong__khach_hang__ten_kh', 'don_dat_phong__phong__ten_p',
+        'ngay_tao', 'tong_tien', 'da_thanh_toan', 'phuong_thuc_tt', 'ghi_chu',
+    ).iterator(chunk_size=CHUNK_SIZE)
+    header = ['Mã hóa đơn', 'Mã đơn', 'Khách hàng', 'Phòng', 'Ngày tạo', 'Tổng tiền', 'Đã thanh toán',
+              'Phương thức', 'Ghi chú']
+    labels = {6: {True: 'Có', False: 'Chưa'}}
+    return csv_response('hoa_don', header, _with_labels(rows, labels))
+
+
+def export_requests(requests_list):
+    rows = requests_list.values_list(
+        'ma_yc', 'khach_hang__ten_kh', 'phong__ten_p', 'loai_yc', 'noi_dung_yc', 'nhan_vien__ten_nv',
+        'ngay_tao', 'thoi_gian_hoan_thanh', 'tinh_trang',
+    ).iterator(chunk_size=CHUNK_SIZE)
+    header = ['Mã yêu cầu', 'Khách hàng', 'Phòng', 'Loại', 'Nội dung', 'Nhân viên', 'Ngày tạo',
+              'Hoàn thành lúc', 'Tình trạng']
+    labels = {3: dict(YeuCau.LOAI_YC_CHOICES), 8: dict(YeuCau.TINH_TRANG_CHOICES)}
+    return csv_response('yeu_cau', header, _with_labels(rows, labels))
+
+
+def export_service_bookings(service_bookings):
+    rows = service_bookings.values_list(
+        'ma_ddv', 'don_dat_phong_id', 'don_dat_phong__khach_hang__ten_kh', 'don_dat_phong__phong__ten_p',
+        'dich_vu__ten_dv', 'ngay_su_dung', 'gio_su_dung', 'so_luong', 'thanh_tien', 'ghi_chu',
+    ).iterator(chunk_size=CHUNK_SIZE)
+    header = ['Mã', 'Mã đơn', 'Khách hàng', 'Phòng', 'Dịch vụ', 'Ngày sử dụng', 'Giờ', 'Số lượng',
+              'Thành tiền', 'Ghi chú']
+    return csv_response('don_dat_dich_vu', header, rows)
@@ -4,6 +4,8 @@ from django.forms import inlineformset_factory
 
 from .models import *
 from accounts.models import TaiKhoan
+from .inventory import has_conflict
+from .roster import PATTERNS, parse_pattern
 from django.utils import timezone
 from datetime import timedelta, date
 
@@ -159,6 +161,66 @@ class LichLamViecForm(forms.ModelForm):
         return cleaned_data
 
 
+class RosterForm(forms.Form):
+    """Xếp lịch hàng loạt cho nhân viên đang làm theo vị trí (hoặc danh sách chọn) và mẫu ca xoay vòng."""
+    MAX_DAYS = 186
+
+    vi_tri = forms.ChoiceField(label='Vị trí', required=False,
+                               choices=[('', 'Tất cả vị trí')] + NhanVien.VI_TRI_CHOICES)
+    nhan_vien = forms.ModelMultipleChoiceField(
+        label='Nhân viên (để trống = tất cả theo vị trí)', required=False,
+        queryset=NhanVien.objects.filter(trang_thai='dang_lam').only('ma_nv', 'ten_nv'),
+        widget=forms.SelectMultiple(attrs={'size': 8}),
+    )
+    ngay_bat_dau = forms.DateField(label='Từ ngày', widget=forms.DateInput(attrs={'type': 'date'}))
+    ngay_ket_thuc = forms.DateField(label='Đến ngày', widget=forms.DateInput(attrs={'type': 'date'}))
+    mau = forms.ChoiceField(label='Mẫu ca',
+                            choices=[(code, name) for code, (name, _) in PATTERNS.items()] + [('tu_chon', 'Tự nhập')])
+    mau_tu_chon = forms.CharField(label='Chu kỳ tự nhập', required=False,
+                                  help_text='Các ca cách nhau bằng dấu phẩy: sang, chieu, toi, nghi')
+    lech_ca = forms.BooleanField(label='Lệch chu kỳ giữa các nhân viên', required=False, initial=True)
+    ghi_chu = forms.CharField(label='Ghi chú', required=False)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        for field in self.fields.values():
+            if isinstance(field.widget, forms.CheckboxInput):
+                field.widget.attrs['class'] = 'form-check-input'
+            elif isinstance(field.widget, forms.Select):
+                field.widget.attrs['class'] = 'form-select form-select-sm'
+            else:
+                field.widget.attrs['class'] = 'form-control form-control-sm'
+
+    def clean(self):
+        cleaned_data = super().clean()
+        ngay_bat_dau = cleaned_data.get('ngay_bat_dau')
+        ngay_ket_thuc = cleaned_data.get('ngay_ket_thuc')
+        if ngay_bat_dau and ngay_ket_thuc:
+            if ngay_bat_dau < date.today():
+                raise forms.ValidationError("Không thể tạo lịch làm việc trong quá khứ")
+            if ngay_ket_thuc < ngay_bat_dau:
+                raise forms.ValidationError("Ngày kết thúc phải sau ngày bắt đầu")
+            if (ngay_ket_thuc - ngay_bat_dau).days >= self.MAX_DAYS:
+                raise forms.ValidationError(f"Chỉ xếp lịch tối đa {self.MAX_DAYS} ngày mỗi lần")
+
+        if cleaned_data.get('mau') == 'tu_chon':
+            try:
+                cleaned_data['pattern'] = parse_pattern(cleaned_data.get('mau_tu_chon', ''))
+            except ValueError as exc:
+                self.add_error('mau_tu_chon', f"Ca không hợp lệ: {exc}")
+        elif cleaned_data.get('mau') in PATTERNS:
+            cleaned_data['pattern'] = PATTERNS[cleaned_data['mau']][1]
+        return cleaned_data
+
+    def staff_ids(self):
+        if self.cleaned_data.get('nhan_vien'):
+            return [nhan_vien.ma_nv for nhan_vien in self.cleaned_data['nhan_vien']]
+        staff = NhanVien.objects.filter(trang_thai='dang_lam')
+        if self.cleaned_data.get('vi_tri'):
+            staff = staff.filter(vi_tri=self.cleaned_data['vi_tri'])
+        return list(staff.order_by('ma_nv').values_list('ma_nv', flat=True))
+
+
 class DonDatPhongForm(forms.ModelForm):
     class Meta:
         model = DonDatPhong
@@ -187,13 +249,7 @@ class DonDatPhongForm(forms.ModelForm):
             if (ngay_tra - ngay_nhan).days > 30:
                 raise ValidationError("Không thể đặt phòng quá 30 ngày")
 
-            conflicting_bookings = DonDatPhong.objects.filter(
-                phong=phong,
-                ngay_nhan__lt=ngay_tra,
-                ngay_tra__gt=ngay_nhan,
-                trang_thai__in=['da_xac_nhan', 'da_checkin']
-            )
-            if conflicting_bookings.exists():
+            if phong and has_conflict(phong, ngay_nhan, ngay_tra, exclude_booking=self.instance.pk):
                 raise ValidationError("Phòng đã được đặt trong khoảng thời gian này")
 
         if so_luong_nguoi and phong:
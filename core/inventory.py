@@ -0,0 +1,163 @@
+# QLCSKH_LTW/core/inventory.py
+# Ghi bảng PhongNgay (phòng x đêm -> đơn đặt phòng) cùng transaction với các bước đổi trạng thái đơn.
+# Trùng lịch được phát hiện bằng ràng buộc unique (phong, ngay) thay vì quét khoảng ngày.
+from contextlib import contextmanager
+from datetime import timedelta
+from uuid import uuid4
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .cache_backend import shared_cache
+from .models import DonDatPhong, Phong, PhongNgay
+
+MAX_NIGHTS = 30  # như DonDatPhongForm
+ACCOUNT_HOLD_KEY = 'hold:account:{}'
+
+
+def iter_nights(date_in, date_out):
+    day = date_in
+    while day < date_out:
+        yield day
+        day += timedelta(days=1)
+
+
+def has_conflict(phong, date_in, date_out, exclude_booking=None):
+    nights = PhongNgay.objects.filter(phong=phong, ngay__gte=date_in, ngay__lt=date_out).filter(
+        Q(het_han__isnull=True) | Q(het_han__gt=timezone.now())
+    )
+    if exclude_booking is not None:
+        nights = nights.exclude(don_dat_phong=exclude_booking)
+    return nights.exists()
+
+
+def claim_nights(booking):
+    """Giữ các đêm của đơn. Raise IntegrityError nếu có đêm đã thuộc đơn khác."""
+    rows = [
+        PhongNgay(phong_id=booking.phong_id, ngay=ngay, don_dat_phong=booking, trang_thai=booking.trang_thai)
+        for ngay in iter_nights(booking.ngay_nhan, booking.ngay_tra)
+    ]
+    # Savepoint riêng để lỗi unique không làm hỏng transaction bên ngoài
+    with transaction.atomic():
+        PhongNgay.objects.bulk_create(rows)
+
+
+def sync_nights(booking):
+    """Đồng bộ PhongNgay theo trạng thái hiện tại của đơn (gọi sau khi đổi trang_thai)."""
+    if booking.trang_thai not in DonDatPhong.TRANG_THAI_GIU_PHONG:
+        release_nights(booking)
+        return
+    updated = PhongNgay.objects.filter(don_dat_phong=booking).update(trang_thai=booking.trang_thai)
+    if not updated:
+        # Đơn cũ tạo trước khi có bảng PhongNgay
+        claim_nights(booking)
+
+
+def release_nights(booking):
+    PhongNgay.objects.filter(don_dat_phong=booking).delete()
+
+
+@contextmanager
+def serialized_atomic(phong_id=None):
+    """transaction.atomic() tuần tự hóa các lượt ghi tồn kho phòng.
+
+    SQLite: mở transaction bằng BEGIN IMMEDIATE để lấy khóa ghi ngay từ đầu (các writer khác chờ
+    theo busy timeout thay vì lỗi "database is locked" khi nâng cấp khóa). CSDL khác: khóa dòng Phong.
+    """
+    connection = transaction.get_connection()
+    if connection.vendor == 'sqlite' and not connection.in_atomic_block:
+        connection.ensure_connection()
+        previous_mode = connection.transaction_mode
+        connection.transaction_mode = 'IMMEDIATE'
+        try:
+            with transaction.atomic():
+                connection.transaction_mode = previous_mode
+                yield
+        finally:
+            connection.transaction_mode = previous_mode
+    else:
+        with transaction.atomic():
+            if phong_id is not None:
+                list(Phong.objects.select_for_update().filter(pk=phong_id).values_list('pk', flat=True))
+            yield
+
+
+def reap_expired_holds(phong_id, date_in, date_out):
+    PhongNgay.objects.filter(
+        phong_id=phong_id, ngay__gte=date_in, ngay__lt=date_out, het_han__lte=timezone.now()
+    ).delete()
+
+
+def release_hold(ma_giu):
+    if ma_giu:
+        PhongNgay.objects.filter(ma_giu=ma_giu, don_dat_phong__isnull=True).delete()
+
+
+def place_hold(phong_id, date_in, date_out, previous_hold=None, owner_id=None):
+    """Giữ chỗ tạm các đêm trong BOOKING_HOLD_SECONDS giây. Trả về mã giữ chỗ; IntegrityError nếu đã có người giữ/đặt.
+
+    Tối đa MAX_NIGHTS đêm (ValueError nếu dài hơn). Có owner_id thì mỗi tài khoản chỉ giữ một khoảng ngày tại một
+    thời điểm: lượt giữ mới trả lại lượt trước của tài khoản đó, kể cả khi đặt từ session khác.
+    """
+    if (date_out - date_in).days > MAX_NIGHTS:
+        raise ValueError(f"Hold longer than {MAX_NIGHTS} nights")
+    ma_giu = uuid4().hex
+    het_han = timezone.now() + timedelta(seconds=settings.BOOKING_HOLD_SECONDS)
+    account_key = ACCOUNT_HOLD_KEY.format(owner_id) if owner_id is not None else None
+    with serialized_atomic(phong_id):
+        release_hold(previous_hold)
+        if account_key:
+            release_hold(shared_cache.get(account_key))
+        reap_expired_holds(phong_id, date_in, date_out)
+        rows = [
+            PhongNgay(phong_id=phong_id, ngay=ngay, trang_thai='giu_cho', ma_giu=ma_giu, het_han=het_han)
+            for ngay in iter_nights(date_in, date_out)
+        ]
+        PhongNgay.objects.bulk_create(rows)
+    if account_key:
+        shared_cache.set(account_key, ma_giu, settings.BOOKING_HOLD_SECONDS)
+    return ma_giu
+
+
+def convert_hold(booking, ma_giu):
+    """Chuyển lượt giữ chỗ thành các đêm của đơn; đêm nào không còn giữ được thì giữ mới.
+
+    Gọi bên trong serialized_atomic(). Raise IntegrityError nếu có đêm đã thuộc đơn/lượt giữ khác.
+    """
+    reap_expired_holds(booking.phong_id, booking.ngay_nhan, booking.ngay_tra)
+    nights = list(iter_nights(booking.ngay_nhan, booking.ngay_tra))
+    converted = 0
+    if ma_giu:
+        converted = PhongNgay.objects.filter(
+            ma_giu=ma_giu, phong_id=booking.phong_id, ngay__in=nights, don_dat_phong__isnull=True
+        ).update(don_dat_phong=booking, trang_thai=booking.trang_thai, ma_giu='', het_han=None)
+        release_hold(ma_giu)
+    if converted == len(nights):
+        return
+    owned = set(PhongNgay.objects.filter(don_dat_phong=booking).values_list('ngay', flat=True))
+    rows = [
+        PhongNgay(phong_id=booking.phong_id, ngay=ngay, don_dat_phong=booking, trang_thai=booking.trang_thai)
+        for ngay in nights if ngay not in owned
+    ]
+    with transaction.atomic():
+        PhongNgay.objects.bulk_create(rows)
+
+
+def expected_nights():
+    """Sinh (phong_id, ngay, ma_ddp, trang_thai) từ DonDatPhong; đêm trùng nhau thì đơn đến trước được giữ."""
+    bookings = DonDatPhong.objects.filter(
+        trang_thai__in=DonDatPhong.TRANG_THAI_GIU_PHONG
+    ).order_by('ngay_dat', 'ma_ddp').values_list('ma_ddp', 'phong_id', 'ngay_nhan', 'ngay_tra', 'trang_thai')
+    claimed = {}
+    conflicts = []
+    for ma_ddp, phong_id, ngay_nhan, ngay_tra, trang_thai in bookings.iterator(chunk_size=2000):
+        for ngay in iter_nights(ngay_nhan, ngay_tra):
+            key = (phong_id, ngay)
+            if key in claimed:
+                conflicts.append((phong_id, ngay, claimed[key][0], ma_ddp))
+                continue
+            claimed[key] = (ma_ddp, trang_thai)
+    return claimed, conflicts
+
@@ -0,0 +1,38 @@
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from core.models import DonDatPhong
+from core.rollups import backfill
+
+
+class Command(BaseCommand):
+    help = "Dựng lại bảng BaoCaoNgay (công suất, ADR, RevPAR theo ngày và loại phòng) từ dữ liệu đặt phòng"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', help='Ngày bắt đầu (YYYY-MM-DD), mặc định ngày nhận phòng sớm nhất')
+        parser.add_argument('--to', dest='date_to', help='Ngày kết thúc, không bao gồm (YYYY-MM-DD), mặc định hôm nay')
+        parser.add_argument('--batch-days', type=int, default=31)
+
+    def handle(self, *args, **options):
+        try:
+            date_from = datetime.strptime(options['date_from'], '%Y-%m-%d').date() if options['date_from'] else None
+            date_to = datetime.strptime(options['date_to'], '%Y-%m-%d').date() if options['date_to'] else None
+        except ValueError:
+            raise CommandError("Ngày không hợp lệ, dùng định dạng YYYY-MM-DD.")
+
+        if date_from is None or date_to is None:
+            bounds = DonDatPhong.objects.aggregate(first=Min('ngay_nhan'), last=Max('ngay_tra'))
+            today = timezone.now().date()
+            date_from = date_from or bounds['first'] or today
+            date_to = date_to or max(bounds['last'] or today, today) + timedelta(days=1)
+        if date_from >= date_to:
+            raise CommandError("--from phải trước --to.")
+
+        def progress(start, end, rows):
+            self.stdout.write(f"{start} -> {end}: {rows} dòng")
+
+        written = backfill(date_from, date_to, options['batch_days'], progress)
+        self.stdout.write(self.style.SUCCESS(f"Đã ghi {written} dòng BaoCaoNgay từ {date_from} đến {date_to}."))
@@ -0,0 +1,35 @@
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+from django.utils import timezone
+
+from core.models import YeuCau
+from core.sla import backfill
+
+
+class Command(BaseCommand):
+    help = ("Dựng lại SlaNgay (thời gian xử lý yêu cầu theo loại, nhân viên, ca) từ các yêu cầu đã hoàn thành. "
+            "Thời gian phản hồi không có trong lịch sử nên chỉ được ghi nhận trực tiếp.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', help='Ngày bắt đầu (YYYY-MM-DD), mặc định ngày hoàn thành sớm nhất')
+        parser.add_argument('--to', dest='date_to', help='Ngày kết thúc, không bao gồm (YYYY-MM-DD), mặc định ngày mai')
+
+    def handle(self, *args, **options):
+        try:
+            date_from = datetime.strptime(options['date_from'], '%Y-%m-%d').date() if options['date_from'] else None
+            date_to = datetime.strptime(options['date_to'], '%Y-%m-%d').date() if options['date_to'] else None
+        except ValueError:
+            raise CommandError("Ngày không hợp lệ, dùng định dạng YYYY-MM-DD.")
+
+        today = timezone.localdate()
+        if date_from is None:
+            first = YeuCau.objects.filter(tinh_trang='da_xu_ly').aggregate(first=Min('thoi_gian_hoan_thanh'))['first']
+            date_from = timezone.localdate(first) if first else today
+        date_to = date_to or today + timedelta(days=1)
+        if date_from >= date_to:
+            raise CommandError("--from phải trước --to.")
+
+        written = backfill(date_from, date_to)
+        self.stdout.write(self.style.SUCCESS(f"Đã ghi {written} dòng SlaNgay từ {date_from} đến {date_to}."))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import DonDatPhong
+from core.totals import drifted, recompute
+
+
+class Command(BaseCommand):
+    help = "Kiểm tra DonDatPhong.tong_dich_vu/tong_tien có khớp với DonDatDichVu hay không"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Tính lại tổng cho các đơn bị lệch')
+
+    def handle(self, *args, **options):
+        rows = list(drifted().values_list('ma_ddp', 'tong_dich_vu', 'tong_tien', 'gia_ddp', 'thuc_te_dich_vu'))
+        for ma_ddp, tong_dich_vu, tong_tien, gia_ddp, actual in rows:
+            self.stdout.write(
+                f"Lệch: đơn #{ma_ddp} dịch vụ {tong_dich_vu:,.0f} != {actual:,.0f}, "
+                f"tổng {tong_tien:,.0f} != {(gia_ddp or 0) + actual:,.0f}"
+            )
+
+        if not rows:
+            self.stdout.write(self.style.SUCCESS("Tổng tiền của các đơn đặt phòng khớp với dịch vụ đã đặt."))
+            return
+        if not options['fix']:
+            raise CommandError(f"{len(rows)} đơn đặt phòng lệch tổng tiền. Chạy lại với --fix để sửa.")
+        fixed = recompute(DonDatPhong.objects.filter(pk__in=drifted().values('pk')))
+        self.stdout.write(self.style.SUCCESS(f"Đã tính lại tổng tiền cho {fixed} đơn đặt phòng."))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.inventory import expected_nights
+from core.models import PhongNgay
+
+
+class Command(BaseCommand):
+    help = "Kiểm tra bảng PhongNgay có khớp với DonDatPhong hay không"
+
+    def handle(self, *args, **options):
+        expected, conflicts = expected_nights()
+        actual = {
+            (phong_id, ngay): (ma_ddp, trang_thai)
+            for phong_id, ngay, ma_ddp, trang_thai in PhongNgay.objects.filter(don_dat_phong__isnull=False).values_list(
+                'phong_id', 'ngay', 'don_dat_phong_id', 'trang_thai').iterator(chunk_size=2000)
+        }
+
+        missing = expected.keys() - actual.keys()
+        extra = actual.keys() - expected.keys()
+        mismatched = [key for key in expected.keys() & actual.keys() if expected[key] != actual[key]]
+
+        for phong_id, ngay in sorted(missing):
+            self.stdout.write(f"Thiếu: phòng {phong_id} ngày {ngay} (đơn #{expected[(phong_id, ngay)][0]})")
+        for phong_id, ngay in sorted(extra):
+            self.stdout.write(f"Thừa: phòng {phong_id} ngày {ngay} (đơn #{actual[(phong_id, ngay)][0]})")
+        for phong_id, ngay in sorted(mismatched):
+            self.stdout.write(f"Sai lệch: phòng {phong_id} ngày {ngay}: {actual[(phong_id, ngay)]} != {expected[(phong_id, ngay)]}")
+        for phong_id, ngay, kept, skipped in conflicts:
+            self.stdout.write(f"Trùng lịch: phòng {phong_id} ngày {ngay} giữa đơn #{kept} và #{skipped}")
+
+        problems = len(missing) + len(extra) + len(mismatched) + len(conflicts)
+        if problems:
+            raise CommandError(f"PhongNgay lệch {problems} dòng so với DonDatPhong. Chạy rebuild_room_nights để sửa.")
+        self.stdout.write(self.style.SUCCESS(f"PhongNgay khớp ({len(actual)} phòng-đêm)."))
@@ -0,0 +1,35 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import DonDatPhong, Phong
+from core.night_audit import run
+
+
+class Command(BaseCommand):
+    help = ("Kiểm toán cuối ngày: đối chiếu trạng thái phòng với đơn đặt phòng, gắn cảnh báo quá hạn xác nhận/"
+            "không đến/ở quá ngày trả, tạo hóa đơn còn thiếu cho các đơn đã check-out.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', dest='ngay', help='Ngày kiểm toán (YYYY-MM-DD), mặc định hôm nay')
+
+    def handle(self, *args, **options):
+        try:
+            ngay = datetime.strptime(options['ngay'], '%Y-%m-%d').date() if options['ngay'] else None
+        except ValueError:
+            raise CommandError("Ngày không hợp lệ, dùng định dạng YYYY-MM-DD.")
+
+        result = run(ngay)
+        room_labels = dict(Phong.TRANG_THAI_CHOICES)
+        flag_labels = dict(DonDatPhong.CANH_BAO_CHOICES)
+        for status, changed in result.rooms.items():
+            if changed:
+                self.stdout.write(f"Phòng chuyển sang '{room_labels[status]}': {changed}")
+        for flag, total in sorted(result.flags.items()):
+            self.stdout.write(f"Cảnh báo '{flag_labels[flag]}': {total} đơn")
+        if result.cleared:
+            self.stdout.write(f"Bỏ cảnh báo: {result.cleared} đơn")
+        self.stdout.write(self.style.SUCCESS(
+            f"Kiểm toán xong: {sum(result.rooms.values())} phòng cập nhật, "
+            f"{result.invoices} hóa đơn mới ({result.invoice_total:,.0f} VND)."
+        ))
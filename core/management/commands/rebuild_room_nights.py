@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.inventory import expected_nights
+from core.models import PhongNgay
+
+
+class Command(BaseCommand):
+    help = "Dựng lại bảng PhongNgay từ các DonDatPhong đang giữ phòng (các lượt giữ chỗ tạm sẽ bị xóa)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        claimed, conflicts = expected_nights()
+        rows = [
+            PhongNgay(phong_id=phong_id, ngay=ngay, don_dat_phong_id=ma_ddp, trang_thai=trang_thai)
+            for (phong_id, ngay), (ma_ddp, trang_thai) in claimed.items()
+        ]
+        with transaction.atomic():
+            PhongNgay.objects.all().delete()
+            PhongNgay.objects.bulk_create(rows, batch_size=options['batch_size'])
+
+        for phong_id, ngay, kept, skipped in conflicts:
+            self.stderr.write(f"Trùng lịch phòng {phong_id} ngày {ngay}: giữ đơn #{kept}, bỏ qua đơn #{skipped}")
+        self.stdout.write(self.style.SUCCESS(f"Đã ghi {len(rows)} phòng-đêm ({len(conflicts)} đêm trùng lịch)."))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core.search import DOCUMENTS, get_backend, rebuild
+
+
+class Command(BaseCommand):
+    help = "Dựng lại chỉ mục tìm kiếm không dấu (khách hàng, yêu cầu, phòng, dịch vụ)"
+
+    def handle(self, *args, **options):
+        get_backend().create_tables()
+        for model in DOCUMENTS:
+            total = rebuild(model)
+            self.stdout.write(f"{model.__name__}: {total} tài liệu")
+        self.stdout.write(self.style.SUCCESS("Đã dựng lại chỉ mục tìm kiếm."))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from core.counters import reconcile
+
+
+class Command(BaseCommand):
+    help = "Đếm lại bộ đếm trang chủ/dashboard từ DB và sửa sai lệch (chạy định kỳ bằng cron)"
+
+    def handle(self, *args, **options):
+        drift = reconcile()
+        for name, (old, value) in sorted(drift.items()):
+            self.stdout.write(f"{name}: {old} -> {value}")
+        self.stdout.write(self.style.SUCCESS(f"Đã đồng bộ bộ đếm ({len(drift)} bộ đếm lệch)."))
@@ -0,0 +1,141 @@
+# QLCSKH_LTW/core/middleware.py
+# Đếm truy vấn SQL của từng request, gom các câu cùng "dạng" để phát hiện N+1 (kèm template/dòng gây ra),
+# so với ngân sách theo tên URL khai báo cạnh urlpatterns (QUERY_BUDGETS trong ROOT_URLCONF).
+# QUERY_BUDGET_MODE = 'raise' (test): vượt ngân sách/N+1 thì raise; 'log' (production): chỉ lấy mẫu
+# QUERY_BUDGET_SAMPLE_RATE request và ghi log các trường hợp vi phạm.
+import logging
+import random
+import re
+import sys
+from collections import Counter, defaultdict
+from importlib import import_module
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+_IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+_PROJECT_DIR = str(settings.BASE_DIR)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def query_shape(sql):
+    """Dạng chuẩn hóa của câu SQL: tham số đã là %s, chỉ cần gộp danh sách IN (...) dài ngắn khác nhau."""
+    return _IN_LIST.sub('IN (...)', sql)
+
+
+def query_origin():
+    """Nơi phát sinh truy vấn: node template trong cùng đang render (template:dòng), nếu không thì dòng code của dự án."""
+    frame = sys._getframe(2)
+    code_origin = None
+    while frame is not None:
+        code = frame.f_code
+        if code.co_name == 'render_annotated' and code.co_filename.endswith(('django/template/base.py', 'django\\template\\base.py')):
+            node = frame.f_locals.get('self')
+            token = getattr(node, 'token', None)
+            origin = getattr(node, 'origin', None)
+            if token is not None and origin is not None:
+                return f"{origin.template_name or origin.name}:{token.lineno}"
+        if (code_origin is None and code.co_filename.startswith(_PROJECT_DIR)
+                and 'site-packages' not in code.co_filename and code.co_filename != __file__):
+            code_origin = f"{code.co_filename[len(_PROJECT_DIR) + 1:]}:{frame.f_lineno}"
+        frame = frame.f_back
+    return code_origin or '?'
+
+
+class QueryReport:
+    def __init__(self):
+        self.total = 0
+        self.shapes = Counter()
+        self.origins = defaultdict(Counter)
+
+    def __call__(self, execute, sql, params, many, context):
+        self.total += 1
+        shape = query_shape(sql)
+        self.shapes[shape] += 1
+        self.origins[shape][query_origin()] += 1
+        return execute(sql, params, many, context)
+
+    def repeated(self, threshold):
+        """[(dạng SQL, số lần, nơi gọi nhiều nhất)] cho các dạng lặp lại >= threshold lần."""
+        return [
+            (shape, count, self.origins[shape].most_common(1)[0][0])
+            for shape, count in self.shapes.most_common()
+            if count >= threshold
+        ]
+
+
+def query_budgets():
+    return getattr(import_module(settings.ROOT_URLCONF), 'QUERY_BUDGETS', {})
+
+
+class QueryBudgetMiddleware:
+    # Chạy được cả WSGI lẫn ASGI: dưới ASGI không ép các view async (luồng SSE request_events) qua sync_to_async.
+    # Kết nối DB gắn theo thread, mà truy vấn của request ASGI chạy trong thread của sync_to_async (thread_sensitive,
+    # cùng một thread cho cả request), nên wrapper được gắn/gỡ trong chính thread đó.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        mode = self.sampled_mode()
+        if mode is None:
+            return self.get_response(request)
+        report = QueryReport()
+        with connection.execute_wrapper(report):
+            response = self.get_response(request)
+        self.check(request, response, report, mode)
+        return response
+
+    async def __acall__(self, request):
+        mode = self.sampled_mode()
+        if mode is None:
+            return await self.get_response(request)
+        report = QueryReport()
+        await sync_to_async(lambda: connection.execute_wrappers.append(report))()
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(lambda: connection.execute_wrappers.remove(report))()
+        self.check(request, response, report, mode)
+        return response
+
+    @staticmethod
+    def sampled_mode():
+        """Chế độ cho request này, None nếu không đếm."""
+        mode = getattr(settings, 'QUERY_BUDGET_MODE', 'off')
+        if mode == 'off' or (mode == 'log' and random.random() >= getattr(settings, 'QUERY_BUDGET_SAMPLE_RATE', 0)):
+            return None
+        return mode
+
+    def check(self, request, response, report, mode):
+        request.query_report = report
+        if response.streaming:
+            # Nội dung (CSV, SSE) được sinh sau khi middleware trả về: số truy vấn lúc này chưa phải của cả request
+            return
+
+        url_name = request.resolver_match.url_name if request.resolver_match else None
+        budget = query_budgets().get(url_name)
+        repeated = report.repeated(getattr(settings, 'QUERY_BUDGET_REPEAT_THRESHOLD', 5))
+        problems = []
+        if budget is not None and report.total > budget:
+            problems.append(f"{report.total} queries > budget {budget}")
+        for shape, count, origin in repeated:
+            problems.append(f"N+1: {count}x at {origin}: {shape[:200]}")
+        if problems:
+            message = f"{request.method} {request.path} ({url_name}): " + '; '.join(problems)
+            if mode == 'raise':
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
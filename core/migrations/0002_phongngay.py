@@ -0,0 +1,50 @@
+# Generated by Django 5.2 on 2026-10-18 11:35
+
+from datetime import timedelta
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+TRANG_THAI_GIU_PHONG = ('cho_xac_nhan', 'da_xac_nhan', 'da_checkin')
+
+
+def fill_room_nights(apps, schema_editor):
+    # Đơn đã có trước bảng PhongNgay: giữ đêm như rebuild_room_nights, đêm trùng nhau thì đơn đến trước được giữ
+    DonDatPhong = apps.get_model('core', 'DonDatPhong')
+    PhongNgay = apps.get_model('core', 'PhongNgay')
+    bookings = DonDatPhong.objects.filter(trang_thai__in=TRANG_THAI_GIU_PHONG).order_by(
+        'ngay_dat', 'ma_ddp').values_list('ma_ddp', 'phong_id', 'ngay_nhan', 'ngay_tra', 'trang_thai')
+    claimed = set()
+    rows = []
+    for ma_ddp, phong_id, ngay_nhan, ngay_tra, trang_thai in bookings.iterator(chunk_size=2000):
+        ngay = ngay_nhan
+        while ngay < ngay_tra:
+            if (phong_id, ngay) not in claimed:
+                claimed.add((phong_id, ngay))
+                rows.append(PhongNgay(phong_id=phong_id, ngay=ngay, don_dat_phong_id=ma_ddp, trang_thai=trang_thai))
+            ngay += timedelta(days=1)
+    PhongNgay.objects.bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PhongNgay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ngay', models.DateField()),
+                ('trang_thai', models.CharField(choices=[('cho_xac_nhan', 'Chờ xác nhận'), ('da_xac_nhan', 'Đã xác nhận'), ('da_checkin', 'Đã check-in'), ('da_checkout', 'Đã check-out'), ('da_huy', 'Đã hủy')], max_length=20)),
+                ('don_dat_phong', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='phong_ngay', to='core.dondatphong')),
+                ('phong', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.phong')),
+            ],
+            options={
+                'unique_together': {('phong', 'ngay')},
+            },
+        ),
+        migrations.RunPython(fill_room_nights, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2 on 2026-10-18 11:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_phongngay'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='dondatdichvu',
+            index=models.Index(fields=['-ngay_su_dung'], name='ddv_ngay_su_dung_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dondatphong',
+            index=models.Index(fields=['phong', 'ngay_nhan', 'ngay_tra', 'trang_thai'], name='ddp_phong_ngay_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dondatphong',
+            index=models.Index(fields=['khach_hang', '-ngay_dat'], name='ddp_kh_ngay_dat_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dondatphong',
+            index=models.Index(fields=['trang_thai', '-ngay_dat'], name='ddp_tt_ngay_dat_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dondatphong',
+            index=models.Index(fields=['-ngay_dat'], name='ddp_ngay_dat_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lichlamviec',
+            index=models.Index(fields=['ngay_lam'], name='llv_ngay_lam_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='phong',
+            index=models.Index(fields=['trang_thai', 'loai_p', 'suc_chua'], name='phong_tt_loai_succhua_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='yeucau',
+            index=models.Index(fields=['tinh_trang', '-ngay_tao'], name='yc_tt_ngay_tao_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='yeucau',
+            index=models.Index(fields=['nhan_vien', 'tinh_trang'], name='yc_nv_tt_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='yeucau',
+            index=models.Index(fields=['-ngay_tao'], name='yc_ngay_tao_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='yeucau',
+            index=models.Index(condition=models.Q(('tinh_trang', 'cho_phan_cong')), fields=['-ngay_tao'], name='yc_cho_phan_cong_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2 on 2026-10-18 11:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_hot_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='phongngay',
+            name='het_han',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='phongngay',
+            name='ma_giu',
+            field=models.CharField(blank=True, db_index=True, max_length=32),
+        ),
+        migrations.AlterField(
+            model_name='phongngay',
+            name='don_dat_phong',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='phong_ngay', to='core.dondatphong'),
+        ),
+        migrations.AlterField(
+            model_name='phongngay',
+            name='trang_thai',
+            field=models.CharField(choices=[('cho_xac_nhan', 'Chờ xác nhận'), ('da_xac_nhan', 'Đã xác nhận'), ('da_checkin', 'Đã check-in'), ('da_checkout', 'Đã check-out'), ('da_huy', 'Đã hủy'), ('giu_cho', 'Đang giữ chỗ')], max_length=20),
+        ),
+    ]
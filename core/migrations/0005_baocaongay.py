@@ -0,0 +1,29 @@
+# Generated by Django 5.2 on 2026-10-18 11:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_phongngay_holds'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BaoCaoNgay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ngay', models.DateField()),
+                ('loai_p', models.CharField(choices=[('standard', 'Phòng Standard'), ('deluxe', 'Phòng Deluxe'), ('suite', 'Phòng Suite'), ('family', 'Phòng Gia đình')], max_length=25)),
+                ('so_phong', models.PositiveIntegerField(default=0)),
+                ('so_dem_ban', models.PositiveIntegerField(default=0)),
+                ('so_dem_huy', models.PositiveIntegerField(default=0)),
+                ('doanh_thu_phong', models.FloatField(default=0)),
+                ('doanh_thu_dich_vu', models.FloatField(default=0)),
+            ],
+            options={
+                'unique_together': {('ngay', 'loai_p')},
+            },
+        ),
+    ]
@@ -0,0 +1,75 @@
+import re
+import unicodedata
+
+from django.db import migrations
+
+# Bản chép của core/search.py tại thời điểm migration này (không import code đang chạy: core.search sau này đổi
+# thì migration vẫn dựng đúng chỉ mục cho schema lúc đó). Bảng FTS5 chỉ có trên SQLite.
+DOCUMENTS = {
+    'KhachHang': ('khach_hang', ('ten_kh', 'sdt', 'email')),
+    'YeuCau': ('yeu_cau', ('ma_yc', 'noi_dung_yc', 'khach_hang__ten_kh', 'phong__ten_p')),
+    'Phong': ('phong', ('ten_p', 'loai_p', 'mo_ta')),
+    'DichVu': ('dich_vu', ('ma_dv', 'ten_dv', 'mo_ta')),
+}
+CHUNK_SIZE = 2000
+
+_TOKEN = re.compile(r'\w+')
+_ALNUM_PARTS = re.compile(r'\d+|[^\W\d_]+')
+
+
+def fold(text):
+    text = unicodedata.normalize('NFD', str(text).lower().replace('đ', 'd'))
+    return ''.join(ch for ch in text if not unicodedata.combining(ch))
+
+
+def document_text(values):
+    tokens = []
+    for value in values:
+        if value is None or value == '':
+            continue
+        for token in _TOKEN.findall(fold(value)):
+            tokens.append(token)
+            parts = _ALNUM_PARTS.findall(token)
+            if len(parts) > 1:
+                tokens.extend(parts)
+    return ' '.join(tokens)
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for model_name, (doc, fields) in DOCUMENTS.items():
+            table = f'core_fts_{doc}'
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING fts5(body, tokenize='unicode61', prefix='2 3')"
+            )
+            cursor.execute(f"DELETE FROM {table}")
+            rows = apps.get_model('core', model_name).objects.order_by().values_list('pk', *fields)
+            batch = []
+            for pk, *values in rows.iterator(chunk_size=CHUNK_SIZE):
+                batch.append((pk, document_text(values)))
+                if len(batch) >= CHUNK_SIZE:
+                    cursor.executemany(f"INSERT INTO {table} (rowid, body) VALUES (%s, %s)", batch)
+                    batch = []
+            if batch:
+                cursor.executemany(f"INSERT INTO {table} (rowid, body) VALUES (%s, %s)", batch)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for doc, _ in DOCUMENTS.values():
+            cursor.execute(f"DROP TABLE IF EXISTS core_fts_{doc}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_baocaongay'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-18 12:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_search_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='khachhang',
+            name='email',
+            field=models.EmailField(db_index=True, max_length=254),
+        ),
+        migrations.AlterField(
+            model_name='khachhang',
+            name='sdt',
+            field=models.CharField(db_index=True, max_length=10),
+        ),
+    ]
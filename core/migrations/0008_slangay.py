@@ -0,0 +1,29 @@
+# Generated by Django 5.2 on 2026-10-18 12:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_khachhang_contact_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlaNgay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ngay', models.DateField()),
+                ('chi_so', models.CharField(choices=[('phan_hoi', 'Thời gian phản hồi'), ('xu_ly', 'Thời gian xử lý')], max_length=10)),
+                ('nhom', models.CharField(choices=[('tat_ca', 'Tất cả'), ('loai_yc', 'Loại yêu cầu'), ('nhan_vien', 'Nhân viên'), ('ca_lam', 'Ca làm')], max_length=10)),
+                ('gia_tri', models.CharField(blank=True, max_length=30)),
+                ('so_luong', models.PositiveIntegerField(default=0)),
+                ('tong_giay', models.FloatField(default=0)),
+                ('phac_thao', models.BinaryField(default=b'')),
+            ],
+            options={
+                'unique_together': {('ngay', 'chi_so', 'nhom', 'gia_tri')},
+            },
+        ),
+    ]
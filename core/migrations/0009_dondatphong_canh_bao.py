@@ -0,0 +1,22 @@
+# Generated by Django 5.2 on 2026-10-18 12:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_slangay'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dondatphong',
+            name='canh_bao',
+            field=models.CharField(blank=True, choices=[('', 'Không'), ('chua_xac_nhan', 'Quá hạn xác nhận'), ('khong_den', 'Khách không đến'), ('o_qua_han', 'Ở quá ngày trả')], default='', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='dondatphong',
+            index=models.Index(condition=models.Q(('canh_bao', ''), _negated=True), fields=['canh_bao', '-ngay_dat'], name='ddp_canh_bao_idx'),
+        ),
+    ]
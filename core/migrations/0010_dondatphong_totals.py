@@ -0,0 +1,38 @@
+# Generated by Django 5.2 on 2026-10-18 12:53
+
+from django.db import migrations, models
+from django.db.models import F, FloatField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_totals(apps, schema_editor):
+    # Như core.totals.recompute tại thời điểm migration này, trên model lịch sử
+    DonDatPhong = apps.get_model('core', 'DonDatPhong')
+    DonDatDichVu = apps.get_model('core', 'DonDatDichVu')
+    actual = Coalesce(
+        Subquery(DonDatDichVu.objects.filter(don_dat_phong=OuterRef('pk')).order_by().values('don_dat_phong')
+                 .annotate(total=Sum('thanh_tien')).values('total')),
+        Value(0.0), output_field=FloatField(),
+    )
+    DonDatPhong.objects.update(tong_dich_vu=actual, tong_tien=Coalesce(F('gia_ddp'), 0.0) + actual)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_dondatphong_canh_bao'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dondatphong',
+            name='tong_dich_vu',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='dondatphong',
+            name='tong_tien',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(fill_totals, migrations.RunPython.noop),
+    ]
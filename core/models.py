@@ -1,7 +1,7 @@
 from django.db import models
 
 # Create your models here.
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 from django.core.validators import MinValueValidator
 
@@ -31,6 +31,11 @@ class Phong(models.Model):
     suc_chua = models.PositiveIntegerField(default=2)
     tien_ich = models.TextField(blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['trang_thai', 'loai_p', 'suc_chua'], name='phong_tt_loai_succhua_idx'),
+        ]
+
     def __str__(self):
         return f"{self.ten_p} - {self.get_loai_p_display()}"
 
@@ -63,8 +68,8 @@ class KhachHang(models.Model):
     ma_kh = models.AutoField(primary_key=True) # khóa chính tự động tăng
     tai_khoan = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE) # khóa ngoại ràng buộc 1:1 với models TaiKhoan của accounts, đảm bảo khi khachhang bị xóa thì taikhoan cũng sẽ bị xóa.
     ten_kh = models.CharField(max_length=50)
-    sdt = models.CharField(max_length=10)
-    email = models.EmailField()
+    sdt = models.CharField(max_length=10, db_index=True) # chỉ mục cho tìm kiếm theo SĐT (khớp tiền tố) trên trang admin
+    email = models.EmailField(db_index=True)
     dia_chi = models.TextField()
     anh_dai_dien = models.ImageField(upload_to='khach_hang/', null=True, blank=True) # cho phép khách hàng có thể không có ảnh, và để trống không thêm ảnh vào khi tạo tài khoản.
     #upload to khach_hang có nghĩa là sẽ khi tải ảnh lên sẽ upload đến MEDIA_ROOT/khach_hang mà MEDIA_ROOT = BASE_DIR / 'media' nghĩa là ảnh sẽ được đẩy đến media/khach_hang
@@ -122,6 +127,9 @@ class LichLamViec(models.Model):
 
     class Meta:
         unique_together = ('nhan_vien', 'ngay_lam', 'ca_lam')
+        indexes = [
+            models.Index(fields=['ngay_lam'], name='llv_ngay_lam_idx'),
+        ]
 
     def __str__(self):
         return f"{self.nhan_vien.ten_nv} - {self.ngay_lam} - {self.get_ca_lam_display()}"
@@ -135,6 +143,15 @@ class DonDatPhong(models.Model):
         ('da_checkout', 'Đã check-out'),
         ('da_huy', 'Đã hủy'),
     ]
+    # Các trạng thái đơn đang giữ phòng (được ghi vào bảng PhongNgay)
+    TRANG_THAI_GIU_PHONG = ('cho_xac_nhan', 'da_xac_nhan', 'da_checkin')
+    # Cảnh báo do night audit gắn (core/night_audit.py), xóa khi đơn đổi trạng thái
+    CANH_BAO_CHOICES = [
+        ('', 'Không'),
+        ('chua_xac_nhan', 'Quá hạn xác nhận'),
+        ('khong_den', 'Khách không đến'),
+        ('o_qua_han', 'Ở quá ngày trả'),
+    ]
     ma_ddp = models.AutoField(primary_key=True)
     khach_hang = models.ForeignKey(KhachHang, on_delete=models.CASCADE)
     phong = models.ForeignKey(Phong, on_delete=models.CASCADE)
@@ -146,11 +163,60 @@ class DonDatPhong(models.Model):
     trang_thai = models.CharField(max_length=20, choices=TRANG_THAI_CHOICES, default='cho_xac_nhan')
     ghi_chu = models.TextField(blank=True)
     da_thanh_toan = models.BooleanField(default=False)
+    canh_bao = models.CharField(max_length=20, choices=CANH_BAO_CHOICES, blank=True, default='')
+    # Tổng thành tiền dịch vụ và tổng tiền (phòng + dịch vụ), cộng dồn bằng F() khi thêm/xóa dịch vụ (core/totals.py)
+    tong_dich_vu = models.FloatField(default=0)
+    tong_tien = models.FloatField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['phong', 'ngay_nhan', 'ngay_tra', 'trang_thai'], name='ddp_phong_ngay_idx'),
+            models.Index(fields=['khach_hang', '-ngay_dat'], name='ddp_kh_ngay_dat_idx'),
+            models.Index(fields=['trang_thai', '-ngay_dat'], name='ddp_tt_ngay_dat_idx'),
+            models.Index(fields=['-ngay_dat'], name='ddp_ngay_dat_idx'),
+            # Chỉ các đơn đang bị cảnh báo (số ít) cho bộ lọc "cần chú ý"
+            models.Index(fields=['canh_bao', '-ngay_dat'], name='ddp_canh_bao_idx', condition=~models.Q(canh_bao='')),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            self.tong_tien = (self.gia_ddp or 0) + (self.tong_dich_vu or 0)
+            return super().save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and not {'gia_ddp', 'tong_dich_vu', 'tong_tien'} & set(update_fields):
+            return super().save(*args, **kwargs)
+        # tong_dich_vu trên instance có thể cũ (dịch vụ vừa được thêm ở request khác): sau khi lưu tính lại tổng
+        # từ DonDatDichVu trong cùng transaction và nạp lại vào instance (core/totals.py)
+        from .totals import sync
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            sync(self)
 
     def __str__(self):
         return f"Đặt phòng #{self.ma_ddp} - {self.khach_hang.ten_kh}"
 
 
+# Tồn kho phòng theo đêm: mỗi (phòng, ngày) chỉ thuộc về tối đa một đơn đang giữ phòng
+# hoặc một lượt giữ chỗ tạm thời (bước 1 của form đặt phòng, có thời hạn het_han).
+# Bảng được ghi cùng transaction với các bước đổi trạng thái đơn (xem core/inventory.py).
+class PhongNgay(models.Model):
+    TRANG_THAI_CHOICES = DonDatPhong.TRANG_THAI_CHOICES + [
+        ('giu_cho', 'Đang giữ chỗ'),
+    ]
+    phong = models.ForeignKey(Phong, on_delete=models.CASCADE)
+    ngay = models.DateField()
+    don_dat_phong = models.ForeignKey(DonDatPhong, related_name='phong_ngay', on_delete=models.CASCADE, null=True, blank=True)
+    trang_thai = models.CharField(max_length=20, choices=TRANG_THAI_CHOICES)
+    ma_giu = models.CharField(max_length=32, blank=True, db_index=True)  # mã lượt giữ chỗ, lưu trong session
+    het_han = models.DateTimeField(null=True, blank=True)  # chỉ có với dòng giữ chỗ
+
+    class Meta:
+        unique_together = ('phong', 'ngay')
+
+    def __str__(self):
+        return f"{self.phong_id} - {self.ngay} - #{self.don_dat_phong_id}"
+
+
 class DonDatDichVu(models.Model):
     ma_ddv = models.AutoField(primary_key=True)
     don_dat_phong = models.ForeignKey(DonDatPhong, on_delete=models.CASCADE)
@@ -161,6 +227,11 @@ class DonDatDichVu(models.Model):
     thanh_tien = models.FloatField(validators=[MinValueValidator(0)]) # được tính trong phương thức save(), giá trị phải lớn hơn hoặc bằng 0.
     ghi_chu = models.TextField(blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-ngay_su_dung'], name='ddv_ngay_su_dung_idx'),
+        ]
+
     def save(self, *args, **kwargs): #ghi đè phương thức save để tính giá tiền dịch vụ
         self.thanh_tien = self.dich_vu.phi_dv * self.so_luong
         super().save(*args, **kwargs)
@@ -196,6 +267,15 @@ class YeuCau(models.Model):
     thoi_gian_hoan_thanh = models.DateTimeField(null=True, blank=True)
     ghi_chu = models.TextField(blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['tinh_trang', '-ngay_tao'], name='yc_tt_ngay_tao_idx'),
+            models.Index(fields=['nhan_vien', 'tinh_trang'], name='yc_nv_tt_idx'),
+            models.Index(fields=['-ngay_tao'], name='yc_ngay_tao_idx'),
+            # Hàng đợi yêu cầu chưa phân công trên dashboard admin
+            models.Index(fields=['-ngay_tao'], condition=models.Q(tinh_trang='cho_phan_cong'), name='yc_cho_phan_cong_idx'),
+        ]
+
     def __str__(self):
         return f"YC {self.ma_yc} - {self.get_loai_yc_display()}"
 
@@ -211,4 +291,62 @@ class HoaDon(models.Model):
     ghi_chu = models.TextField(blank=True)
 
     def __str__(self):
-        return f"Hóa đơn #{self.ma_hd} - {self.don_dat_phong}"
\ No newline at end of file
+        return f"Hóa đơn #{self.ma_hd} - {self.don_dat_phong}"
+
+
+# Số liệu tổng hợp theo ngày và loại phòng cho báo cáo công suất/ADR/RevPAR (xem core/rollups.py)
+class BaoCaoNgay(models.Model):
+    ngay = models.DateField()
+    loai_p = models.CharField(max_length=25, choices=Phong.LOAI_PHONG_CHOICES)
+    so_phong = models.PositiveIntegerField(default=0)  # số phòng thuộc loại này
+    so_dem_ban = models.PositiveIntegerField(default=0)  # số phòng-đêm đã bán (đơn đã check-out)
+    so_dem_huy = models.PositiveIntegerField(default=0)  # số phòng-đêm của các đơn bị hủy
+    doanh_thu_phong = models.FloatField(default=0)
+    doanh_thu_dich_vu = models.FloatField(default=0)
+
+    class Meta:
+        unique_together = ('ngay', 'loai_p')
+
+    def __str__(self):
+        return f"{self.ngay} - {self.get_loai_p_display()}"
+
+    @property
+    def cong_suat(self):
+        return self.so_dem_ban / self.so_phong if self.so_phong else 0
+
+    @property
+    def adr(self):
+        return self.doanh_thu_phong / self.so_dem_ban if self.so_dem_ban else 0
+
+    @property
+    def revpar(self):
+        return self.doanh_thu_phong / self.so_phong if self.so_phong else 0
+
+
+# Thời gian phản hồi/xử lý yêu cầu theo ngày và theo nhóm (loại yêu cầu, nhân viên, ca), lưu dạng phác thảo phân vị
+# gộp được (xem core/sla.py): báo cáo p50/p90/p99 cho khoảng ngày bất kỳ chỉ gộp các dòng này, không quét YeuCau
+class SlaNgay(models.Model):
+    CHI_SO_CHOICES = [
+        ('phan_hoi', 'Thời gian phản hồi'),  # tạo -> bắt đầu xử lý
+        ('xu_ly', 'Thời gian xử lý'),  # tạo -> hoàn thành
+    ]
+    NHOM_CHOICES = [
+        ('tat_ca', 'Tất cả'),
+        ('loai_yc', 'Loại yêu cầu'),
+        ('nhan_vien', 'Nhân viên'),
+        ('ca_lam', 'Ca làm'),
+    ]
+
+    ngay = models.DateField()
+    chi_so = models.CharField(max_length=10, choices=CHI_SO_CHOICES)
+    nhom = models.CharField(max_length=10, choices=NHOM_CHOICES)
+    gia_tri = models.CharField(max_length=30, blank=True)  # mã loại yêu cầu / ma_nv / ca_lam; rỗng với 'tat_ca'
+    so_luong = models.PositiveIntegerField(default=0)
+    tong_giay = models.FloatField(default=0)
+    phac_thao = models.BinaryField(default=b'')
+
+    class Meta:
+        unique_together = ('ngay', 'chi_so', 'nhom', 'gia_tri')
+
+    def __str__(self):
+        return f"{self.ngay} - {self.get_chi_so_display()} - {self.get_nhom_display()} {self.gia_tri}"
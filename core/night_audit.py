@@ -0,0 +1,87 @@
+# QLCSKH_LTW/core/night_audit.py
+# Kiểm toán cuối ngày (lệnh night_audit): đối chiếu Phong.trang_thai với DonDatPhong, gắn cảnh báo cho đơn quá hạn xác nhận,
+# khách không đến, khách ở quá ngày trả, và tạo HoaDon còn thiếu cho các đơn đã check-out.
+# Mọi bước là UPDATE/INSERT theo tập với điều kiện Exists/aggregate, nên số truy vấn không đổi theo số phòng/đơn.
+from collections import namedtuple
+
+from django.db import connection, transaction
+from django.db.models import Count, DateTimeField, Exists, OuterRef, Q, Sum, Value
+from django.utils import timezone
+
+from . import page_cache
+from .models import DonDatPhong, HoaDon, Phong
+
+AuditResult = namedtuple('AuditResult', 'rooms flags cleared invoices invoice_total')
+
+
+def flag_conditions(ngay):
+    """{cảnh báo: điều kiện trên DonDatPhong} tại ngày kiểm toán."""
+    return {
+        'chua_xac_nhan': Q(trang_thai='cho_xac_nhan', ngay_nhan__lte=ngay),
+        'khong_den': Q(trang_thai='da_xac_nhan', ngay_nhan__lte=ngay),
+        'o_qua_han': Q(trang_thai='da_checkin', ngay_tra__lte=ngay),
+    }
+
+
+def reconcile_rooms(ngay):
+    """Phòng có khách đang ở -> dang_su_dung, có đơn đã xác nhận cho đêm nay -> da_dat, còn lại -> trong (bỏ qua bao_tri).
+
+    Trả về {trạng thái: số phòng đã đổi}.
+    """
+    in_house = DonDatPhong.objects.filter(phong=OuterRef('pk'), trang_thai='da_checkin')
+    booked = DonDatPhong.objects.filter(phong=OuterRef('pk'), trang_thai='da_xac_nhan', ngay_nhan__lte=ngay, ngay_tra__gt=ngay)
+    rooms = Phong.objects.exclude(trang_thai='bao_tri')
+    return {
+        'dang_su_dung': rooms.filter(Exists(in_house)).exclude(trang_thai='dang_su_dung').update(trang_thai='dang_su_dung'),
+        'da_dat': rooms.filter(~Exists(in_house), Exists(booked)).exclude(trang_thai='da_dat').update(trang_thai='da_dat'),
+        'trong': rooms.filter(~Exists(in_house), ~Exists(booked)).exclude(trang_thai='trong').update(trang_thai='trong'),
+    }
+
+
+def flag_bookings(ngay):
+    """Gắn cảnh báo mới, bỏ cảnh báo đã hết đúng; trả về ({cảnh báo: số đơn đang bị gắn}, số đơn được bỏ cảnh báo)."""
+    conditions = flag_conditions(ngay)
+    for flag, condition in conditions.items():
+        DonDatPhong.objects.filter(condition).exclude(canh_bao=flag).update(canh_bao=flag)
+    any_flag = Q()
+    for condition in conditions.values():
+        any_flag |= condition
+    cleared = DonDatPhong.objects.exclude(canh_bao='').exclude(any_flag).update(canh_bao='')
+    flagged = dict(DonDatPhong.objects.exclude(canh_bao='').order_by().values_list('canh_bao').annotate(total=Count('pk')))
+    return flagged, cleared
+
+
+def create_missing_invoices(now=None):
+    """HoaDon (tong_tien của đơn: phòng + dịch vụ) cho mọi đơn đã check-out chưa có hóa đơn.
+
+    bulk_create trên SQLite bị chia lô theo giới hạn 999 tham số, nên ghi bằng một câu INSERT ... SELECT
+    sinh từ queryset: số truy vấn không đổi dù có hàng nghìn đơn.
+    """
+    missing = DonDatPhong.objects.filter(trang_thai='da_checkout', hoadon__isnull=True).order_by()
+    summary = missing.aggregate(invoices=Count('pk'), total=Sum('tong_tien'))
+    if not summary['invoices']:
+        return 0, 0
+    select = missing.values_list('ma_ddp', 'tong_tien').annotate(
+        ngay_tao=Value(now or timezone.now(), output_field=DateTimeField()),
+        da_thanh_toan=Value(False), phuong_thuc_tt=Value(''), ghi_chu=Value(''),
+    )
+    sql, params = select.query.sql_with_params()
+    table = HoaDon._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} (don_dat_phong_id, tong_tien, ngay_tao, da_thanh_toan, phuong_thuc_tt, ghi_chu) {sql}",
+            params,
+        )
+    return summary['invoices'], summary['total'] or 0
+
+
+def run(ngay=None):
+    """Chạy kiểm toán cho ngày ngay (mặc định hôm nay) trong một transaction."""
+    ngay = ngay or timezone.localdate()
+    with transaction.atomic():
+        rooms = reconcile_rooms(ngay)
+        flagged, cleared = flag_bookings(ngay)
+        invoices, invoice_total = create_missing_invoices()
+        if any(rooms.values()):
+            transaction.on_commit(lambda: page_cache.bump(Phong))
+    return AuditResult(rooms, flagged, cleared, invoices, invoice_total)
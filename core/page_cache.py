@@ -0,0 +1,86 @@
+# QLCSKH_LTW/core/page_cache.py
+# Cache dữ liệu của các trang công khai nhiều lượt xem (home, service_list, service_detail, RoomDetailView.get).
+# Chỉ cache dữ liệu đã truy vấn (danh sách phòng, dịch vụ, ảnh), không cache HTML: phần phụ thuộc người dùng
+# (thanh điều hướng, csrf_token, thông tin khách trong form đặt phòng) vẫn render theo từng request, nên khách
+# ẩn danh và người đã đăng nhập dùng chung một mục cache mà không lộ dữ liệu của nhau.
+# Khóa = tên trang + version của từng model liên quan + tham số GET đã chuẩn hóa. Lưu/xóa Phong, AnhPhong, DichVu
+# tăng version của model đó (core/signals.py; các chỗ dùng update() tự gọi bump()), khóa cũ không còn được đọc.
+# Version nằm trong cache 'shared' nên thay đổi từ worker khác hay lệnh quản trị cũng được thấy; dữ liệu nằm trong
+# cache 'default' của từng tiến trình.
+# Chống dồn request khi vừa đổi version: trong mỗi tiến trình một request giữ khóa dựng lại, các request khác dùng
+# bản cũ gần nhất (hoặc chờ ngắn nếu chưa có bản nào).
+import hashlib
+import logging
+import time
+
+from django.core.cache import cache
+
+from .cache_backend import new_version, shared_cache
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'page:version:{}'
+TIMEOUT = 24 * 60 * 60
+LOCK_TIMEOUT = 10  # giây; request dựng lại bị lỗi/treo thì khóa tự hết hạn
+WAIT_SECONDS = 2
+WAIT_STEP = 0.05
+
+
+def _model_key(model):
+    return VERSION_KEY.format(model._meta.label_lower)
+
+
+def versions(models):
+    keys = [_model_key(model) for model in models]
+    found = shared_cache.get_many(keys)
+    # Key chưa có/bị xóa khỏi cache: mốc thời gian để không trùng version cũ
+    missing = {key: new_version() for key in keys if key not in found}
+    if missing:
+        shared_cache.set_many(missing, None)
+        found.update(missing)
+    return tuple(found[key] for key in keys)
+
+
+def bump(*models):
+    for model in models:
+        key = _model_key(model)
+        try:
+            shared_cache.incr(key)
+        except ValueError:
+            shared_cache.set(key, new_version(), None)
+
+
+def normalize(params, allowed):
+    """Chuỗi ổn định từ các tham số GET được dùng (bỏ tham số lạ như utm_*, bỏ giá trị rỗng, sắp xếp theo tên)."""
+    return '&'.join(f"{name}={params.get(name, '').strip()}" for name in sorted(allowed) if params.get(name, '').strip())
+
+
+def get_or_build(name, models, build, params=None, allowed=()):
+    """Dữ liệu của trang `name` từ cache; thiếu thì gọi build() (chỉ một request dựng lại tại một thời điểm)."""
+    digest = hashlib.md5(normalize(params or {}, allowed).encode()).hexdigest()
+    current = versions(models)
+    key = f"page:{name}:{digest}:{'-'.join(map(str, current))}"
+    latest_key = f"page:{name}:{digest}:latest"  # (version, dữ liệu) mới nhất, dùng khi đang có request khác dựng lại
+    lock_key = f"page:{name}:{digest}:lock"
+
+    data = cache.get(key)
+    if data is not None:
+        return data
+    if not cache.add(lock_key, 1, LOCK_TIMEOUT):
+        stale = cache.get(latest_key)
+        if stale is not None:
+            return stale[1]
+        deadline = time.monotonic() + WAIT_SECONDS
+        while time.monotonic() < deadline:
+            time.sleep(WAIT_STEP)
+            data = cache.get(key)
+            if data is not None:
+                return data
+        logger.warning(f"Page cache {name} still rebuilding after {WAIT_SECONDS}s, building without lock")
+        return build()
+    try:
+        data = build()
+        cache.set_many({key: data, latest_key: (current, data)}, TIMEOUT)
+    finally:
+        cache.delete(lock_key)
+    return data
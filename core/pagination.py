@@ -0,0 +1,177 @@
+# QLCSKH_LTW/core/pagination.py
+# Phân trang theo con trỏ (keyset) cho các danh sách lớn: lọc WHERE (khóa sắp xếp, pk) < giá trị dòng cuối
+# thay vì OFFSET, nên trang thứ 5000 tốn như trang đầu. Không đếm COUNT(*) toàn bảng: tổng số lấy từ
+# bộ đếm (core/counters.py) khi có, nếu không thì đếm tối đa ESTIMATE_LIMIT dòng.
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+ESTIMATE_LIMIT = 1000
+CURSOR_PARAM = 'cursor'
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _encode(direction, ordering, values):
+    raw = json.dumps([direction, ','.join(ordering), values], separators=(',', ':'), default=str)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def _decode(token, ordering):
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        direction, token_ordering, values = json.loads(raw)
+    except (ValueError, TypeError):
+        raise InvalidCursor(token)
+    # Con trỏ của cách sắp xếp khác (vd. người dùng vừa đổi ?sort=) không dùng được
+    if direction not in ('n', 'p') or token_ordering != ','.join(ordering) or not isinstance(values, list):
+        raise InvalidCursor(token)
+    return direction, values
+
+
+class KeysetPage:
+    """Tương thích phần lớn với django.core.paginator.Page (lặp, len, has_next/has_previous, paginator.count)."""
+
+    def __init__(self, paginator, object_list, has_next, has_previous, params):
+        self.paginator = paginator
+        self.object_list = object_list
+        self._has_next = has_next
+        self._has_previous = has_previous
+        self._params = params
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    def _url(self, token=None):
+        params = self._params.copy()
+        params.pop(CURSOR_PARAM, None)
+        params.pop('page', None)
+        if token:
+            params[CURSOR_PARAM] = token
+        return '?' + params.urlencode()
+
+    @property
+    def next_token(self):
+        if not self._has_next or not self.object_list:
+            return None
+        return _encode('n', self.paginator.ordering, self.paginator.cursor_values(self.object_list[-1]))
+
+    @property
+    def previous_token(self):
+        if not self._has_previous or not self.object_list:
+            return None
+        return _encode('p', self.paginator.ordering, self.paginator.cursor_values(self.object_list[0]))
+
+    @property
+    def next_url(self):
+        return self._url(self.next_token)
+
+    @property
+    def previous_url(self):
+        return self._url(self.previous_token)
+
+    @property
+    def first_url(self):
+        return self._url()
+
+
+class KeysetPaginator:
+    """Phân trang theo `ordering` (vd. ('-ngay_dat', '-ma_ddp')); trường cuối phải là khóa duy nhất.
+
+    `total` là tổng số dòng đã biết sẵn (từ bộ đếm); để None thì đếm có giới hạn.
+    """
+    keyset = True
+
+    def __init__(self, queryset, ordering, per_page=10, total=None):
+        self.queryset = queryset
+        self.ordering = tuple(ordering)
+        self.per_page = per_page
+        self._total = total
+        self._fields = [queryset.model._meta.get_field(name.lstrip('-')) for name in self.ordering]
+
+    # ---- Tổng số (ước lượng) ----
+
+    @property
+    def count(self):
+        if self._total is None:
+            # Chỉ đếm tới ESTIMATE_LIMIT + 1 dòng
+            self._total = self.queryset.order_by()[:ESTIMATE_LIMIT + 1].count()
+        return self._total
+
+    @property
+    def count_is_estimate(self):
+        return self.count > ESTIMATE_LIMIT
+
+    @property
+    def display_count(self):
+        return f"{ESTIMATE_LIMIT}+" if self.count_is_estimate else self.count
+
+    # ---- Con trỏ ----
+
+    def cursor_values(self, obj):
+        return [field.value_to_string(obj) for field in self._fields]
+
+    def _parse_values(self, values):
+        if len(values) != len(self._fields):
+            raise InvalidCursor(values)
+        try:
+            return [field.to_python(value) for field, value in zip(self._fields, values)]
+        except (ValidationError, TypeError):
+            raise InvalidCursor(values)
+
+    def _after(self, values, reverse=False):
+        """Q cho các dòng đứng sau `values` theo ordering (hoặc đứng trước nếu reverse)."""
+        condition = Q()
+        for index, name in enumerate(self.ordering):
+            descending = name.startswith('-')
+            lookup = 'lt' if descending != reverse else 'gt'
+            step = Q(**{f"{name.lstrip('-')}__{lookup}": values[index]})
+            for previous_name, previous_value in zip(self.ordering[:index], values[:index]):
+                step &= Q(**{previous_name.lstrip('-'): previous_value})
+            condition |= step
+        return condition
+
+    def get_page(self, params):
+        """Lấy trang theo ?cursor= trong `params` (request.GET); con trỏ hỏng thì trả về trang đầu."""
+        token = params.get(CURSOR_PARAM)
+        direction, values = None, None
+        if token:
+            try:
+                direction, raw_values = _decode(token, self.ordering)
+                values = self._parse_values(raw_values)
+            except InvalidCursor:
+                direction, values = None, None
+
+        if direction == 'p':
+            reversed_ordering = [name[1:] if name.startswith('-') else f'-{name}' for name in self.ordering]
+            rows = list(self.queryset.filter(self._after(values, reverse=True)).order_by(*reversed_ordering)[:self.per_page + 1])
+            if rows:
+                return KeysetPage(self, rows[:self.per_page][::-1], True, len(rows) > self.per_page, params)
+            # Các dòng trước con trỏ đã bị xóa/lọc mất từ lúc phát con trỏ: về trang đầu như con trỏ hỏng
+            values = None
+
+        queryset = self.queryset.order_by(*self.ordering)
+        if values is not None:
+            queryset = queryset.filter(self._after(values))
+        rows = list(queryset[:self.per_page + 1])
+        # Con trỏ 'n' có thể ra trang rỗng (các dòng sau đã bị xóa): giữ nguyên để cửa sổ tải thêm không lặp lại trang đầu
+        return KeysetPage(self, rows[:self.per_page], len(rows) > self.per_page, values is not None, params)
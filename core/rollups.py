@@ -0,0 +1,169 @@
+# QLCSKH_LTW/core/rollups.py
+# Tổng hợp BaoCaoNgay (ngày x loại phòng): cập nhật dần khi check-out/hủy đơn trong process_booking,
+# lệnh backfill_daily_rollups dựng lại lịch sử theo từng đợt ngày.
+from calendar import monthrange
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+
+from .inventory import iter_nights
+from .models import BaoCaoNgay, DonDatDichVu, DonDatPhong, Phong
+
+ROLLUP_FIELDS = ('so_dem_ban', 'so_dem_huy', 'doanh_thu_phong', 'doanh_thu_dich_vu')
+
+
+def _empty_row():
+    return dict.fromkeys(ROLLUP_FIELDS, 0)
+
+
+def room_counts():
+    return dict(Phong.objects.order_by().values_list('loai_p').annotate(total=Count('pk')))
+
+
+def add_booking_nights(deltas, loai_p, ngay_nhan, ngay_tra, gia_ddp, field, date_from=None, date_to=None):
+    nights = (ngay_tra - ngay_nhan).days
+    if nights <= 0:
+        return
+    nightly_rate = (gia_ddp or 0) / nights
+    for ngay in iter_nights(ngay_nhan, ngay_tra):
+        if (date_from and ngay < date_from) or (date_to and ngay >= date_to):
+            continue
+        row = deltas[(ngay, loai_p)]
+        row[field] += 1
+        if field == 'so_dem_ban':
+            row['doanh_thu_phong'] += nightly_rate
+
+
+def apply_deltas(deltas):
+    """Cộng dồn các thay đổi vào BaoCaoNgay bằng F(), tạo dòng mới nếu chưa có."""
+    if not deltas:
+        return
+    counts = room_counts()
+    with transaction.atomic():
+        BaoCaoNgay.objects.bulk_create(
+            [BaoCaoNgay(ngay=ngay, loai_p=loai_p, so_phong=counts.get(loai_p, 0)) for ngay, loai_p in deltas],
+            ignore_conflicts=True,
+        )
+        for (ngay, loai_p), row in deltas.items():
+            changes = {field: F(field) + value for field, value in row.items() if value}
+            if changes:
+                BaoCaoNgay.objects.filter(ngay=ngay, loai_p=loai_p).update(**changes)
+
+
+def record_checkout(booking):
+    deltas = defaultdict(_empty_row)
+    loai_p = booking.phong.loai_p
+    add_booking_nights(deltas, loai_p, booking.ngay_nhan, booking.ngay_tra, booking.gia_ddp, 'so_dem_ban')
+    service_totals = booking.dondatdichvu_set.order_by().values_list('ngay_su_dung').annotate(total=Sum('thanh_tien'))
+    for ngay_su_dung, total in service_totals:
+        deltas[(ngay_su_dung, loai_p)]['doanh_thu_dich_vu'] += total or 0
+    apply_deltas(deltas)
+
+
+def record_cancellation(booking):
+    deltas = defaultdict(_empty_row)
+    add_booking_nights(deltas, booking.phong.loai_p, booking.ngay_nhan, booking.ngay_tra, booking.gia_ddp, 'so_dem_huy')
+    apply_deltas(deltas)
+
+
+def record_bulk(checkouts=(), cancellations=(), services=()):
+    """Như record_checkout/record_cancellation cho nhiều đơn, ghi một lượt.
+
+    checkouts/cancellations: (loai_p, ngay_nhan, ngay_tra, gia_ddp); services: (ngay_su_dung, loai_p, tổng tiền) của các đơn check-out.
+    """
+    deltas = defaultdict(_empty_row)
+    for loai_p, ngay_nhan, ngay_tra, gia_ddp in checkouts:
+        add_booking_nights(deltas, loai_p, ngay_nhan, ngay_tra, gia_ddp, 'so_dem_ban')
+    for loai_p, ngay_nhan, ngay_tra, gia_ddp in cancellations:
+        add_booking_nights(deltas, loai_p, ngay_nhan, ngay_tra, gia_ddp, 'so_dem_huy')
+    for ngay_su_dung, loai_p, total in services:
+        deltas[(ngay_su_dung, loai_p)]['doanh_thu_dich_vu'] += total or 0
+    apply_deltas(deltas)
+
+
+def compute_window(date_from, date_to):
+    """Tính lại số liệu cho [date_from, date_to) từ DonDatPhong/DonDatDichVu bằng 2 truy vấn gom nhóm."""
+    deltas = defaultdict(_empty_row)
+    bookings = DonDatPhong.objects.filter(
+        trang_thai__in=['da_checkout', 'da_huy'],
+        ngay_nhan__lt=date_to,
+        ngay_tra__gt=date_from,
+    ).values_list('phong__loai_p', 'ngay_nhan', 'ngay_tra', 'gia_ddp', 'trang_thai')
+    for loai_p, ngay_nhan, ngay_tra, gia_ddp, trang_thai in bookings.iterator(chunk_size=2000):
+        field = 'so_dem_ban' if trang_thai == 'da_checkout' else 'so_dem_huy'
+        add_booking_nights(deltas, loai_p, ngay_nhan, ngay_tra, gia_ddp, field, date_from, date_to)
+
+    services = DonDatDichVu.objects.filter(
+        don_dat_phong__trang_thai='da_checkout',
+        ngay_su_dung__gte=date_from,
+        ngay_su_dung__lt=date_to,
+    ).order_by().values_list('ngay_su_dung', 'don_dat_phong__phong__loai_p').annotate(total=Sum('thanh_tien'))
+    for ngay_su_dung, loai_p, total in services:
+        deltas[(ngay_su_dung, loai_p)]['doanh_thu_dich_vu'] += total or 0
+    return deltas
+
+
+def backfill(date_from, date_to, batch_days=31, progress=None):
+    """Dựng lại BaoCaoNgay cho [date_from, date_to) theo từng đợt batch_days ngày."""
+    counts = room_counts()
+    written = 0
+    start = date_from
+    while start < date_to:
+        end = min(start + timedelta(days=batch_days), date_to)
+        deltas = compute_window(start, end)
+        # Ghi đủ mọi ngày x loại phòng (kể cả ngày không có khách) để báo cáo tính được số phòng-đêm sẵn có
+        for ngay in iter_nights(start, end):
+            for loai_p in counts:
+                deltas[(ngay, loai_p)]
+        rows = [
+            BaoCaoNgay(ngay=ngay, loai_p=loai_p, so_phong=counts.get(loai_p, 0), **values)
+            for (ngay, loai_p), values in deltas.items()
+        ]
+        with transaction.atomic():
+            BaoCaoNgay.objects.filter(ngay__gte=start, ngay__lt=end).delete()
+            BaoCaoNgay.objects.bulk_create(rows, batch_size=1000)
+        written += len(rows)
+        if progress:
+            progress(start, end, len(rows))
+        start = end
+    return written
+
+
+def summarize_by_month(rows, year, counts, months=()):
+    """Gom các dòng BaoCaoNgay theo (tháng, loại phòng) và theo tháng; tính công suất, ADR, RevPAR.
+
+    Số phòng-đêm sẵn có tính theo lịch: số ngày trong tháng x số phòng (counts), ngày có dòng thì dùng so_phong
+    của dòng đó; cập nhật dần chỉ ghi ngày có phát sinh nên không thể cộng so_phong của các dòng. months: các tháng
+    phải có trong kết quả dù không có dòng nào (tháng đã qua).
+    """
+    def empty():
+        return {'phong_dem': 0, 'so_dem_ban': 0, 'so_dem_huy': 0, 'doanh_thu_phong': 0, 'doanh_thu_dich_vu': 0}
+
+    by_type = defaultdict(empty)
+    by_month = defaultdict(empty)
+    recorded = defaultdict(lambda: [0, 0])  # (tháng, loại phòng) -> [số ngày có dòng, tổng so_phong của các ngày đó]
+    for ngay, loai_p, so_phong, so_dem_ban, so_dem_huy, doanh_thu_phong, doanh_thu_dich_vu in rows:
+        recorded[(ngay.month, loai_p)][0] += 1
+        recorded[(ngay.month, loai_p)][1] += so_phong
+        for bucket in (by_type[(ngay.month, loai_p)], by_month[ngay.month]):
+            bucket['so_dem_ban'] += so_dem_ban
+            bucket['so_dem_huy'] += so_dem_huy
+            bucket['doanh_thu_phong'] += doanh_thu_phong
+            bucket['doanh_thu_dich_vu'] += doanh_thu_dich_vu
+
+    for month in set(months) | {month for month, _ in recorded}:
+        days = monthrange(year, month)[1]
+        for loai_p in set(counts) | {loai_p for m, loai_p in recorded if m == month}:
+            days_recorded, rooms_recorded = recorded.get((month, loai_p), (0, 0))
+            phong_dem = rooms_recorded + (days - days_recorded) * counts.get(loai_p, 0)
+            by_type[(month, loai_p)]['phong_dem'] += phong_dem
+            by_month[month]['phong_dem'] += phong_dem
+
+    for bucket in list(by_type.values()) + list(by_month.values()):
+        phong_dem, so_dem_ban = bucket['phong_dem'], bucket['so_dem_ban']
+        bucket['cong_suat'] = so_dem_ban * 100 / phong_dem if phong_dem else 0
+        bucket['adr'] = bucket['doanh_thu_phong'] / so_dem_ban if so_dem_ban else 0
+        bucket['revpar'] = bucket['doanh_thu_phong'] / phong_dem if phong_dem else 0
+    return by_type, by_month
@@ -0,0 +1,92 @@
+# QLCSKH_LTW/core/roster.py
+# Xếp lịch làm việc hàng loạt theo mẫu ca xoay vòng (admin_schedule_roster).
+# Mẫu là chu kỳ các ngày, mỗi ngày một ca hoặc nghỉ, vd. sáng, sáng, chiều, chiều, tối, tối, nghỉ, nghỉ.
+# Trùng (nhan_vien, ngay_lam, ca_lam) với lịch đã có được tìm bằng một truy vấn rồi bỏ qua,
+# phần còn lại bulk_create theo từng đợt; kết quả trả về kèm danh sách trùng để báo cho admin.
+import logging
+from collections import namedtuple
+from datetime import timedelta
+
+from django.db import transaction
+
+from .dispatch import bump_version as bump_dispatch_version
+from .models import LichLamViec
+from .schedule import bump_month_versions
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+OFF = 'nghi'
+
+# mã mẫu -> (tên hiển thị, chu kỳ)
+PATTERNS = {
+    'xoay_3_ca': ('Xoay 3 ca (2 sáng, 2 chiều, 2 tối, nghỉ 2)', ('sang', 'sang', 'chieu', 'chieu', 'toi', 'toi', OFF, OFF)),
+    'sang_chieu': ('Xoay sáng/chiều theo tuần (nghỉ 1 ngày/tuần)',
+                   ('sang',) * 6 + (OFF,) + ('chieu',) * 6 + (OFF,)),
+    'hanh_chinh': ('Hành chính (ca sáng, nghỉ 2 ngày/tuần)', ('sang',) * 5 + (OFF, OFF)),
+    'ca_dem': ('Ca đêm (3 tối, nghỉ 2)', ('toi', 'toi', 'toi', OFF, OFF)),
+}
+
+Assignment = namedtuple('Assignment', 'nhan_vien_id ngay_lam ca_lam')
+RosterResult = namedtuple('RosterResult', 'created conflicts')
+
+
+def parse_pattern(text):
+    """'sang,chieu,nghi' -> ('sang', 'chieu', 'nghi'); raise ValueError nếu có ca không hợp lệ."""
+    shifts = tuple(part.strip() for part in text.replace(';', ',').split(',') if part.strip())
+    valid = {code for code, _ in LichLamViec.CA_LAM_CHOICES} | {OFF}
+    invalid = [shift for shift in shifts if shift not in valid]
+    if not shifts or invalid:
+        raise ValueError(', '.join(invalid) or text)
+    return shifts
+
+
+def generate(staff_ids, date_from, date_to, pattern, stagger=True):
+    """Các ca cho [date_from, date_to] (tính cả hai đầu).
+
+    stagger: nhân viên thứ i bắt đầu lệch i ngày trong chu kỳ để các ca luôn có người.
+    """
+    days = (date_to - date_from).days + 1
+    cycle = len(pattern)
+    assignments = []
+    for position, nhan_vien_id in enumerate(staff_ids):
+        offset = position % cycle if stagger else 0
+        for day_index in range(days):
+            shift = pattern[(offset + day_index) % cycle]
+            if shift != OFF:
+                assignments.append(Assignment(nhan_vien_id, date_from + timedelta(days=day_index), shift))
+    return assignments
+
+
+def existing_keys(staff_ids, date_from, date_to):
+    """Tập (nhan_vien_id, ngay_lam, ca_lam) đã có trong khoảng ngày - một truy vấn."""
+    return set(LichLamViec.objects.filter(
+        nhan_vien_id__in=staff_ids, ngay_lam__range=[date_from, date_to],
+    ).values_list('nhan_vien_id', 'ngay_lam', 'ca_lam').iterator(chunk_size=5000))
+
+
+def apply(staff_ids, date_from, date_to, pattern, stagger=True, ghi_chu=''):
+    """Sinh và ghi lịch; trả về RosterResult(số ca đã tạo, [Assignment bị trùng])."""
+    staff_ids = list(staff_ids)
+    assignments = generate(staff_ids, date_from, date_to, pattern, stagger)
+    with transaction.atomic():
+        taken = existing_keys(staff_ids, date_from, date_to)
+        conflicts = [assignment for assignment in assignments if tuple(assignment) in taken]
+        rows = [
+            LichLamViec(nhan_vien_id=nhan_vien_id, ngay_lam=ngay_lam, ca_lam=ca_lam, ghi_chu=ghi_chu)
+            for nhan_vien_id, ngay_lam, ca_lam in assignments
+            if (nhan_vien_id, ngay_lam, ca_lam) not in taken
+        ]
+        # ignore_conflicts: phòng khi có người thêm ca xen giữa lúc đọc và lúc ghi. bulk_create khi đó không cho biết
+        # dòng nào bị bỏ, nên số ca đã tạo lấy từ số dòng trong khoảng ngay trước và sau khi ghi
+        in_range = LichLamViec.objects.filter(nhan_vien_id__in=staff_ids, ngay_lam__range=[date_from, date_to])
+        before = in_range.count()
+        LichLamViec.objects.bulk_create(rows, batch_size=BATCH_SIZE, ignore_conflicts=True)
+        created = in_range.count() - before
+        if created != len(rows):
+            logger.info(f"Roster insert skipped {len(rows) - created} shifts added concurrently")
+        # bulk_create không gửi signal: tự tăng version các tháng cho feed lịch
+        days = {row.ngay_lam for row in rows}
+        transaction.on_commit(lambda: bump_month_versions(days))
+        transaction.on_commit(bump_dispatch_version)
+    return RosterResult(created, conflicts)
@@ -0,0 +1,216 @@
+# QLCSKH_LTW/core/schedule.py
+# Lưới lịch làm việc theo tháng cho admin_schedule_management: gom các ca (LichLamViec) theo
+# (nhân viên, ngày) trong một lượt duyệt, template chỉ việc in ra từng ô thay vì lọc lại toàn bộ ca mỗi ô.
+# Feed ICS/JSON theo nhân viên hoặc bộ phận (vi_tri): ETag ghép từ version của từng tháng trong cache 'shared',
+# version tăng khi một ca của tháng đó được lưu/xóa (signals), nên client hỏi lại chỉ nhận 304 sau một lần đọc version.
+# Feed còn in tên nhân viên và lọc theo bộ phận/trạng thái của họ, nên ETag ghép thêm version danh sách nhân viên
+# (tăng khi lưu/xóa NhanVien).
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+
+from django.core import signing
+from django.utils import timezone
+
+from .cache_backend import new_version, shared_cache
+from .models import LichLamViec
+
+# ca_lam -> (class CSS, nhãn ngắn)
+SHIFT_DISPLAY = {
+    'sang': ('bg-warning text-dark', 'Sáng: 7h00-15h00'),
+    'chieu': ('bg-info text-dark', 'Chiều: 15h00-23h00'),
+    'toi': ('bg-danger text-white', 'Tối: 23h00-7h00'),
+}
+SHIFT_ORDER = {ca_lam: index for index, (ca_lam, _) in enumerate(LichLamViec.CA_LAM_CHOICES)}
+
+
+def month_weeks(first_day, last_day):
+    """Các tuần (thứ 2 -> chủ nhật) của tháng; ô ngoài tháng là None."""
+    weeks = []
+    week = [None] * first_day.weekday()
+    day = first_day
+    while day <= last_day:
+        if len(week) == 7:
+            weeks.append(week)
+            week = []
+        week.append(day)
+        day += timedelta(days=1)
+    if week:
+        weeks.append(week + [None] * (7 - len(week)))
+    return weeks
+
+
+def shifts_by_staff_day(schedules):
+    """{(ma_nv, ngày): [ca]} từ queryset LichLamViec, đọc bằng một truy vấn values()."""
+    grid = defaultdict(list)
+    rows = schedules.order_by().values('ma_lich', 'nhan_vien_id', 'ngay_lam', 'ca_lam', 'ghi_chu')
+    for row in rows:
+        css, label = SHIFT_DISPLAY.get(row['ca_lam'], SHIFT_DISPLAY['toi'])
+        row['css'], row['label'] = css, label
+        grid[(row['nhan_vien_id'], row['ngay_lam'])].append(row)
+    for shifts in grid.values():
+        shifts.sort(key=lambda row: SHIFT_ORDER.get(row['ca_lam'], len(SHIFT_ORDER)))
+    return grid
+
+
+def _fill(weeks, shifts_for_day):
+    return [[(day, shifts_for_day(day) if day else []) for day in week] for week in weeks]
+
+
+def staff_grid(staff, schedules, weeks):
+    """[(nhân viên, tuần -> [(ngày, [ca])])] cho bảng của admin: mỗi nhân viên một khối tuần."""
+    grid = shifts_by_staff_day(schedules)
+    return [(employee, _fill(weeks, lambda day: grid.get((employee.ma_nv, day), []))) for employee in staff]
+
+
+def calendar_grid(schedules, weeks):
+    """Tuần -> [(ngày, [ca])] gộp mọi ca của các nhân viên trong schedules (lịch của chính nhân viên)."""
+    by_day = defaultdict(list)
+    for (_, day), shifts in shifts_by_staff_day(schedules).items():
+        by_day[day].extend(shifts)
+    return _fill(weeks, lambda day: by_day.get(day, []))
+
+
+# ---- Feed lịch làm việc ----
+
+MONTH_VERSION_KEY = 'schedule:month:{}'
+STAFF_VERSION_KEY = 'schedule:staff'
+FEED_SALT = 'core.schedule.feed'
+FEED_MONTHS_BEFORE = 1
+FEED_MONTHS_AFTER = 2
+
+# ca_lam -> (giờ bắt đầu, số giờ)
+SHIFT_TIMES = {
+    'sang': (time(7, 0), 8),
+    'chieu': (time(15, 0), 8),
+    'toi': (time(23, 0), 8),
+}
+
+
+def month_key(day):
+    return f"{day.year:04d}-{day.month:02d}"
+
+
+def add_months(day, months):
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _versions(keys):
+    """{key: version} đọc bằng một get_many; key bị xóa khỏi cache thì lấy mốc thời gian."""
+    found = shared_cache.get_many(keys)
+    missing = {key: new_version() for key in keys if key not in found}
+    if missing:
+        shared_cache.set_many(missing, None)
+        found.update(missing)
+    return found
+
+
+def month_versions(months):
+    """{'YYYY-MM': version} cho các tháng (ngày đầu tháng)."""
+    keys = {MONTH_VERSION_KEY.format(month_key(month)): month_key(month) for month in months}
+    found = _versions(list(keys))
+    return {month: found[key] for key, month in keys.items()}
+
+
+def feed_versions(months):
+    """(version từng tháng như month_versions, version danh sách nhân viên) cho ETag feed, cùng một lượt đọc."""
+    keys = {MONTH_VERSION_KEY.format(month_key(month)): month_key(month) for month in months}
+    found = _versions(list(keys) + [STAFF_VERSION_KEY])
+    return {month: found[key] for key, month in keys.items()}, found[STAFF_VERSION_KEY]
+
+
+def _bump(key):
+    try:
+        shared_cache.incr(key)
+    except ValueError:
+        shared_cache.set(key, new_version(), None)
+
+
+def bump_month_versions(days):
+    """Tăng version của các tháng chứa `days` (sau khi lưu/xóa/tạo hàng loạt ca)."""
+    for month in {month_key(day) for day in days if day}:
+        _bump(MONTH_VERSION_KEY.format(month))
+
+
+def bump_staff_version():
+    """Sau khi lưu/xóa NhanVien: đổi tên, bộ phận, trạng thái làm việc đều đổi nội dung feed."""
+    _bump(STAFF_VERSION_KEY)
+
+
+def feed_token(scope, value):
+    """Token ký sẵn cho URL feed: scope 'nv' (ma_nv) hoặc 'bp' (vi_tri). Ứng dụng lịch không đăng nhập được."""
+    return signing.Signer(salt=FEED_SALT).sign(f"{scope}.{value}")
+
+
+def read_feed_token(token):
+    """(scope, value) hoặc None nếu token sai chữ ký."""
+    try:
+        scope, _, value = signing.Signer(salt=FEED_SALT).unsign(token).partition('.')
+    except signing.BadSignature:
+        return None
+    if scope not in ('nv', 'bp') or not value:
+        return None
+    return scope, value
+
+
+def feed_months(month=None):
+    """Các tháng của feed: chỉ `month` nếu có, mặc định từ tháng trước tới 2 tháng sau."""
+    if month is not None:
+        return [month]
+    this_month = timezone.localdate().replace(day=1)
+    return [add_months(this_month, offset) for offset in range(-FEED_MONTHS_BEFORE, FEED_MONTHS_AFTER + 1)]
+
+
+def feed_shifts(scope, value, months):
+    schedules = LichLamViec.objects.filter(
+        ngay_lam__gte=months[0], ngay_lam__lt=add_months(months[-1], 1),
+    )
+    if scope == 'nv':
+        schedules = schedules.filter(nhan_vien_id=value)
+    else:
+        schedules = schedules.filter(nhan_vien__vi_tri=value, nhan_vien__trang_thai='dang_lam')
+    rows = schedules.order_by('ngay_lam', 'nhan_vien_id').values(
+        'ma_lich', 'nhan_vien_id', 'nhan_vien__ten_nv', 'ngay_lam', 'ca_lam', 'ghi_chu',
+    )
+    shifts = []
+    for row in rows:
+        start_time, hours = SHIFT_TIMES.get(row['ca_lam'], SHIFT_TIMES['sang'])
+        row['bat_dau'] = timezone.make_aware(datetime.combine(row['ngay_lam'], start_time))
+        row['ket_thuc'] = row['bat_dau'] + timedelta(hours=hours)
+        row['label'] = SHIFT_DISPLAY.get(row['ca_lam'], SHIFT_DISPLAY['toi'])[1]
+        shifts.append(row)
+    return shifts
+
+
+def _ics_escape(text):
+    return str(text).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def _ics_time(value):
+    return value.astimezone(dt_timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def to_ics(shifts, name):
+    stamp = _ics_time(timezone.now())
+    lines = [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//QLCSKH//Lich lam viec//VI',
+        'CALSCALE:GREGORIAN',
+        f'X-WR-CALNAME:{_ics_escape(name)}',
+    ]
+    for shift in shifts:
+        summary = f"{shift['nhan_vien__ten_nv']} - {shift['label']}"
+        lines += [
+            'BEGIN:VEVENT',
+            f"UID:lich-{shift['ma_lich']}@qlcskh",
+            f'DTSTAMP:{stamp}',
+            f"DTSTART:{_ics_time(shift['bat_dau'])}",
+            f"DTEND:{_ics_time(shift['ket_thuc'])}",
+            f'SUMMARY:{_ics_escape(summary)}',
+        ]
+        if shift['ghi_chu']:
+            lines.append(f"DESCRIPTION:{_ics_escape(shift['ghi_chu'])}")
+        lines.append('END:VEVENT')
+    lines.append('END:VCALENDAR')
+    return '\r\n'.join(lines) + '\r\n'
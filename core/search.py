@@ -0,0 +1,230 @@
+# QLCSKH_LTW/core/search.py
+# Tìm kiếm toàn văn không dấu cho KhachHang, YeuCau, Phong, DichVu.
+# Mỗi model có một "tài liệu" ghép từ các trường trong DOCUMENTS, đã bỏ dấu (fold) trước khi đưa vào chỉ mục,
+# nên "nguyen" khớp "Nguyễn". Chỉ mục được cập nhật qua signals (core/signals.py) cùng transaction với lần lưu;
+# lệnh rebuild_search_index dựng lại sau khi nạp dữ liệu bằng bulk_create/update.
+# Backend chọn bằng settings.SEARCH_BACKEND: SQLite dùng FTS5, CSDL khác mặc định quay về icontains.
+import re
+import unicodedata
+from functools import reduce
+from operator import and_, or_
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+from .models import DichVu, KhachHang, Phong, YeuCau
+
+# model -> (tên tài liệu, các trường/đường dẫn quan hệ được đánh chỉ mục)
+DOCUMENTS = {
+    KhachHang: ('khach_hang', ('ten_kh', 'sdt', 'email')),
+    YeuCau: ('yeu_cau', ('ma_yc', 'noi_dung_yc', 'khach_hang__ten_kh', 'phong__ten_p')),
+    Phong: ('phong', ('ten_p', 'loai_p', 'mo_ta')),
+    DichVu: ('dich_vu', ('ma_dv', 'ten_dv', 'mo_ta')),
+}
+
+# Lưu model này thì phải đánh chỉ mục lại các tài liệu khác có chứa trường của nó
+DEPENDENTS = {
+    KhachHang: ((YeuCau, 'khach_hang'),),
+    Phong: ((YeuCau, 'phong'),),
+}
+
+RANK_LIMIT = 500
+REBUILD_CHUNK_SIZE = 2000
+
+_TOKEN = re.compile(r'\w+')
+_ALNUM_PARTS = re.compile(r'\d+|[^\W\d_]+')
+
+
+def fold(text):
+    """Chữ thường, bỏ dấu tiếng Việt (kể cả đ -> d)."""
+    text = unicodedata.normalize('NFD', str(text).lower().replace('đ', 'd'))
+    return ''.join(ch for ch in text if not unicodedata.combining(ch))
+
+
+def tokenize(text):
+    return _TOKEN.findall(fold(text))
+
+
+def document_text(values):
+    """Ghép giá trị các trường thành văn bản đã fold; token lẫn chữ/số (P101) thêm cả từng phần (p, 101)."""
+    tokens = []
+    for value in values:
+        if value is None or value == '':
+            continue
+        for token in tokenize(value):
+            tokens.append(token)
+            parts = _ALNUM_PARTS.findall(token)
+            if len(parts) > 1:
+                tokens.extend(parts)
+    return ' '.join(tokens)
+
+
+def document_rows(queryset, fields):
+    """(pk, văn bản) cho các đối tượng trong queryset, đọc bằng một truy vấn values_list theo từng đợt."""
+    rows = queryset.order_by().values_list('pk', *fields).iterator(chunk_size=REBUILD_CHUNK_SIZE)
+    for pk, *values in rows:
+        yield pk, document_text(values)
+
+
+class SQLiteFTSBackend:
+    """Một bảng FTS5 cho mỗi tài liệu, rowid = pk của đối tượng; xếp hạng bằng bm25 (cột rank)."""
+
+    def table(self, doc):
+        return f'core_fts_{doc}'
+
+    def match_expression(self, query):
+        tokens = tokenize(query)
+        if not tokens:
+            return None
+        # Mọi từ đều phải khớp, mỗi từ khớp theo tiền tố (gõ dở "nguy" vẫn ra "nguyen")
+        return ' '.join(f'"{token}"*' for token in tokens)
+
+    def create_tables(self, schema_connection=None):
+        with (schema_connection or connection).cursor() as cursor:
+            for doc, _ in DOCUMENTS.values():
+                cursor.execute(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table(doc)} "
+                    f"USING fts5(body, tokenize='unicode61', prefix='2 3')"
+                )
+
+    def drop_tables(self, schema_connection=None):
+        with (schema_connection or connection).cursor() as cursor:
+            for doc, _ in DOCUMENTS.values():
+                cursor.execute(f"DROP TABLE IF EXISTS {self.table(doc)}")
+
+    def index(self, doc, rows, replace=True):
+        rows = list(rows)
+        if not rows:
+            return
+        with connection.cursor() as cursor:
+            if replace:
+                cursor.executemany(f"DELETE FROM {self.table(doc)} WHERE rowid = %s", [(pk,) for pk, _ in rows])
+            cursor.executemany(f"INSERT INTO {self.table(doc)} (rowid, body) VALUES (%s, %s)", rows)
+
+    def remove(self, doc, pks):
+        with connection.cursor() as cursor:
+            cursor.executemany(f"DELETE FROM {self.table(doc)} WHERE rowid = %s", [(pk,) for pk in pks])
+
+    def clear(self, doc):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table(doc)}")
+
+    def filter(self, queryset, doc, query):
+        match = self.match_expression(query)
+        if match is None:
+            return queryset.none()
+        table = self.table(doc)
+        return queryset.filter(pk__in=RawSQL(f"SELECT rowid FROM {table} WHERE {table} MATCH %s", (match,)))
+
+    def ranked_ids(self, doc, query, limit=RANK_LIMIT):
+        match = self.match_expression(query)
+        if match is None:
+            return []
+        table = self.table(doc)
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT rowid FROM {table} WHERE {table} MATCH %s ORDER BY rank LIMIT %s", (match, limit))
+            return [row[0] for row in cursor.fetchall()]
+
+
+class IContainsBackend:
+    """Dự phòng cho CSDL không có FTS: icontains trên từng từ (vẫn phân biệt dấu), không xếp hạng."""
+
+    def create_tables(self, schema_connection=None):
+        pass
+
+    drop_tables = create_tables
+
+    def index(self, doc, rows, replace=True):
+        pass
+
+    def remove(self, doc, pks):
+        pass
+
+    def clear(self, doc):
+        pass
+
+    def filter(self, queryset, doc, query):
+        words = query.split()
+        if not words:
+            return queryset.none()
+        _, fields = DOCUMENTS[queryset.model]
+        return queryset.filter(reduce(and_, (
+            reduce(or_, (Q(**{f'{field}__icontains': word}) for field in fields)) for word in words
+        )))
+
+    def ranked_ids(self, doc, query, limit=RANK_LIMIT):
+        return None
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        default = 'core.search.SQLiteFTSBackend' if connection.vendor == 'sqlite' else 'core.search.IContainsBackend'
+        _backend = import_string(getattr(settings, 'SEARCH_BACKEND', default))()
+    return _backend
+
+
+# ---- API dùng trong views ----
+
+def search_filter(queryset, query):
+    """Lọc queryset theo chỉ mục, giữ nguyên thứ tự sắp xếp đang có (dùng cho danh sách phân trang theo ngày)."""
+    doc, _ = DOCUMENTS[queryset.model]
+    return get_backend().filter(queryset, doc, query)
+
+
+def search_ranked(queryset, query, limit=RANK_LIMIT):
+    """Lọc và sắp xếp theo độ liên quan (tối đa `limit` kết quả tốt nhất)."""
+    doc, _ = DOCUMENTS[queryset.model]
+    backend = get_backend()
+    ids = backend.ranked_ids(doc, query, limit)
+    if ids is None:
+        return backend.filter(queryset, doc, query)
+    if not ids:
+        return queryset.none()
+    ordering = Case(*[When(pk=pk, then=Value(position)) for position, pk in enumerate(ids)], output_field=IntegerField())
+    return queryset.filter(pk__in=ids).annotate(search_rank=ordering).order_by('search_rank')
+
+
+def search_related(query, **relations):
+    """Q khớp khi một trong các quan hệ (tên trường=model) khớp chỉ mục, vd. search_related(q, khach_hang=KhachHang)."""
+    return reduce(or_, (
+        Q(**{f'{field}__in': search_filter(model._default_manager.all(), query)}) for field, model in relations.items()
+    ))
+
+
+def index_objects(model, pks):
+    doc, fields = DOCUMENTS[model]
+    get_backend().index(doc, document_rows(model._default_manager.filter(pk__in=pks), fields))
+
+
+def remove_objects(model, pks):
+    doc, _ = DOCUMENTS[model]
+    get_backend().remove(doc, pks)
+
+
+def rebuild(model, progress=None, queryset=None):
+    """Xóa và đánh chỉ mục lại toàn bộ tài liệu của model (queryset: dùng model lịch sử trong migration)."""
+    doc, fields = DOCUMENTS[model]
+    backend = get_backend()
+    backend.clear(doc)
+    queryset = model._default_manager.all() if queryset is None else queryset
+    batch, total = [], 0
+    for row in document_rows(queryset, fields):
+        batch.append(row)
+        if len(batch) >= REBUILD_CHUNK_SIZE:
+            backend.index(doc, batch, replace=False)
+            total += len(batch)
+            batch = []
+            if progress:
+                progress(doc, total)
+    backend.index(doc, batch, replace=False)
+    total += len(batch)
+    if progress:
+        progress(doc, total)
+    return total
@@ -0,0 +1,204 @@
+# QLCSKH_LTW/core/search_query.py
+# Cú pháp tìm kiếm chung cho các ô tìm kiếm trang admin. Mỗi từ khóa được dịch thành một điều kiện có chỉ mục,
+# phần còn lại mới đi qua tìm kiếm toàn văn (core/search.py):
+#   #1234             -> mã (khóa chính)
+#   0912345678 / 0912 -> số điện thoại (10 số = khớp đúng, bắt đầu bằng 0 và >= 4 số = khớp tiền tố)
+#   an@gmail.com      -> email (khớp đúng; "@gmail.com" = theo tên miền)
+#   room:P101  status:da_checkin  type:deluxe  from:2026-10-01  to:2026-10-31
+# Mỗi trang khai báo một SCHEMA: loại từ khóa -> trường cần lọc; từ khóa trang đó không hỗ trợ thì coi là chữ thường.
+import re
+import shlex
+from collections import namedtuple
+from datetime import datetime, time, timedelta
+
+from django.db.models import DateTimeField, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import DichVu, DonDatPhong, KhachHang, NhanVien, Phong, YeuCau
+from .search import fold, search_filter, search_ranked, search_related
+
+Term = namedtuple('Term', 'kind value')
+
+# Tên khóa (cả tiếng Việt không dấu) -> loại từ khóa
+KEYS = {
+    'id': 'id', 'ma': 'id',
+    'sdt': 'phone', 'phone': 'phone',
+    'email': 'email',
+    'room': 'room', 'phong': 'room',
+    'status': 'status', 'tt': 'status', 'trang_thai': 'status',
+    'type': 'type', 'loai': 'type',
+    'from': 'from', 'tu': 'from',
+    'to': 'to', 'den': 'to',
+}
+
+# re.ASCII: \d mặc định khớp cả chữ số Unicode (vd. '٣'), không có trong mã/SĐT
+_PK = re.compile(r'#(\d+)$', re.ASCII)
+_PHONE = re.compile(r'0\d{3,9}$', re.ASCII)
+_EMAIL = re.compile(r'[^@\s]*@[^@\s]+$')
+
+
+def _split(query):
+    try:
+        return shlex.split(query)
+    except ValueError:
+        # Dấu nháy không đóng: tách theo khoảng trắng
+        return query.split()
+
+
+def parse(query):
+    """Tách chuỗi tìm kiếm thành ([Term], phần chữ còn lại)."""
+    terms, words = [], []
+    for token in _split(query or ''):
+        key, sep, value = token.partition(':')
+        if sep and value and fold(key) in KEYS:
+            terms.append(Term(KEYS[fold(key)], value))
+        elif _PK.match(token):
+            terms.append(Term('id', _PK.match(token).group(1)))
+        elif _PHONE.match(token):
+            terms.append(Term('phone', token))
+        elif _EMAIL.match(token):
+            terms.append(Term('email', token))
+        else:
+            words.append(token)
+    return terms, ' '.join(words)
+
+
+def _prefix_range(field, prefix):
+    """field bắt đầu bằng prefix, viết dạng khoảng >= / < để dùng được chỉ mục B-tree (LIKE thì không)."""
+    return Q(**{f'{field}__gte': prefix, f'{field}__lt': prefix[:-1] + chr(ord(prefix[-1]) + 1)})
+
+
+def _choice_codes(value, choices):
+    """Mã lựa chọn khớp value: đúng mã, hoặc mã/nhãn (bỏ dấu) chứa value, vd. "checkin" -> da_checkin."""
+    value = fold(value).replace(' ', '_')
+    codes = [code for code, _ in choices]
+    if value in codes:
+        return [value]
+    return [code for code, label in choices if value in code or value in fold(label).replace(' ', '_')]
+
+
+def _date_condition(model, field, value, upper):
+    try:
+        day = parse_date(value) if re.match(r'\d{4}-\d{2}-\d{2}$', value) else None
+    except ValueError:
+        # Đúng dạng nhưng không có ngày đó (vd. 2026-13-45): coi như chữ thường
+        day = None
+    if day is None:
+        return None
+    if upper:
+        day += timedelta(days=1)
+    if isinstance(model._meta.get_field(field), DateTimeField):
+        # So với mốc nửa đêm theo giờ địa phương thay vì __date để dùng chỉ mục trên cột datetime
+        day = timezone.make_aware(datetime.combine(day, time.min))
+    return Q(**{f'{field}__lt' if upper else f'{field}__gte': day})
+
+
+def is_number(value):
+    """Chỉ gồm chữ số 0-9: str.isdigit() nhận cả '²', '٣' mà int() hoặc DB không hiểu."""
+    return value.isascii() and value.isdigit()
+
+
+def compile_term(term, schema, model):
+    """Q cho một từ khóa theo schema của trang; None nếu trang không hỗ trợ hoặc giá trị không hợp lệ."""
+    kind, value = term
+    field = schema.get('from' if kind == 'to' else kind)
+    if field is None:
+        return None
+    if kind == 'id':
+        return Q(pk=int(value)) if is_number(value) else None
+    if kind == 'phone':
+        if not is_number(value):
+            return None
+        return Q(**{field: value}) if len(value) == 10 else _prefix_range(field, value)
+    if kind == 'email':
+        if value.startswith('@'):
+            return Q(**{f'{field}__iendswith': value})
+        # Email lưu như người dùng nhập; thử cả dạng chữ thường
+        return Q(**{f'{field}__in': {value, value.lower()}})
+    if kind == 'room':
+        return Q(**{f'{field}__in': {value, value.upper()}})
+    if kind in ('status', 'type'):
+        field, choices = field
+        codes = _choice_codes(value, choices)
+        return Q(**{f'{field}__in': codes}) if codes else None
+    if kind in ('from', 'to'):
+        return _date_condition(model, field, value, upper=(kind == 'to'))
+    return None
+
+
+def apply_search(queryset, query, schema):
+    """Lọc queryset theo chuỗi tìm kiếm; từ khóa không dịch được gộp vào phần chữ cho schema['text']."""
+    terms, text = parse(query)
+    leftovers = [text] if text else []
+    for term in terms:
+        condition = compile_term(term, schema, queryset.model)
+        if condition is None:
+            leftovers.append(term.value)
+        else:
+            queryset = queryset.filter(condition)
+    text = ' '.join(leftovers)
+    if not text:
+        return queryset
+    if 'id' in schema and not terms and is_number(text):
+        # Chỉ gõ một con số: có thể là mã hoặc nằm trong nội dung
+        matches = schema['text'](queryset.model._default_manager.all(), text).values('pk')
+        return queryset.filter(Q(pk=int(text)) | Q(pk__in=matches))
+    return schema['text'](queryset, text)
+
+
+# ---- Schema cho từng trang danh sách ----
+
+def _related_text(**relations):
+    return lambda queryset, text: queryset.filter(search_related(text, **relations))
+
+
+def _staff_text(queryset, text):
+    # NhanVien chưa có trong chỉ mục toàn văn
+    return queryset.filter(Q(ten_nv__icontains=text) | Q(sdt__icontains=text) | Q(email__icontains=text))
+
+
+CUSTOMER_SCHEMA = {
+    'id': 'ma_kh', 'phone': 'sdt', 'email': 'email',
+    'text': search_filter,
+}
+
+REQUEST_SCHEMA = {
+    'id': 'ma_yc', 'phone': 'khach_hang__sdt', 'email': 'khach_hang__email', 'room': 'phong__ten_p',
+    'status': ('tinh_trang', YeuCau.TINH_TRANG_CHOICES), 'type': ('loai_yc', YeuCau.LOAI_YC_CHOICES),
+    'from': 'ngay_tao',
+    'text': search_filter,
+}
+
+BOOKING_SCHEMA = {
+    'id': 'ma_ddp', 'phone': 'khach_hang__sdt', 'email': 'khach_hang__email', 'room': 'phong__ten_p',
+    'status': ('trang_thai', DonDatPhong.TRANG_THAI_CHOICES), 'type': ('phong__loai_p', Phong.LOAI_PHONG_CHOICES),
+    'from': 'ngay_nhan',
+    'text': _related_text(khach_hang=KhachHang, phong=Phong),
+}
+
+SERVICE_BOOKING_SCHEMA = {
+    'id': 'ma_ddv', 'phone': 'don_dat_phong__khach_hang__sdt', 'email': 'don_dat_phong__khach_hang__email',
+    'room': 'don_dat_phong__phong__ten_p',
+    'status': ('don_dat_phong__trang_thai', DonDatPhong.TRANG_THAI_CHOICES),
+    'from': 'ngay_su_dung',
+    'text': _related_text(don_dat_phong__khach_hang=KhachHang, dich_vu=DichVu, don_dat_phong__phong=Phong),
+}
+
+ROOM_SCHEMA = {
+    'id': 'ma_p', 'room': 'ten_p',
+    'status': ('trang_thai', Phong.TRANG_THAI_CHOICES), 'type': ('loai_p', Phong.LOAI_PHONG_CHOICES),
+    'text': search_ranked,
+}
+
+SERVICE_SCHEMA = {
+    'id': 'ma_dv',
+    'text': search_ranked,
+}
+
+STAFF_SCHEMA = {
+    'id': 'ma_nv', 'phone': 'sdt', 'email': 'email',
+    'status': ('trang_thai', NhanVien.TRANG_THAI_CHOICES), 'type': ('vi_tri', NhanVien.VI_TRI_CHOICES),
+    'from': 'ngay_vao_lam',
+    'text': _staff_text,
+}
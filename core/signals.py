@@ -0,0 +1,221 @@
+# QLCSKH_LTW/core/signals.py
+from django.db import transaction
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+
+from . import counters, dispatch, events, page_cache, search, totals
+from .availability import availability_index, bump_room_version
+from .models import AnhPhong, DichVu, DonDatDichVu, DonDatPhong, KhachHang, LichLamViec, NhanVien, Phong, YeuCau
+from .schedule import bump_month_versions, bump_staff_version
+from .typeahead import customer_index
+
+
+# Đồng bộ chỉ mục phòng trống sau khi transaction commit (rollback thì không đổi gì)
+@receiver(post_save, sender=DonDatPhong)
+def sync_availability_on_booking_save(sender, instance, **kwargs):
+    def apply():
+        availability_index.apply_booking(
+            instance.ma_ddp, instance.phong_id, instance.ngay_nhan, instance.ngay_tra, instance.trang_thai
+        )
+        bump_room_version(instance.phong_id)
+    transaction.on_commit(apply)
+
+
+@receiver(post_delete, sender=DonDatPhong)
+def sync_availability_on_booking_delete(sender, instance, **kwargs):
+    ma_ddp, phong_id = instance.ma_ddp, instance.phong_id
+
+    def apply():
+        availability_index.remove_booking(ma_ddp)
+        bump_room_version(phong_id)
+    transaction.on_commit(apply)
+
+
+# Bộ đếm cho trang chủ/dashboard: nhớ trạng thái lúc nạp để biết trạng thái cũ khi lưu
+def remember_counted_status(sender, instance, **kwargs):
+    status_field = counters.TRACKED_MODELS[sender][1]
+    # Đọc từ __dict__ để không phát sinh truy vấn khi trường bị defer (.only()/.defer())
+    instance._counted_status = instance.__dict__.get(status_field) if instance.pk else None
+
+
+def count_on_save(sender, instance, created, **kwargs):
+    name, status_field = counters.TRACKED_MODELS[sender]
+    changes = {}
+    if created:
+        changes[name] = 1
+    if status_field:
+        old_status = None if created else getattr(instance, '_counted_status', None)
+        new_status = getattr(instance, status_field)
+        # Không biết trạng thái cũ (trường bị defer khi nạp) thì để reconcile_counters sửa
+        if old_status != new_status and (created or old_status):
+            if old_status:
+                changes[counters.counter_name(name, old_status)] = -1
+            changes[counters.counter_name(name, new_status)] = 1
+        instance._counted_status = new_status
+    if changes:
+        transaction.on_commit(lambda: counters.adjust_many(changes))
+
+
+def count_on_delete(sender, instance, **kwargs):
+    name, status_field = counters.TRACKED_MODELS[sender]
+    changes = {name: -1}
+    if status_field:
+        changes[counters.counter_name(name, getattr(instance, status_field))] = -1
+    transaction.on_commit(lambda: counters.adjust_many(changes))
+
+
+for counted_model, (_, counted_status_field) in counters.TRACKED_MODELS.items():
+    if counted_status_field:
+        post_init.connect(remember_counted_status, sender=counted_model, dispatch_uid=f'counters_init_{counted_model.__name__}')
+    post_save.connect(count_on_save, sender=counted_model, dispatch_uid=f'counters_save_{counted_model.__name__}')
+    post_delete.connect(count_on_delete, sender=counted_model, dispatch_uid=f'counters_delete_{counted_model.__name__}')
+
+
+# Chỉ mục tìm kiếm không dấu: ghi cùng transaction với lần lưu (rollback thì chỉ mục cũng rollback)
+def index_on_save(sender, instance, **kwargs):
+    search.index_objects(sender, [instance.pk])
+    for dependent, field in search.DEPENDENTS.get(sender, ()):
+        search.index_objects(dependent, dependent._default_manager.filter(**{field: instance.pk}).values('pk'))
+
+
+def unindex_on_delete(sender, instance, **kwargs):
+    search.remove_objects(sender, [instance.pk])
+
+
+for indexed_model in search.DOCUMENTS:
+    post_save.connect(index_on_save, sender=indexed_model, dispatch_uid=f'search_save_{indexed_model.__name__}')
+    post_delete.connect(unindex_on_delete, sender=indexed_model, dispatch_uid=f'search_delete_{indexed_model.__name__}')
+
+
+# Gợi ý khách hàng (chỉ mục trong bộ nhớ): cập nhật sau commit như chỉ mục phòng trống
+@receiver(post_save, sender=KhachHang)
+def sync_typeahead_on_customer_save(sender, instance, **kwargs):
+    ma_kh, ten_kh, sdt, email = instance.ma_kh, instance.ten_kh, instance.sdt, instance.email
+    transaction.on_commit(lambda: customer_index.apply_customer(ma_kh, ten_kh, sdt, email))
+
+
+@receiver(post_delete, sender=KhachHang)
+def sync_typeahead_on_customer_delete(sender, instance, **kwargs):
+    ma_kh = instance.ma_kh
+    transaction.on_commit(lambda: customer_index.remove_customer(ma_kh))
+
+
+# Feed lịch làm việc: đổi/xóa ca thì tăng version của tháng chứa ca (cả tháng cũ nếu đổi ngày)
+@receiver(post_init, sender=LichLamViec)
+def remember_schedule_day(sender, instance, **kwargs):
+    instance._initial_ngay_lam = instance.__dict__.get('ngay_lam') if instance.pk else None
+
+
+@receiver(post_save, sender=LichLamViec)
+def bump_schedule_month_on_save(sender, instance, **kwargs):
+    days = [instance._initial_ngay_lam, instance.ngay_lam]
+    instance._initial_ngay_lam = instance.ngay_lam
+    transaction.on_commit(lambda: bump_month_versions(days))
+    transaction.on_commit(dispatch.bump_version)
+
+
+@receiver(post_delete, sender=LichLamViec)
+def bump_schedule_month_on_delete(sender, instance, **kwargs):
+    day = instance.ngay_lam
+    transaction.on_commit(lambda: bump_month_versions([day]))
+    transaction.on_commit(dispatch.bump_version)
+
+
+# Phân công tự động và luồng sự kiện cho bảng điều khiển: nhớ (tình trạng, nhân viên) lúc nạp
+# để biết yêu cầu được giao/đổi người/xử lý xong/hủy
+@receiver(post_init, sender=YeuCau)
+def remember_request_state(sender, instance, **kwargs):
+    instance._request_state = (
+        (instance.__dict__.get('tinh_trang'), instance.__dict__.get('nhan_vien_id')) if instance.pk else (None, None)
+    )
+
+
+@receiver(post_save, sender=YeuCau)
+def sync_request_state_on_save(sender, instance, **kwargs):
+    old_status, old_staff = instance._request_state
+    new_status, new_staff = instance.tinh_trang, instance.nhan_vien_id
+    instance._request_state = (new_status, new_staff)
+    if (old_status, old_staff) == (new_status, new_staff):
+        return
+    was_active = old_staff is not None and old_status in dispatch.ACTIVE_STATUSES
+    is_active = new_staff is not None and new_status in dispatch.ACTIVE_STATUSES
+    event = events.make_event('yeu_cau', [instance.pk], new_status, old_status, new_staff, old_staff)
+
+    def apply():
+        if (was_active, old_staff) != (is_active, new_staff):
+            if was_active:
+                dispatch.dispatcher.adjust(old_staff, -1)
+            if is_active:
+                dispatch.dispatcher.adjust(new_staff, 1)
+        events.event_broker.publish(event)
+    transaction.on_commit(apply)
+
+
+@receiver(post_delete, sender=YeuCau)
+def sync_dispatch_load_on_delete(sender, instance, **kwargs):
+    if instance.nhan_vien_id is not None and instance.tinh_trang in dispatch.ACTIVE_STATUSES:
+        ma_nv = instance.nhan_vien_id
+        transaction.on_commit(lambda: dispatch.dispatcher.adjust(ma_nv, -1))
+
+
+# Đổi trạng thái/bộ phận nhân viên thì dựng lại danh sách nhân viên trong ca; feed lịch in tên nhân viên
+# và feed bộ phận lọc theo vi_tri/trang_thai nên cũng phải đổi ETag
+@receiver(post_save, sender=NhanVien)
+@receiver(post_delete, sender=NhanVien)
+def bump_versions_on_staff_change(sender, instance, **kwargs):
+    transaction.on_commit(dispatch.bump_version)
+    transaction.on_commit(bump_staff_version)
+
+
+@receiver(post_init, sender=DonDatPhong)
+def remember_booking_status(sender, instance, **kwargs):
+    instance._event_status = instance.__dict__.get('trang_thai') if instance.pk else None
+
+
+@receiver(post_save, sender=DonDatPhong)
+def publish_booking_status(sender, instance, **kwargs):
+    old_status, new_status = instance._event_status, instance.trang_thai
+    instance._event_status = new_status
+    if old_status != new_status:
+        event = events.make_event('don_dat_phong', [instance.pk], new_status, old_status)
+        transaction.on_commit(lambda: events.event_broker.publish(event))
+
+
+# Tổng dịch vụ trên đơn đặt phòng: cộng/trừ phần chênh lệch trong cùng transaction với lần lưu/xóa dịch vụ
+# (bulk_create ở form đặt phòng không gửi signal, xem attach_selected_services)
+@receiver(post_init, sender=DonDatDichVu)
+def remember_service_amount(sender, instance, **kwargs):
+    # Đọc từ __dict__ để không phát sinh truy vấn khi trường bị defer; None = không biết giá trị cũ
+    fields = instance.__dict__
+    known = instance.pk and 'thanh_tien' in fields and 'don_dat_phong_id' in fields
+    instance._counted_amount = (fields['don_dat_phong_id'], fields['thanh_tien'] or 0) if known else None
+
+
+@receiver(post_save, sender=DonDatDichVu)
+def add_service_to_booking_total(sender, instance, created, **kwargs):
+    changes = {}
+    if not created:
+        if instance._counted_amount is None:
+            # Không biết thành tiền cũ (trường bị defer khi nạp): để check_booking_totals --fix sửa
+            return
+        old_booking, old_amount = instance._counted_amount
+        changes[old_booking] = -old_amount
+    changes[instance.don_dat_phong_id] = changes.get(instance.don_dat_phong_id, 0) + instance.thanh_tien
+    totals.add(changes)
+    instance._counted_amount = (instance.don_dat_phong_id, instance.thanh_tien)
+
+
+@receiver(post_delete, sender=DonDatDichVu)
+def remove_service_from_booking_total(sender, instance, **kwargs):
+    totals.add({instance.don_dat_phong_id: -(instance.thanh_tien or 0)})
+
+
+# Dữ liệu trang công khai (home, danh sách/chi tiết dịch vụ, chi tiết phòng) được cache theo version của từng model
+@receiver(post_save, sender=Phong)
+@receiver(post_delete, sender=Phong)
+@receiver(post_save, sender=AnhPhong)
+@receiver(post_delete, sender=AnhPhong)
+@receiver(post_save, sender=DichVu)
+@receiver(post_delete, sender=DichVu)
+def bump_page_cache(sender, instance, **kwargs):
+    transaction.on_commit(lambda: page_cache.bump(sender))
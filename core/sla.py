@@ -0,0 +1,221 @@
+# QLCSKH_LTW/core/sla.py
+# Thời gian phản hồi (tạo -> bắt đầu xử lý) và xử lý (tạo -> hoàn thành) của YeuCau theo loại yêu cầu, nhân viên, ca.
+# Mỗi dòng SlaNgay (ngày, chỉ số, nhóm, giá trị) giữ một QuantileSketch: đếm số mẫu theo bậc logarit (sai số tương đối 1%),
+# nên hai phác thảo gộp lại chỉ bằng cộng số đếm và mỗi dòng chỉ vài chục byte. process_request ghi nhận khi đổi trạng thái,
+# báo cáo gộp các dòng của khoảng ngày cần xem; lệnh backfill_sla dựng lại thời gian xử lý từ lịch sử.
+import math
+from collections import defaultdict
+from datetime import datetime, time
+
+from django.db import transaction
+from django.utils import timezone
+
+from .dispatch import current_shift
+from .models import SlaNgay, YeuCau
+
+RELATIVE_ACCURACY = 0.01
+QUANTILES = (('p50', 0.5), ('p90', 0.9), ('p99', 0.99))
+# Trạng thái tính là "đã phản hồi": chuyển từ trạng thái khác sang một trong hai thì ghi thời gian phản hồi
+RESPONDED = ('dang_xu_ly', 'da_xu_ly')
+
+
+def _write_varint(out, value):
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varints(data):
+    value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            yield value
+            value = shift = 0
+
+
+class QuantileSketch:
+    """Phác thảo phân vị gộp được: bậc i chứa các giá trị trong (gamma^(i-1), gamma^i] giây."""
+
+    gamma = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+    _log_gamma = math.log(gamma)
+
+    def __init__(self):
+        self.bins = defaultdict(int)
+        self.zero = 0  # mẫu dưới 1 giây
+        self.total = 0.0  # tổng số giây, để tính trung bình
+
+    @property
+    def count(self):
+        return self.zero + sum(self.bins.values())
+
+    def add(self, seconds):
+        seconds = max(seconds, 0)
+        self.total += seconds
+        if seconds < 1:
+            self.zero += 1
+        else:
+            self.bins[math.ceil(math.log(seconds) / self._log_gamma - 1e-9)] += 1
+
+    def merge(self, other):
+        self.zero += other.zero
+        self.total += other.total
+        for index, count in other.bins.items():
+            self.bins[index] += count
+        return self
+
+    def quantile(self, q):
+        """Giá trị (giây) tại phân vị q, sai số tương đối không quá RELATIVE_ACCURACY; None nếu chưa có mẫu."""
+        count = self.count
+        if not count:
+            return None
+        rank = q * (count - 1)
+        seen = self.zero
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen > rank:
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.bins) / (self.gamma + 1)
+
+    def to_bytes(self):
+        # varint: số mẫu < 1 giây, rồi từng cặp (khoảng cách tới bậc trước, số đếm) theo thứ tự bậc tăng dần
+        out = bytearray()
+        _write_varint(out, self.zero)
+        previous = 0
+        for index in sorted(self.bins):
+            if self.bins[index]:
+                _write_varint(out, index - previous)
+                _write_varint(out, self.bins[index])
+                previous = index
+        return bytes(out)
+
+    @classmethod
+    def from_bytes(cls, data, total=0.0):
+        sketch = cls()
+        sketch.total = total
+        values = _read_varints(bytes(data or b''))
+        sketch.zero = next(values, 0)
+        index = 0
+        for delta in values:
+            index += delta
+            sketch.bins[index] = next(values)
+        return sketch
+
+
+def summarize(sketch):
+    summary = {'so_luong': sketch.count, 'trung_binh': sketch.total / sketch.count if sketch.count else None}
+    for name, q in QUANTILES:
+        summary[name] = sketch.quantile(q)
+    return summary
+
+
+def group_keys(loai_yc, nhan_vien_id, ngay_tao):
+    """Các (nhóm, giá trị) mà một yêu cầu được tính vào; ca là ca lúc khách gửi yêu cầu."""
+    keys = [('tat_ca', ''), ('loai_yc', loai_yc), ('ca_lam', current_shift(ngay_tao)[1])]
+    if nhan_vien_id:
+        keys.append(('nhan_vien', str(nhan_vien_id)))
+    return keys
+
+
+def add_sample(deltas, ngay, chi_so, keys, seconds):
+    for nhom, gia_tri in keys:
+        deltas[(ngay, chi_so, nhom, gia_tri)].add(seconds)
+
+
+def apply_deltas(deltas):
+    """Gộp {(ngày, chỉ số, nhóm, giá trị): QuantileSketch} vào SlaNgay: tạo dòng thiếu, khóa, gộp, ghi lại một lượt."""
+    if not deltas:
+        return
+    with transaction.atomic():
+        SlaNgay.objects.bulk_create(
+            [SlaNgay(ngay=ngay, chi_so=chi_so, nhom=nhom, gia_tri=gia_tri) for ngay, chi_so, nhom, gia_tri in deltas],
+            ignore_conflicts=True,
+        )
+        rows = SlaNgay.objects.select_for_update().filter(
+            ngay__in={key[0] for key in deltas}, chi_so__in={key[1] for key in deltas},
+            nhom__in={key[2] for key in deltas}, gia_tri__in={key[3] for key in deltas},
+        )
+        changed = []
+        for row in rows:
+            delta = deltas.get((row.ngay, row.chi_so, row.nhom, row.gia_tri))
+            if delta is None:
+                continue
+            sketch = QuantileSketch.from_bytes(row.phac_thao, row.tong_giay).merge(delta)
+            row.phac_thao, row.so_luong, row.tong_giay = sketch.to_bytes(), sketch.count, sketch.total
+            changed.append(row)
+        SlaNgay.objects.bulk_update(changed, ['phac_thao', 'so_luong', 'tong_giay'], batch_size=500)
+
+
+def add_transition(deltas, loai_yc, nhan_vien_id, ngay_tao, old_status, new_status, finished=None, now=None):
+    """Thêm mẫu của một lần đổi tình trạng: bắt đầu xử lý -> phản hồi, hoàn thành -> xử lý (và phản hồi nếu bỏ qua bước đang xử lý)."""
+    if new_status == old_status or new_status not in RESPONDED:
+        return
+    now = now or timezone.now()
+    ngay = timezone.localdate(now)
+    keys = group_keys(loai_yc, nhan_vien_id, ngay_tao)
+    if old_status not in RESPONDED:
+        add_sample(deltas, ngay, 'phan_hoi', keys, (now - ngay_tao).total_seconds())
+    if new_status == 'da_xu_ly':
+        add_sample(deltas, ngay, 'xu_ly', keys, ((finished or now) - ngay_tao).total_seconds())
+
+
+def record_transition(yeu_cau, old_status, now=None):
+    """Ghi nhận khi process_request đổi tình trạng của một yêu cầu."""
+    deltas = defaultdict(QuantileSketch)
+    add_transition(deltas, yeu_cau.loai_yc, yeu_cau.nhan_vien_id, yeu_cau.ngay_tao, old_status, yeu_cau.tinh_trang,
+                   yeu_cau.thoi_gian_hoan_thanh, now)
+    apply_deltas(deltas)
+
+
+def report(date_from, date_to):
+    """{(chỉ số, nhóm, giá trị): {so_luong, trung_binh, p50, p90, p99}} cho [date_from, date_to], chỉ đọc SlaNgay."""
+    merged = defaultdict(QuantileSketch)
+    rows = SlaNgay.objects.filter(ngay__range=[date_from, date_to]).values_list(
+        'chi_so', 'nhom', 'gia_tri', 'tong_giay', 'phac_thao',
+    )
+    for chi_so, nhom, gia_tri, tong_giay, phac_thao in rows.iterator(chunk_size=2000):
+        merged[(chi_so, nhom, gia_tri)].merge(QuantileSketch.from_bytes(phac_thao, tong_giay))
+    return {key: summarize(sketch) for key, sketch in merged.items()}
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return '-'
+    minutes = round(seconds / 60)
+    if minutes < 60:
+        return f"{minutes} phút"
+    hours, minutes = divmod(minutes, 60)
+    if hours < 24:
+        return f"{hours} giờ {minutes:02d} phút"
+    days, hours = divmod(hours, 24)
+    return f"{days} ngày {hours} giờ"
+
+
+def backfill(date_from, date_to):
+    """Dựng lại thời gian xử lý cho các yêu cầu hoàn thành trong [date_from, date_to) (ngày địa phương).
+
+    Lịch sử không lưu lúc bắt đầu xử lý nên thời gian phản hồi chỉ có từ khi bắt đầu ghi nhận trực tiếp;
+    các dòng 'xu_ly' của khoảng ngày được thay toàn bộ.
+    """
+    start = timezone.make_aware(datetime.combine(date_from, time.min))
+    end = timezone.make_aware(datetime.combine(date_to, time.min))
+    deltas = defaultdict(QuantileSketch)
+    done = YeuCau.objects.filter(
+        tinh_trang='da_xu_ly', thoi_gian_hoan_thanh__gte=start, thoi_gian_hoan_thanh__lt=end,
+    ).values_list('loai_yc', 'nhan_vien_id', 'ngay_tao', 'thoi_gian_hoan_thanh')
+    for loai_yc, nhan_vien_id, ngay_tao, finished in done.iterator(chunk_size=2000):
+        add_sample(deltas, timezone.localdate(finished), 'xu_ly', group_keys(loai_yc, nhan_vien_id, ngay_tao),
+                   (finished - ngay_tao).total_seconds())
+    with transaction.atomic():
+        SlaNgay.objects.filter(chi_so='xu_ly', ngay__gte=date_from, ngay__lt=date_to).delete()
+        SlaNgay.objects.bulk_create([
+            SlaNgay(ngay=ngay, chi_so=chi_so, nhom=nhom, gia_tri=gia_tri, so_luong=sketch.count,
+                    tong_giay=sketch.total, phac_thao=sketch.to_bytes())
+            for (ngay, chi_so, nhom, gia_tri), sketch in deltas.items()
+        ], batch_size=1000)
+    return len(deltas)
@@ -0,0 +1,52 @@
+# QLCSKH_LTW/core/totals.py
+# DonDatPhong.tong_dich_vu / tong_tien: tổng dịch vụ và tổng tiền lưu sẵn trên đơn để danh sách, trang chi tiết,
+# check-out và night audit không phải gom DonDatDichVu mỗi lần. Cộng dồn bằng UPDATE ... SET x = x + %s (F())
+# trong cùng transaction với lần thêm/xóa dịch vụ: signals cho save()/delete(), gọi add() trực tiếp sau bulk_create.
+# Lưu cả đơn (vd. đổi giá phòng) thì DonDatPhong.save gọi sync() để tính lại từ DonDatDichVu.
+# Lệnh check_booking_totals phát hiện (và --fix sửa) các đơn lệch so với DonDatDichVu.
+from django.db.models import F, FloatField, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Abs, Coalesce
+
+from .models import DonDatDichVu, DonDatPhong
+
+# Sai số cho phép khi so sánh tổng số thực (thứ tự cộng khác nhau)
+TOLERANCE = 0.01
+
+
+def add(changes):
+    """Cộng {ma_ddp: số tiền dịch vụ thay đổi} vào tổng của từng đơn (âm khi xóa dịch vụ)."""
+    for ma_ddp, amount in changes.items():
+        if amount:
+            DonDatPhong.objects.filter(pk=ma_ddp).update(
+                tong_dich_vu=F('tong_dich_vu') + amount, tong_tien=F('tong_tien') + amount,
+            )
+
+
+def _actual_services(manager=DonDatDichVu.objects):
+    return Coalesce(
+        Subquery(manager.filter(don_dat_phong=OuterRef('pk')).order_by().values('don_dat_phong')
+                 .annotate(total=Sum('thanh_tien')).values('total')),
+        Value(0.0), output_field=FloatField(),
+    )
+
+
+def drifted(bookings=None):
+    """Các đơn có tong_dich_vu/tong_tien lệch với DonDatDichVu, kèm tổng dịch vụ đúng (thuc_te_dich_vu)."""
+    bookings = DonDatPhong.objects.all() if bookings is None else bookings
+    return bookings.annotate(thuc_te_dich_vu=_actual_services()).annotate(
+        lech_dich_vu=Abs(F('tong_dich_vu') - F('thuc_te_dich_vu')),
+        lech_tong=Abs(F('tong_tien') - Coalesce(F('gia_ddp'), 0.0) - F('thuc_te_dich_vu')),
+    ).filter(Q(lech_dich_vu__gt=TOLERANCE) | Q(lech_tong__gt=TOLERANCE))
+
+
+def sync(booking):
+    """Tính lại tổng của một đơn vừa lưu từ DonDatDichVu và nạp lại vào instance (DonDatPhong.save)."""
+    recompute(DonDatPhong.objects.filter(pk=booking.pk))
+    booking.refresh_from_db(fields=['tong_dich_vu', 'tong_tien'])
+
+
+def recompute(bookings=None, services=None):
+    """Tính lại tổng cho các đơn (mặc định tất cả) bằng một UPDATE với subquery; trả về số đơn được ghi."""
+    bookings = DonDatPhong.objects.all() if bookings is None else bookings
+    actual = _actual_services(services or DonDatDichVu.objects)
+    return bookings.update(tong_dich_vu=actual, tong_tien=Coalesce(F('gia_ddp'), 0.0) + actual)
@@ -0,0 +1,160 @@
+# QLCSKH_LTW/core/typeahead.py
+# Gợi ý khách hàng khi lễ tân gõ SĐT hoặc tên (endpoint admin_customer_typeahead).
+# Giữ trong bộ nhớ một danh sách khóa đã sắp xếp: các chữ số của SĐT và từng từ của tên đã bỏ dấu,
+# tra tiền tố bằng bisect, không truy vấn bảng KhachHang. Cập nhật qua signals; worker khác đổi dữ liệu thì
+# version trong cache 'shared' thay đổi và chỉ mục được dựng lại (cùng cách với core/availability.py).
+import logging
+import threading
+from bisect import bisect_left, insort
+from collections import namedtuple
+
+from django.db import DatabaseError
+
+from .cache_backend import new_version, shared_cache
+from .models import KhachHang
+from .search import tokenize
+
+logger = logging.getLogger(__name__)
+
+VERSION_CACHE_KEY = 'typeahead:customers:version'
+MIN_QUERY_LENGTH = 2
+MAX_SCAN = 2000  # số khóa tối đa duyệt mỗi lần tra; dừng sớm thì báo `more` để lễ tân gõ thêm
+
+# more: có thể còn khách khớp chưa trả về (đủ limit hoặc dừng ở MAX_SCAN); scanned: số khóa đã duyệt
+LookupResult = namedtuple('LookupResult', 'results more scanned')
+
+
+def customer_keys(ten_kh, sdt):
+    """Các khóa tra tiền tố: từng từ của tên đã bỏ dấu và dãy chữ số của SĐT."""
+    keys = set(tokenize(ten_kh))
+    digits = ''.join(ch for ch in sdt or '' if ch.isdigit())
+    if digits:
+        keys.add(digits)
+    return keys
+
+
+def _haystack(keys):
+    # " k1 k2 ...": kiểm tra "có khóa bắt đầu bằng t" bằng một phép `" " + t in haystack`
+    return ' ' + ' '.join(sorted(keys))
+
+
+class CustomerPrefixIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._entries = []  # [(khóa, -ma_kh)] đã sắp xếp; -ma_kh để khách mới hơn đứng trước
+        self._customers = {}  # ma_kh -> (ten_kh, sdt, email, " khóa1 khóa2 ...")
+        self._version = None
+
+    # ---- Dựng / đồng bộ chỉ mục ----
+
+    def rebuild(self):
+        entries, customers = [], {}
+        rows = KhachHang.objects.order_by().values_list('ma_kh', 'ten_kh', 'sdt', 'email')
+        for ma_kh, ten_kh, sdt, email in rows.iterator(chunk_size=2000):
+            keys = customer_keys(ten_kh, sdt)
+            customers[ma_kh] = (ten_kh, sdt, email, _haystack(keys))
+            entries.extend((key, -ma_kh) for key in keys)
+        entries.sort()
+
+        with self._lock:
+            self._entries = entries
+            self._customers = customers
+            self._version = shared_cache.get_or_set(VERSION_CACHE_KEY, new_version, None)
+        logger.debug(f"Customer typeahead index rebuilt: {len(customers)} customers, version {self._version}")
+
+    def warm(self):
+        """Dựng sẵn khi khởi động (wsgi); lỗi DB (chưa migrate) thì để lần tra đầu tiên tự dựng."""
+        try:
+            self.rebuild()
+        except DatabaseError as exc:
+            logger.warning(f"Customer typeahead index not built at startup: {exc}")
+
+    def _ensure_fresh(self):
+        current = shared_cache.get(VERSION_CACHE_KEY)
+        if self._version is None or current != self._version:
+            self.rebuild()
+
+    def _remove_entries(self, ma_kh):
+        old = self._customers.pop(ma_kh, None)
+        if old is None:
+            return
+        for key in customer_keys(old[0], old[1]):
+            position = bisect_left(self._entries, (key, -ma_kh))
+            if position < len(self._entries) and self._entries[position] == (key, -ma_kh):
+                del self._entries[position]
+
+    def apply_customer(self, ma_kh, ten_kh, sdt, email):
+        """Thêm/cập nhật một khách hàng sau khi lưu."""
+        with self._lock:
+            if self._version is None:
+                return
+            self._remove_entries(ma_kh)
+            keys = customer_keys(ten_kh, sdt)
+            self._customers[ma_kh] = (ten_kh, sdt, email, _haystack(keys))
+            for key in keys:
+                insort(self._entries, (key, -ma_kh))
+            self._bump()
+
+    def remove_customer(self, ma_kh):
+        with self._lock:
+            if self._version is None:
+                return
+            self._remove_entries(ma_kh)
+            self._bump()
+
+    def _bump(self):
+        try:
+            version = shared_cache.incr(VERSION_CACHE_KEY)
+        except ValueError:
+            version = new_version()
+            shared_cache.set(VERSION_CACHE_KEY, version, None)
+        # Có worker khác ghi xen giữa thì lần tra sau sẽ dựng lại toàn bộ
+        self._version = version if version == self._version + 1 else None
+
+    # ---- Tra cứu ----
+
+    @property
+    def version(self):
+        self._ensure_fresh()
+        return self._version
+
+    def lookup(self, query, limit=10):
+        """Tối đa `limit` khách có mọi từ trong query là tiền tố của SĐT/một từ trong tên.
+
+        Trả về [(ma_kh, ten_kh, sdt, email)] theo thứ tự khóa (khớp đúng cả từ đứng trước), cùng khóa thì khách mới hơn trước.
+        """
+        return self.search(query, limit).results
+
+    def search(self, query, limit=10):
+        """Như lookup, trả về LookupResult kèm cờ `more` khi kết quả có thể chưa đủ."""
+        tokens = tokenize(query)
+        if tokens and all(token.isdigit() for token in tokens):
+            # SĐT gõ có dấu cách/chấm: "0912 345 678"
+            tokens = [''.join(tokens)]
+        if not tokens or len(''.join(tokens)) < MIN_QUERY_LENGTH:
+            return LookupResult([], False, 0)
+        self._ensure_fresh()
+        with self._lock:
+            entries, customers = self._entries, self._customers
+            # Duyệt theo từ có ít khóa khớp nhất, các từ còn lại kiểm tra trên tập khóa của khách
+            ranges = [(bisect_left(entries, (token,)), bisect_left(entries, (token + '\uffff',)), token) for token in tokens]
+            start, end, lead = min(ranges, key=lambda item: item[1] - item[0])
+            others = [' ' + token for token in tokens]
+            others.remove(' ' + lead)
+            results, seen = [], set()
+            position = start
+            stop = min(end, start + MAX_SCAN)
+            while position < stop and len(results) < limit:
+                ma_kh = -entries[position][1]
+                position += 1
+                if ma_kh in seen:
+                    continue
+                seen.add(ma_kh)
+                ten_kh, sdt, email, haystack = customers[ma_kh]
+                if all(token in haystack for token in others):
+                    results.append((ma_kh, ten_kh, sdt, email))
+        if position < end:
+            logger.debug(f"Customer typeahead stopped after {position - start} of {end - start} keys for {query!r}")
+        return LookupResult(results, position < end, position - start)
+
+customer_index = CustomerPrefixIndex()
@@ -1,13 +1,18 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.template.loader import render_to_string
 from django.contrib.auth.decorators import login_required, user_passes_test
-from django.core.paginator import Paginator
-from django.db.models import Q, Sum
+from django.core.paginator import Page, Paginator
+from django.db.models import Q
 from django.contrib import messages
 from .models import *
 from .forms import *
 from datetime import date, timedelta, datetime
 from django.urls import reverse
-from django.http import JsonResponse
+from django.http import Http404, HttpResponse, JsonResponse, HttpResponseNotModified, QueryDict, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.utils.cache import patch_cache_control
+from django.utils.http import quote_etag, parse_etags
+import hashlib
 import logging
 from accounts.models import TaiKhoan
 import json
@@ -16,10 +21,32 @@ from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from django.views import View
-from django.db import transaction
+from django.db import transaction, IntegrityError
+from urllib.parse import urlencode
+from .availability import find_available_rooms, availability_matrix, room_versions
+from .counters import get_counters, status_counts
+from .inventory import MAX_NIGHTS, sync_nights, place_hold, convert_hold, serialized_atomic
+from .exports import export_bookings, export_invoices, export_requests, export_service_bookings
+from .pagination import KeysetPaginator
+from .search import fold, search_ranked, search_related
+from .search_query import (
+    BOOKING_SCHEMA, CUSTOMER_SCHEMA, REQUEST_SCHEMA, ROOM_SCHEMA, SERVICE_BOOKING_SCHEMA, SERVICE_SCHEMA, STAFF_SCHEMA,
+    apply_search, is_number,
+)
+from .rollups import record_checkout, record_cancellation, room_counts, summarize_by_month
+from .sla import format_duration, record_transition as record_sla, report as sla_report
+from .schedule import (
+    calendar_grid, feed_months, feed_shifts, feed_token, feed_versions, month_weeks, read_feed_token, staff_grid,
+    to_ics,
+)
+from . import bulk, dispatch, events, page_cache, roster, totals
+from .typeahead import customer_index
 
 logger = logging.getLogger(__name__)
 timeout = settings.SESSION_COOKIE_AGE
+TYPEAHEAD_MAX_AGE = 30
+ROSTER_CONFLICTS_SHOWN = 200
+CA_LAM_LABELS = dict(LichLamViec.CA_LAM_CHOICES)
 
 # Role-based access control functions
 def is_admin(user):
@@ -50,12 +77,10 @@ def is_admin_or_staff(user):
 
 def home(request):
     logger.debug(f"Home view accessed by user: {request.user.username if request.user.is_authenticated else 'Anonymous'}, Authenticated: {request.user.is_authenticated}")
-    featured_rooms = Phong.objects.filter(trang_thai='trong')[:8]
-    services = DichVu.objects.filter(hoat_dong=True)[:3]
-
-    total_customers = KhachHang.objects.count()
-    total_bookings = DonDatPhong.objects.count()
-    total_rooms = Phong.objects.count()
+    counts = get_counters()
+    total_customers = counts['khach_hang']
+    total_bookings = counts['don_dat_phong']
+    total_rooms = counts['phong']
 
     if request.method == 'POST' and 'search_rooms' in request.POST:
         check_in = request.POST.get('check_in')
@@ -63,12 +88,15 @@ def home(request):
         guests = request.POST.get('guests', 1)
         room_type = request.POST.get('room_type', '')
 
-        return redirect(
-            'room_search') + f'?check_in={check_in}&check_out={check_out}&guests={guests}&room_type={room_type}'
+        query = urlencode({'check_in': check_in, 'check_out': check_out, 'guests': guests, 'room_type': room_type})
+        return redirect(f"{reverse('room_search')}?{query}")
 
+    cached = page_cache.get_or_build('home', (Phong, DichVu), lambda: {
+        'featured_rooms': list(Phong.objects.filter(trang_thai='trong')[:8]),
+        'services': list(DichVu.objects.filter(hoat_dong=True)[:3]),
+    })
     context = {
-        'featured_rooms': featured_rooms,
-        'services': services,
+        **cached,
         'total_customers': total_customers,
         'total_bookings': total_bookings,
         'total_rooms': total_rooms,
@@ -79,45 +107,104 @@ def room_search(request):
     room_status = request.GET.get('room_status', 'trong')
     guests_str = request.GET.get('guests', '1')
     room_type = request.GET.get('room_type', '')
+    check_in_str = request.GET.get('check_in', '')
+    check_out_str = request.GET.get('check_out', '')
+
+    date_in = date_out = None
+    if check_in_str and check_out_str:
+        try:
+            date_in = datetime.strptime(check_in_str, '%Y-%m-%d').date()
+            date_out = datetime.strptime(check_out_str, '%Y-%m-%d').date()
+            if date_out <= date_in:
+                messages.error(request, "Ngày trả phòng phải sau ngày nhận phòng.")
+                date_in = date_out = None
+        except ValueError:
+            date_in = date_out = None
 
     rooms = Phong.objects.all()
 
-    if room_status:
+    # Có khoảng ngày thì xét phòng trống theo lịch đặt, chỉ loại phòng đang bảo trì
+    if date_in and date_out:
+        rooms = rooms.exclude(trang_thai='bao_tri')
+    elif room_status:
         rooms = rooms.filter(trang_thai=room_status)
 
+    guests_int = None
     if guests_str:
         try:
             guests_int = int(guests_str)
-            rooms = rooms.filter(suc_chua__gte=guests_int)
         except ValueError:
             pass
 
     if room_type:
         rooms = rooms.filter(loai_p=room_type)
 
+    if date_in and date_out:
+        rooms = find_available_rooms(rooms, date_in, date_out, guests_int)
+    elif guests_int:
+        rooms = rooms.filter(suc_chua__gte=guests_int)
+
     context = {
         'rooms': rooms,
         'room_status': room_status,
         'guests': guests_str,
         'room_type': room_type,
+        'check_in': check_in_str if date_in else '',
+        'check_out': check_out_str if date_out else '',
     }
     return render(request, 'core/room_search.html', context)
 
+# JSON: ma trận phòng x ngày (mặc định 90 ngày từ hôm nay) cho lịch đặt phòng, hỗ trợ If-None-Match
+def room_availability(request):
+    today = timezone.now().date()
+    try:
+        start = datetime.strptime(request.GET['start'], '%Y-%m-%d').date() if request.GET.get('start') else today
+        days = min(max(int(request.GET.get('days', 90)), 1), 366)
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Tham số ngày không hợp lệ.'}, status=400)
+    encoding = 'bits' if request.GET.get('encoding') == 'bits' else 'rle'
+
+    rooms_param = request.GET.get('rooms', '')
+    if rooms_param:
+        try:
+            room_ids = sorted({int(room_id) for room_id in rooms_param.split(',') if room_id})
+        except ValueError:
+            return JsonResponse({'status': 'error', 'message': 'Danh sách phòng không hợp lệ.'}, status=400)
+    else:
+        room_ids = list(Phong.objects.order_by('ma_p').values_list('ma_p', flat=True))
+
+    versions = room_versions(room_ids)
+    etag_source = f"{start}:{days}:{encoding}:" + ",".join(f"{room_id}.{versions[room_id]}" for room_id in room_ids)
+    etag = quote_etag(hashlib.md5(etag_source.encode()).hexdigest())
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+    else:
+        matrix = availability_matrix(room_ids, start, days, encoding, versions)
+        response = JsonResponse({
+            'start': start.isoformat(),
+            'days': days,
+            'encoding': encoding,
+            'rooms': {str(room_id): value for room_id, value in matrix.items()},
+        })
+    response['ETag'] = etag
+    patch_cache_control(response, no_cache=True)
+    return response
+
 def service_list(request):
     search_query = request.GET.get('search', '')
 
-    services_qs = DichVu.objects.filter(hoat_dong=True)
+    def build():
+        services_qs = DichVu.objects.filter(hoat_dong=True)
 
-    if search_query:
-        services_qs = services_qs.filter(
-            Q(ten_dv__icontains=search_query) |
-            Q(mo_ta__icontains=search_query) |
-            Q(ma_dv__icontains=search_query)
-        )
+        if search_query:
+            services_qs = search_ranked(services_qs, search_query)
 
-    paginator = Paginator(services_qs, 10)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+        paginator = Paginator(services_qs, 10)
+        page = paginator.get_page(request.GET.get('page'))
+        # Bản gọn để cache: dịch vụ của trang + paginator trên range(count), không giữ queryset
+        return Page(list(page.object_list), page.number, Paginator(range(paginator.count), 10))
+
+    page_obj = page_cache.get_or_build('service_list', (DichVu,), build, request.GET, ('search', 'page'))
 
     context = {
         'page_obj': page_obj,
@@ -126,17 +213,53 @@ def service_list(request):
     return render(request, 'core/service_list.html', context)
 
 def service_detail(request, pk):
-    service = get_object_or_404(DichVu, pk=pk)
+    service = page_cache.get_or_build(f'service_detail:{pk}', (DichVu,), lambda: get_object_or_404(DichVu, pk=pk))
     context = {
         'service': service,
     }
     return render(request, 'core/service_detail.html', context)
 
+# Gắn các dịch vụ khách chọn ở form đặt phòng: một truy vấn lấy dịch vụ, một lệnh bulk_create
+def attach_selected_services(booking, selected_service_ids, service_date, service_time):
+    service_ids = []
+    for service_id_str in selected_service_ids:
+        try:
+            service_ids.append(int(service_id_str))
+        except (TypeError, ValueError):
+            logger.warning(f"Invalid service id format: {service_id_str}. Skipping.")
+
+    services = DichVu.objects.filter(hoat_dong=True).in_bulk(service_ids) if service_ids else {}
+
+    service_bookings = []
+    for service_id in service_ids:
+        service_instance = services.get(service_id)
+        if service_instance is None:
+            logger.warning(f"Service with id {service_id} not found or not active. Skipping.")
+            continue
+        # bulk_create không gọi DonDatDichVu.save() nên tính thành tiền tại đây theo giá hiện tại
+        service_bookings.append(DonDatDichVu(
+            don_dat_phong=booking,
+            dich_vu=service_instance,
+            ngay_su_dung=service_date,
+            gio_su_dung=service_time,
+            so_luong=1,
+            thanh_tien=service_instance.phi_dv
+        ))
+    created = DonDatDichVu.objects.bulk_create(service_bookings)
+    # bulk_create không gửi signal: tự cộng vào tổng dịch vụ của đơn
+    totals.add({booking.pk: sum(service.thanh_tien for service in created)})
+    return created
+
 @method_decorator(csrf_exempt, name='dispatch')
 class RoomDetailView(View):
     def get(self, request, pk):
+        context = page_cache.get_or_build(f'room_detail:{pk}', (Phong, AnhPhong, DichVu), lambda: self.build(pk))
+        return render(request, 'core/room_detail.html', {**context, 'booking_success': False})
+
+    @staticmethod
+    def build(pk):
         room = get_object_or_404(Phong, pk=pk)
-        additional_images = room.anh_phu.all()
+        additional_images = list(room.anh_phu.all())
 
         all_room_images = []
         if room.anh_dai_dien:
@@ -145,16 +268,12 @@ class RoomDetailView(View):
         for img in additional_images:
             all_room_images.append({'url': img.anh.url, 'alt': img.mo_ta_anh or f"Ảnh thêm của {room.ten_p}"})
 
-        available_services = DichVu.objects.filter(hoat_dong=True).order_by('ten_dv')
-
-        context = {
+        return {
             'room': room,
             'all_room_images': all_room_images,
             'additional_images': additional_images,
-            'available_services': available_services,
-            'booking_success': False,
+            'available_services': list(DichVu.objects.filter(hoat_dong=True).order_by('ten_dv')),
         }
-        return render(request, 'core/room_detail.html', context)
 
     def post(self, request, pk):
         room = get_object_or_404(Phong, pk=pk)
@@ -165,6 +284,9 @@ class RoomDetailView(View):
             logger.debug(f"Created new session: {request.session.session_key}")
 
         if step == '1':
+            # Giữ chỗ ghi PhongNgay cho từng đêm nên chỉ cho tài khoản đã đăng nhập (bước 2 cũng bắt buộc đăng nhập)
+            if not request.user.is_authenticated:
+                return JsonResponse({'status': 'error', 'message': 'Vui lòng đăng nhập để giữ phòng.'}, status=401)
             try:
                 check_in_str = request.POST.get('check_in')
                 check_out_str = request.POST.get('check_out')
@@ -181,6 +303,8 @@ class RoomDetailView(View):
                 date_out = datetime.strptime(check_out_str, '%Y-%m-%d').date()
                 if date_out <= date_in:
                     return JsonResponse({'status': 'error', 'message': 'Ngày trả phòng phải sau ngày nhận phòng.'}, status=400)
+                if (date_out - date_in).days > MAX_NIGHTS:
+                    return JsonResponse({'status': 'error', 'message': f'Không thể đặt phòng quá {MAX_NIGHTS} ngày.'}, status=400)
 
                 try:
                     selected_service_ids = json.loads(selected_services_json)
@@ -189,12 +313,19 @@ class RoomDetailView(View):
                 except json.JSONDecodeError:
                     selected_service_ids = []
 
+                previous_hold = request.session.get('booking_data', {}).get('hold_token')
+                try:
+                    hold_token = place_hold(room.ma_p, date_in, date_out, previous_hold, owner_id=request.user.pk)
+                except IntegrityError:
+                    return JsonResponse({'status': 'error', 'message': 'Rất tiếc, phòng đã có người đặt hoặc đang giữ chỗ trong khoảng thời gian này. Vui lòng chọn ngày khác.'}, status=409)
+
                 request.session['booking_data'] = {
                     'check_in': check_in_str,
                     'check_out': check_out_str,
                     'guests': guests_str,
                     'room_id': pk,
                     'selected_service_ids': selected_service_ids,
+                    'hold_token': hold_token,
                     'timestamp': str(timezone.now())
                 }
                 request.session.modified = True
@@ -244,51 +375,30 @@ class RoomDetailView(View):
                 if guests > room.suc_chua:
                     return JsonResponse({'status': 'error', 'message': f"Số lượng khách vượt quá sức chứa ({room.suc_chua} người) của phòng."}, status=400)
 
-                conflicting_bookings = DonDatPhong.objects.filter(
-                    phong=room,
-                    ngay_nhan__lt=date_out,
-                    ngay_tra__gt=date_in,
-                    trang_thai__in=['da_xac_nhan', 'da_checkin']
-                ).exists()
-
-                if conflicting_bookings:
-                    return JsonResponse({'status': 'error', 'message': 'Rất tiếc, phòng này vừa có người khác đặt trong khoảng thời gian bạn chọn. Vui lòng chọn lại.'}, status=409)
-
                 days = (date_out - date_in).days
                 if days <= 0:
                     return JsonResponse({'status': 'error', 'message': 'Số ngày đặt phòng phải lớn hơn 0.'}, status=400)
 
-                with transaction.atomic():
-                    booking = DonDatPhong.objects.create(
-                        phong=room,
-                        ngay_nhan=date_in,
-                        ngay_tra=date_out,
-                        so_luong_nguoi=guests,
-                        khach_hang=khach_hang_profile,
-                        gia_ddp=room.gia * days,
-                        trang_thai='cho_xac_nhan'
-                    )
-
-                    if selected_service_ids:
-                        default_service_date = date_in
-                        default_service_time = datetime.now().time()
-
-                        for service_id_str in selected_service_ids:
-                            try:
-                                service_id = int(service_id_str)
-                                service_instance = DichVu.objects.get(pk=service_id, hoat_dong=True)
-                                DonDatDichVu.objects.create(
-                                    don_dat_phong=booking,
-                                    dich_vu=service_instance,
-                                    ngay_su_dung=default_service_date,
-                                    gio_su_dung=default_service_time,
-                                    so_luong=1,
-                                    thanh_tien=service_instance.phi_dv
-                                )
-                            except DichVu.DoesNotExist:
-                                logger.warning(f"Service with id {service_id_str} not found or not active. Skipping.")
-                            except ValueError:
-                                logger.warning(f"Invalid service id format: {service_id_str}. Skipping.")
+                try:
+                    with serialized_atomic(room.ma_p):
+                        booking = DonDatPhong.objects.create(
+                            phong=room,
+                            ngay_nhan=date_in,
+                            ngay_tra=date_out,
+                            so_luong_nguoi=guests,
+                            khach_hang=khach_hang_profile,
+                            gia_ddp=room.gia * days,
+                            trang_thai='cho_xac_nhan'
+                        )
+                        # Chuyển lượt giữ chỗ ở bước 1 thành đơn; trùng lịch -> vi phạm unique (phong, ngay)
+                        # của PhongNgay, toàn bộ đơn bị rollback
+                        convert_hold(booking, booking_data.get('hold_token'))
+
+                        if selected_service_ids:
+                            attach_selected_services(booking, selected_service_ids, date_in, datetime.now().time())
+                except IntegrityError:
+                    logger.info(f"Room {room.ten_p} already booked between {date_in} and {date_out}, rejecting booking by {request.user.username}")
+                    return JsonResponse({'status': 'error', 'message': 'Rất tiếc, phòng này vừa có người khác đặt trong khoảng thời gian bạn chọn. Vui lòng chọn lại.'}, status=409)
 
                 if 'booking_data' in request.session:
                     del request.session['booking_data']
@@ -325,7 +435,7 @@ def admin_room_management(request):
     status = request.GET.get('status', '')
 
     if search_query:
-        rooms = rooms.filter(Q(ten_p__icontains=search_query) | Q(mo_ta__icontains=search_query))
+        rooms = apply_search(rooms, search_query, ROOM_SCHEMA)
 
     if room_type:
         rooms = rooms.filter(loai_p=room_type)
@@ -420,14 +530,11 @@ def admin_customer_management(request):
 
     search_query = request.GET.get('search', '')
     if search_query:
-        customers = customers.filter(
-            Q(ten_kh__icontains=search_query) |
-            Q(sdt__icontains=search_query) |
-            Q(email__icontains=search_query))
+        customers = apply_search(customers, search_query, CUSTOMER_SCHEMA)
 
-    paginator = Paginator(customers, 10)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    total = None if search_query else get_counters()['khach_hang']
+    paginator = KeysetPaginator(customers, ('-ma_kh',), 10, total=total)
+    page_obj = paginator.get_page(request.GET)
 
     context = {
         'page_obj': page_obj,
@@ -437,13 +544,39 @@ def admin_customer_management(request):
     }
     return render(request, 'admin/customer_management.html', context)
 
+# JSON: gợi ý khách hàng theo SĐT/tên cho ô tìm kiếm (tra chỉ mục trong bộ nhớ, không truy vấn DB).
+# Trình duyệt được dùng lại kết quả trong TYPEAHEAD_MAX_AGE giây nên gõ xóa rồi gõ lại không gửi request mới.
+@login_required
+@user_passes_test(is_admin_or_staff)
+def admin_customer_typeahead(request):
+    query = request.GET.get('q', '').strip()
+    version = customer_index.version
+    etag = quote_etag(hashlib.md5(f"{version}:{fold(query)}".encode()).hexdigest())
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+    else:
+        found = customer_index.search(query)
+        response = JsonResponse({'results': [
+            {
+                'ma_kh': ma_kh,
+                'ten_kh': ten_kh,
+                'sdt': sdt,
+                'email': email,
+                'url': reverse('customer_detail', args=[ma_kh]),
+            }
+            for ma_kh, ten_kh, sdt, email in found.results
+        ], 'more': found.more})
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, max_age=TYPEAHEAD_MAX_AGE)
+    return response
+
 # Cho phép cả admin và nhân viên xem chi tiết khách hàng
 @login_required
 @user_passes_test(is_admin_or_staff)
 def customer_detail(request, pk):
     logger.debug(f"User accessing customer_detail: {request.user.username}, Role: {getattr(request.user, 'loai_tk', 'N/A')}, Authenticated: {request.user.is_authenticated}")
     customer = get_object_or_404(KhachHang, pk=pk)
-    bookings = DonDatPhong.objects.filter(khach_hang=customer).order_by('-ngay_dat')
+    bookings = DonDatPhong.objects.filter(khach_hang=customer).select_related('phong').order_by('-ngay_dat')
 
     context = {
         'customer': customer,
@@ -540,10 +673,7 @@ def admin_staff_management(request):
     status = request.GET.get('status', '')
 
     if search_query:
-        staff = staff.filter(
-            Q(ten_nv__icontains=search_query) |
-            Q(sdt__icontains=search_query) |
-            Q(email__icontains=search_query))
+        staff = apply_search(staff, search_query, STAFF_SCHEMA)
 
     if position:
         staff = staff.filter(vi_tri=position)
@@ -631,9 +761,7 @@ def admin_service_management(request):
     max_price_str = request.GET.get('max_price', '')
 
     if search_query:
-        services = services.filter(
-            Q(ten_dv__icontains=search_query) |
-            Q(mo_ta__icontains=search_query))
+        services = apply_search(services, search_query, SERVICE_SCHEMA)
 
     if status == 'active':
         services = services.filter(hoat_dong=True)
@@ -824,39 +952,146 @@ def delete_request(request, pk):
     return redirect('process_request', pk=pk)
 
 
+def filter_requests(params):
+    """Danh sách YeuCau theo bộ lọc của trang quản lý yêu cầu (q, status, start_date, end_date)."""
+    requests_list = YeuCau.objects.select_related('khach_hang', 'phong', 'nhan_vien').order_by('-ngay_tao')
+
+    search_query = params.get('q', '')
+    status_filter = params.get('status', '')
+
+    if search_query:
+        requests_list = apply_search(requests_list, search_query, REQUEST_SCHEMA)
+
+    if status_filter:
+        requests_list = requests_list.filter(tinh_trang=status_filter)
+
+    start_date_str = params.get('start_date', '')
+    end_date_str = params.get('end_date', '')
+    if start_date_str:
+        try:
+            requests_list = requests_list.filter(ngay_tao__date__gte=datetime.strptime(start_date_str, '%Y-%m-%d').date())
+        except ValueError:
+            pass
+    if end_date_str:
+        try:
+            requests_list = requests_list.filter(ngay_tao__date__lte=datetime.strptime(end_date_str, '%Y-%m-%d').date())
+        except ValueError:
+            pass
+    return requests_list
+
+
 @login_required
 @user_passes_test(lambda u: u.is_authenticated and getattr(u, 'loai_tk', '').strip().lower() in ['admin', 'nhan_vien'])
 def admin_request_management(request):
     logger.debug(f"User accessing admin_request_management: {request.user.username}, Role: {getattr(request.user, 'loai_tk', 'N/A')}, Authenticated: {request.user.is_authenticated}")
-    requests_list = YeuCau.objects.all().order_by('-ngay_tao')
-
+    requests_list = filter_requests(request.GET)
     search_query = request.GET.get('q', '')
     status_filter = request.GET.get('status', '')
+    start_date_str = request.GET.get('start_date', '')
+    end_date_str = request.GET.get('end_date', '')
 
-    if search_query:
-        requests_list = requests_list.filter(
-            Q(ma_yc__icontains=search_query) |
-            Q(khach_hang__ten_kh__icontains=search_query) |
-            Q(phong__ten_p__icontains=search_query) |
-            Q(noi_dung_yc__icontains=search_query)
-        )
+    if request.GET.get('export') == 'csv':
+        return export_requests(requests_list)
 
-    if status_filter:
-        requests_list = requests_list.filter(tinh_trang=status_filter)
-
-    paginator = Paginator(requests_list, 10)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    total = None
+    if not (search_query or start_date_str or end_date_str):
+        counts = get_counters()
+        total = counts.get(f'yeu_cau:{status_filter}' if status_filter else 'yeu_cau')
+    paginator = KeysetPaginator(requests_list, ('-ngay_tao', '-ma_yc'), 10, total=total)
+    page_obj = paginator.get_page(request.GET)
 
     context = {
         'page_obj': page_obj,
         'search_query': search_query,
         'status_filter': status_filter,
+        'start_date': start_date_str,
+        'end_date': end_date_str,
+        'filters': request.GET.urlencode(),
+        'bulk_actions': bulk.REQUEST_ACTIONS if request.user.loai_tk == 'admin' else {
+            key: bulk.REQUEST_ACTIONS[key] for key in bulk.STAFF_REQUEST_ACTIONS
+        },
+        'available_staff': NhanVien.objects.filter(trang_thai='dang_lam') if request.user.loai_tk == 'admin' else [],
+        'max_bulk_items': bulk.MAX_ITEMS,
         'is_admin': request.user.loai_tk == 'admin',
         'is_staff': request.user.loai_tk == 'nhan_vien',
     }
     return render(request, 'admin/request_management.html', context)
 
+@login_required
+@user_passes_test(is_admin)
+def dispatch_requests(request):
+    """Phân công hàng loạt các yêu cầu đang chờ (tối đa dispatch.DRAIN_LIMIT mỗi lần, một transaction)."""
+    if request.method == 'POST':
+        assigned, unassigned = dispatch.drain()
+        if assigned:
+            messages.success(request, f"Đã tự động phân công {assigned} yêu cầu.")
+        if unassigned:
+            messages.warning(request, f"{unassigned} yêu cầu chưa có nhân viên phù hợp đang trong ca.")
+        if not (assigned or unassigned):
+            messages.info(request, "Không có yêu cầu nào đang chờ phân công.")
+    return redirect('admin_request_management')
+
+
+def bulk_selection(request, filter_func):
+    """(danh sách khóa, bị cắt bớt) từ form thao tác hàng loạt: các ô đã chọn, hoặc mọi dòng khớp bộ lọc (scope=filtered)."""
+    if request.POST.get('scope') == 'filtered':
+        ids = list(filter_func(QueryDict(request.POST.get('filters', ''))).values_list('pk', flat=True)[:bulk.MAX_ITEMS + 1])
+    else:
+        ids = list(dict.fromkeys(int(pk) for pk in request.POST.getlist('ids') if is_number(pk)))
+    return ids[:bulk.MAX_ITEMS], len(ids) > bulk.MAX_ITEMS
+
+
+def render_bulk_result(request, results, action_label, truncated, back_url, is_admin_user):
+    done = sum(1 for result in results if result.ok)
+    logger.info(f"Bulk {action_label} by {request.user.username}: {done}/{len(results)} succeeded")
+    context = {
+        'results': results,
+        'action_label': action_label,
+        'done': done,
+        'skipped': len(results) - done,
+        'truncated': truncated,
+        'max_items': bulk.MAX_ITEMS,
+        'back_url': back_url,
+        'is_admin': is_admin_user,
+        'is_staff': not is_admin_user,
+    }
+    return render(request, 'admin/bulk_result.html', context)
+
+
+@login_required
+@user_passes_test(is_admin_or_staff)
+def bulk_requests(request):
+    """Đổi trạng thái nhiều yêu cầu một lần (tối đa bulk.MAX_ITEMS), cùng quy tắc với process_request; báo cáo từng mục."""
+    back_url = f"{reverse('admin_request_management')}?{request.POST.get('filters', '')}".rstrip('?')
+    if request.method != 'POST':
+        return redirect('admin_request_management')
+
+    action = request.POST.get('action')
+    admin_user = request.user.loai_tk == 'admin'
+    allowed = bulk.REQUEST_ACTIONS if admin_user else bulk.STAFF_REQUEST_ACTIONS
+    if action not in allowed:
+        messages.error(request, "Bạn không có quyền thực hiện hành động này.")
+        return redirect(back_url)
+
+    assignee_id = None
+    if action == 'assign':
+        staff = request.POST.get('staff', '')
+        # Giá trị lạ (không phải số) không được tới truy vấn khóa chính: báo lỗi như chưa chọn
+        if is_number(staff):
+            assignee_id = NhanVien.objects.filter(pk=staff).values_list('pk', flat=True).first()
+        if assignee_id is None:
+            messages.error(request, "Vui lòng chọn nhân viên để phân công.")
+            return redirect(back_url)
+    staff_id = None if admin_user else NhanVien.objects.filter(tai_khoan=request.user).values_list('pk', flat=True).first()
+
+    ids, truncated = bulk_selection(request, filter_requests)
+    if not ids:
+        messages.info(request, "Chưa chọn yêu cầu nào.")
+        return redirect(back_url)
+    results = bulk.transition_requests(ids, action, request.user.loai_tk, staff_id, assignee_id)
+    return render_bulk_result(request, results, bulk.REQUEST_ACTIONS[action], truncated, back_url, admin_user)
+
+
 @login_required
 @user_passes_test(lambda u: u.is_authenticated and getattr(u, 'loai_tk', '').strip().lower() in ['admin', 'nhan_vien'])
 def process_request(request, pk):
@@ -876,6 +1111,7 @@ def process_request(request, pk):
         action = request.POST.get('action')
         staff_id = request.POST.get('staff')
         note = request.POST.get('note', '')
+        old_status = yeu_cau.tinh_trang
 
         status_changed = False
         note_changed = (yeu_cau.ghi_chu != note)
@@ -897,6 +1133,17 @@ def process_request(request, pk):
                 messages.error(request, "Vui lòng chọn nhân viên để phân công.")
                 return redirect('process_request', pk=pk)
 
+        elif action == 'auto_assign':
+            if request.user.loai_tk != 'admin':
+                messages.error(request, "Bạn không có quyền thực hiện hành động này.")
+                return redirect('process_request', pk=pk)
+            ma_nv = dispatch.dispatch_request(yeu_cau)
+            if ma_nv is None:
+                messages.warning(request, "Không có nhân viên phù hợp đang trong ca để phân công.")
+            else:
+                messages.success(request, f"Đã tự động phân công cho {NhanVien.objects.get(pk=ma_nv).ten_nv}.")
+            return redirect('process_request', pk=pk)
+
         elif action == 'processing':
             if yeu_cau.tinh_trang != 'dang_xu_ly':
                 yeu_cau.tinh_trang = 'dang_xu_ly'
@@ -926,7 +1173,9 @@ def process_request(request, pk):
 
         if status_changed or note_changed:
             yeu_cau.ghi_chu = note
-            yeu_cau.save()
+            with transaction.atomic():
+                yeu_cau.save()
+                record_sla(yeu_cau, old_status)
             messages.success(request, f"Yêu cầu đã được cập nhật: {action}.")
         else:
             messages.info(request, "Không có thay đổi nào được thực hiện.")
@@ -956,7 +1205,7 @@ def customer_requests(request):
     confirmed_bookings = DonDatPhong.objects.filter(
         khach_hang=request.user.khachhang,
         trang_thai__in=['da_xac_nhan', 'da_checkin']
-    ).order_by('-ngay_dat')
+    ).select_related('phong').order_by('-ngay_dat')
 
     context = {
         'bookings': confirmed_bookings,
@@ -984,6 +1233,8 @@ def request_detail(request, booking_pk):
             yeu_cau.khach_hang = request.user.khachhang
             yeu_cau.phong = booking.phong
             yeu_cau.save()
+            if getattr(settings, 'REQUEST_AUTO_DISPATCH', True):
+                dispatch.dispatch_request(yeu_cau)
             messages.success(request, "Đã gửi yêu cầu thành công.")
             return redirect('request_detail', booking_pk=booking_pk)
         else:
@@ -1016,29 +1267,32 @@ def admin_dashboard(request):
             messages.error(request, "Tài khoản không có thông tin nhân viên. Vui lòng liên hệ quản trị viên để cập nhật hồ sơ nhân viên.")
             staff_profile = None
 
-    total_rooms = Phong.objects.count()
-    total_bookings = DonDatPhong.objects.count()
-    total_customers = KhachHang.objects.count()
-    total_services = DichVu.objects.count()
+    counts = get_counters()
+    total_rooms = counts['phong']
+    total_bookings = counts['don_dat_phong']
+    total_customers = counts['khach_hang']
+    total_services = counts['dich_vu']
 
-    recent_bookings = DonDatPhong.objects.order_by('-ngay_dat')[:5]
+    recent_bookings = DonDatPhong.objects.select_related('khach_hang', 'phong').order_by('-ngay_dat')[:5]
 
     if request.user.loai_tk == 'nhan_vien':
         if staff_profile:
-            pending_requests = YeuCau.objects.filter(
+            pending_requests = YeuCau.objects.select_related('khach_hang', 'phong', 'nhan_vien').filter(
                 Q(nhan_vien=staff_profile) | Q(nhan_vien__isnull=True),
                 tinh_trang__in=['cho_phan_cong', 'da_phan_cong', 'dang_xu_ly']
             )[:5]
         else:
             pending_requests = YeuCau.objects.none()
     else:
-        pending_requests = YeuCau.objects.filter(tinh_trang='cho_phan_cong')[:5]
+        pending_requests = YeuCau.objects.select_related('khach_hang', 'phong', 'nhan_vien').filter(tinh_trang='cho_phan_cong')[:5]
 
     context = {
         'total_rooms': total_rooms,
         'total_bookings': total_bookings,
         'total_customers': total_customers,
         'total_services': total_services,
+        'booking_status_counts': status_counts(counts, DonDatPhong),
+        'request_status_counts': status_counts(counts, YeuCau),
         'recent_bookings': recent_bookings,
         'pending_requests': pending_requests,
         'is_admin': request.user.loai_tk == 'admin',
@@ -1047,32 +1301,189 @@ def admin_dashboard(request):
     }
     return render(request, 'admin/dashboard.html', context)
 
+# Luồng Server-Sent Events cho bảng điều khiển: thay đổi trạng thái yêu cầu/đặt phòng, lọc theo vai trò và phân công.
+# Cần chạy qua ASGI (hotel_management.asgi); dưới WSGI trả 204 để EventSource dừng kết nối lại.
 @login_required
-@user_passes_test(lambda u: u.is_authenticated and getattr(u, 'loai_tk', '').strip().lower() in ['admin', 'nhan_vien'])
-def admin_booking_management(request):
-    logger.debug(f"User accessing admin_booking_management: {request.user.username}, Role: {getattr(request.user, 'loai_tk', 'N/A')}, Authenticated: {request.user.is_authenticated}")
+@user_passes_test(is_admin_or_staff)
+async def request_events(request):
+    if not isinstance(request, ASGIRequest):
+        logger.warning("request_events needs an ASGI server; live updates disabled for this request")
+        return HttpResponse(status=204)
+    user = await request.auser()
+    ma_nv = None
+    if user.loai_tk == 'nhan_vien':
+        ma_nv = await NhanVien.objects.filter(tai_khoan=user).values_list('ma_nv', flat=True).afirst()
+    role = user.loai_tk
+
+    response = StreamingHttpResponse(
+        events.stream(lambda event: events.visible(event, role, ma_nv), request.headers.get('Last-Event-ID')),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # nginx không gom buffer
+    return response
+
+# Báo cáo doanh thu/công suất theo tháng, đọc từ bảng tổng hợp BaoCaoNgay (một truy vấn cho cả năm)
+@login_required
+@user_passes_test(is_admin)
+def admin_revenue_report(request):
+    logger.debug(f"User accessing admin_revenue_report: {request.user.username}, Role: {getattr(request.user, 'loai_tk', 'N/A')}, Authenticated: {request.user.is_authenticated}")
+    try:
+        year = int(request.GET.get('year') or timezone.now().year)
+    except ValueError:
+        year = timezone.now().year
+
+    rows = BaoCaoNgay.objects.filter(
+        ngay__gte=date(year, 1, 1), ngay__lt=date(year + 1, 1, 1)
+    ).values_list('ngay', 'loai_p', 'so_phong', 'so_dem_ban', 'so_dem_huy', 'doanh_thu_phong', 'doanh_thu_dich_vu')
+    today = timezone.localdate()
+    elapsed = range(1, 13) if year < today.year else range(1, today.month + 1) if year == today.year else ()
+    by_type, by_month = summarize_by_month(rows, year, room_counts(), elapsed)
+
+    room_types = Phong.LOAI_PHONG_CHOICES
+    months = []
+    for month in range(1, 13):
+        if month not in by_month:
+            continue
+        months.append({
+            'month': month,
+            'total': by_month[month],
+            'types': [(label, by_type[(month, loai_p)]) for loai_p, label in room_types if (month, loai_p) in by_type],
+        })
+
+    context = {
+        'year': year,
+        'months': months,
+        'years': range(timezone.now().year, timezone.now().year - 5, -1),
+        'is_admin': True,
+        'is_staff': False,
+    }
+    return render(request, 'admin/revenue_report.html', context)
+
+# Báo cáo SLA yêu cầu: p50/p90/p99 thời gian phản hồi và xử lý, gộp từ các phác thảo SlaNgay (không quét YeuCau)
+@login_required
+@user_passes_test(is_admin)
+def admin_sla_report(request):
+    today = timezone.localdate()
+    try:
+        date_from = datetime.strptime(request.GET.get('from', ''), '%Y-%m-%d').date()
+    except ValueError:
+        date_from = today - timedelta(days=29)
+    try:
+        date_to = datetime.strptime(request.GET.get('to', ''), '%Y-%m-%d').date()
+    except ValueError:
+        date_to = today
+    summaries = sla_report(date_from, date_to)
+
+    staff_ids = [int(gia_tri) for _, nhom, gia_tri in summaries if nhom == 'nhan_vien']
+    labels = {
+        'tat_ca': {'': 'Tất cả yêu cầu'},
+        'loai_yc': dict(YeuCau.LOAI_YC_CHOICES),
+        'ca_lam': dict(LichLamViec.CA_LAM_CHOICES),
+        'nhan_vien': {str(ma_nv): ten_nv for ma_nv, ten_nv in NhanVien.objects.filter(pk__in=staff_ids).values_list('ma_nv', 'ten_nv')},
+    }
+
+    def cells(summary):
+        if summary is None:
+            return None
+        return {
+            'so_luong': summary['so_luong'],
+            'trung_binh': format_duration(summary['trung_binh']),
+            'p50': format_duration(summary['p50']),
+            'p90': format_duration(summary['p90']),
+            'p99': format_duration(summary['p99']),
+        }
+
+    sections = []
+    for nhom, nhom_label in SlaNgay.NHOM_CHOICES:
+        values = sorted({gia_tri for _, group, gia_tri in summaries if group == nhom},
+                        key=lambda gia_tri: labels[nhom].get(gia_tri, gia_tri))
+        rows = [
+            (labels[nhom].get(gia_tri, f"#{gia_tri}"),
+             cells(summaries.get(('phan_hoi', nhom, gia_tri))), cells(summaries.get(('xu_ly', nhom, gia_tri))))
+            for gia_tri in values
+        ]
+        if rows:
+            sections.append((nhom_label, rows))
+
+    context = {
+        'date_from': date_from,
+        'date_to': date_to,
+        'sections': sections,
+        'is_admin': True,
+        'is_staff': False,
+    }
+    return render(request, 'admin/sla_report.html', context)
+
+def filter_bookings(params):
+    """Danh sách DonDatPhong theo bộ lọc của trang quản lý đặt phòng (search, status, start_date, end_date)."""
     bookings = DonDatPhong.objects.all().order_by('-ngay_dat')
 
-    search_query = request.GET.get('search', '')
-    status = request.GET.get('status', '')
+    search_query = params.get('search', '')
+    status = params.get('status', '')
 
     if search_query:
-        bookings = bookings.filter(
-            Q(khach_hang__ten_kh__icontains=search_query) |
-            Q(phong__ten_p__icontains=search_query) |
-            Q(ma_ddp=search_query)
-        )
+        bookings = apply_search(bookings, search_query, BOOKING_SCHEMA)
     if status:
         bookings = bookings.filter(trang_thai=status)
+    if params.get('flag'):
+        # Đơn bị night audit gắn cảnh báo
+        bookings = bookings.exclude(canh_bao='') if params['flag'] == 'all' else bookings.filter(canh_bao=params['flag'])
+
+    # Lọc theo ngày nhận phòng
+    start_date_str = params.get('start_date', '')
+    end_date_str = params.get('end_date', '')
+    if start_date_str:
+        try:
+            bookings = bookings.filter(ngay_nhan__gte=datetime.strptime(start_date_str, '%Y-%m-%d').date())
+        except ValueError:
+            pass
+    if end_date_str:
+        try:
+            bookings = bookings.filter(ngay_nhan__lte=datetime.strptime(end_date_str, '%Y-%m-%d').date())
+        except ValueError:
+            pass
+    return bookings
 
-    paginator = Paginator(bookings, 10)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+
+@login_required
+@user_passes_test(lambda u: u.is_authenticated and getattr(u, 'loai_tk', '').strip().lower() in ['admin', 'nhan_vien'])
+def admin_booking_management(request):
+    logger.debug(f"User accessing admin_booking_management: {request.user.username}, Role: {getattr(request.user, 'loai_tk', 'N/A')}, Authenticated: {request.user.is_authenticated}")
+    bookings = filter_bookings(request.GET)
+    search_query = request.GET.get('search', '')
+    status = request.GET.get('status', '')
+    start_date_str = request.GET.get('start_date', '')
+    end_date_str = request.GET.get('end_date', '')
+
+    export = request.GET.get('export')
+    if export == 'csv':
+        return export_bookings(bookings)
+    if export == 'invoices':
+        # Hóa đơn của các đơn đặt phòng khớp bộ lọc
+        return export_invoices(HoaDon.objects.filter(don_dat_phong__in=bookings.values('pk')).order_by('-ngay_tao'))
+
+    flag = request.GET.get('flag', '')
+    total = None
+    if not (search_query or start_date_str or end_date_str or flag):
+        counts = get_counters()
+        total = counts.get(f'don_dat_phong:{status}' if status else 'don_dat_phong')
+    paginator = KeysetPaginator(bookings.select_related('khach_hang', 'phong'), ('-ngay_dat', '-ma_ddp'), 10, total=total)
+    page_obj = paginator.get_page(request.GET)
 
     context = {
         'page_obj': page_obj,
         'search_query': search_query,
         'status': status,
+        'flag': flag,
+        'flag_choices': DonDatPhong.CANH_BAO_CHOICES[1:],
+        'start_date': start_date_str,
+        'end_date': end_date_str,
+        'filters': request.GET.urlencode(),
+        'bulk_actions': bulk.BOOKING_ACTIONS if request.user.loai_tk == 'admin' else {
+            key: bulk.BOOKING_ACTIONS[key] for key in bulk.STAFF_BOOKING_ACTIONS
+        },
+        'max_bulk_items': bulk.MAX_ITEMS,
         'is_admin': request.user.loai_tk == 'admin',
         'is_staff': request.user.loai_tk == 'nhan_vien',
     }
@@ -1099,10 +1510,20 @@ def process_booking(request, pk):
                 logger.warning(f"Staff {request.user.username} attempted to confirm booking {booking.ma_ddp} with invalid status: {booking.trang_thai}")
                 return redirect('admin_booking_management')
 
+        # Đơn đổi trạng thái: cảnh báo của night audit không còn đúng
+        booking.canh_bao = ''
+
         if action == 'confirm':
             booking.trang_thai = 'da_xac_nhan'
             booking.ghi_chu = note
-            booking.save()
+            try:
+                with transaction.atomic():
+                    booking.save()
+                    sync_nights(booking)
+            except IntegrityError:
+                messages.error(request, "Phòng đã có đơn khác giữ trong khoảng thời gian này, không thể xác nhận.")
+                logger.warning(f"Booking {booking.ma_ddp} conflicts with another booking on room {booking.phong_id}")
+                return redirect('admin_booking_management')
             messages.success(request, "Đã xác nhận đặt phòng")
             logger.info(f"Booking {booking.ma_ddp} confirmed by {request.user.username}")
 
@@ -1113,13 +1534,15 @@ def process_booking(request, pk):
                     logger.warning(f"Admin {request.user.username} attempted to check-in booking {booking.ma_ddp} with invalid status: {booking.trang_thai}")
                     return redirect('admin_booking_management')
                 booking.trang_thai = 'da_checkin'
-                if booking.phong:  # Ensure phong exists
-                    booking.phong.trang_thai = 'dang_su_dung'
-                    booking.phong.save()
-                else:
-                    logger.warning(f"Booking {booking.ma_ddp} has no associated room during check-in.")
                 booking.ghi_chu = note
-                booking.save()
+                with transaction.atomic():
+                    if booking.phong:  # Ensure phong exists
+                        booking.phong.trang_thai = 'dang_su_dung'
+                        booking.phong.save()
+                    else:
+                        logger.warning(f"Booking {booking.ma_ddp} has no associated room during check-in.")
+                    booking.save()
+                    sync_nights(booking)
                 messages.success(request, "Đã check-in khách")
                 logger.info(f"Booking {booking.ma_ddp} checked-in by {request.user.username}")
 
@@ -1129,25 +1552,29 @@ def process_booking(request, pk):
                     logger.warning(f"Admin {request.user.username} attempted to check-out booking {booking.ma_ddp} with invalid status: {booking.trang_thai}")
                     return redirect('admin_booking_management')
                 booking.trang_thai = 'da_checkout'
-                if booking.phong:  # Ensure phong exists
-                    booking.phong.trang_thai = 'trong'
-                    booking.phong.save()
-                else:
-                    logger.warning(f"Booking {booking.ma_ddp} has no associated room during check-out.")
                 booking.ghi_chu = note
-                booking.save()
 
-                room_cost = booking.gia_ddp if booking.gia_ddp is not None else 0
-                services_cost_data = booking.dondatdichvu_set.aggregate(total_services=Sum('thanh_tien'))
-                services_cost = services_cost_data['total_services'] if services_cost_data['total_services'] is not None else 0
-                total_invoice_amount = room_cost + services_cost
+                # Tiền phòng + dịch vụ, cộng dồn sẵn trên đơn (core/totals.py)
+                total_invoice_amount = booking.tong_tien
 
-                if not HoaDon.objects.filter(don_dat_phong=booking).exists():
-                    HoaDon.objects.create(
-                        don_dat_phong=booking,
-                        tong_tien=total_invoice_amount,
-                        da_thanh_toan=False
-                    )
+                with transaction.atomic():
+                    if booking.phong:  # Ensure phong exists
+                        booking.phong.trang_thai = 'trong'
+                        booking.phong.save()
+                    else:
+                        logger.warning(f"Booking {booking.ma_ddp} has no associated room during check-out.")
+                    booking.save()
+                    sync_nights(booking)
+                    record_checkout(booking)
+
+                    invoice_created = not HoaDon.objects.filter(don_dat_phong=booking).exists()
+                    if invoice_created:
+                        HoaDon.objects.create(
+                            don_dat_phong=booking,
+                            tong_tien=total_invoice_amount,
+                            da_thanh_toan=False
+                        )
+                if invoice_created:
                     messages.success(request, f"Đã check-out khách cho đơn #{booking.ma_ddp} và tạo hóa đơn.")
                 else:
                     messages.info(request, f"Đã check-out khách cho đơn #{booking.ma_ddp}. Hóa đơn đã tồn tại.")
@@ -1158,9 +1585,14 @@ def process_booking(request, pk):
                     messages.error(request, "Không thể hủy đơn đã check-out.")
                     logger.warning(f"Admin {request.user.username} attempted to cancel booking {booking.ma_ddp} with status: {booking.trang_thai}")
                     return redirect('admin_booking_management')
+                already_canceled = booking.trang_thai == 'da_huy'
                 booking.trang_thai = 'da_huy'
                 booking.ghi_chu = note
-                booking.save()
+                with transaction.atomic():
+                    booking.save()
+                    sync_nights(booking)
+                    if not already_canceled:
+                        record_cancellation(booking)
                 messages.success(request, "Đã hủy đặt phòng")
                 logger.info(f"Booking {booking.ma_ddp} canceled by {request.user.username}")
 
@@ -1183,6 +1615,31 @@ def process_booking(request, pk):
     return render(request, 'admin/process_booking.html', context)
 
 
+@login_required
+@user_passes_test(is_admin_or_staff)
+def bulk_bookings(request):
+    """Xác nhận/check-in/check-out/hủy nhiều đơn một lần (tối đa bulk.MAX_ITEMS), cùng điều kiện với process_booking."""
+    back_url = f"{reverse('admin_booking_management')}?{request.POST.get('filters', '')}".rstrip('?')
+    if request.method != 'POST':
+        return redirect('admin_booking_management')
+
+    action = request.POST.get('action')
+    admin_user = request.user.loai_tk == 'admin'
+    # Nhân viên chỉ được phép xác nhận đơn đặt phòng
+    allowed = bulk.BOOKING_ACTIONS if admin_user else bulk.STAFF_BOOKING_ACTIONS
+    if action not in allowed:
+        messages.error(request, "Bạn không có quyền thực hiện hành động này.")
+        logger.warning(f"User {request.user.username} attempted unauthorized bulk action: {action}")
+        return redirect(back_url)
+
+    ids, truncated = bulk_selection(request, filter_bookings)
+    if not ids:
+        messages.info(request, "Chưa chọn đơn đặt phòng nào.")
+        return redirect(back_url)
+    results = bulk.transition_bookings(ids, action)
+    return render_bulk_result(request, results, bulk.BOOKING_ACTIONS[action], truncated, back_url, admin_user)
+
+
 @login_required
 @user_passes_test(lambda u: u.is_authenticated and getattr(u, 'loai_tk', '').strip().lower() in ['admin', 'nhan_vien'])
 def admin_schedule_management(request):
@@ -1204,67 +1661,35 @@ def admin_schedule_management(request):
 
     first_day = current_date.replace(day=1)
     last_day = (current_date.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+    weeks = month_weeks(first_day, last_day)
+    month_schedules = LichLamViec.objects.filter(ngay_lam__range=[first_day, last_day])
 
-    weeks = []
-    week = []
-
-    start_weekday = first_day.weekday()
-    if start_weekday > 0:
-        week.extend([None] * start_weekday)
-
-    day = first_day
-    while day <= last_day:
-        if len(week) == 7:
-            weeks.append(week)
-            week = []
-        week.append(day)
-        day += timedelta(days=1)
-
-    if week:
-        weeks.append(week + [None] * (7 - len(week)))
-
-    # Chỉ admin được phép xem danh sách nhân viên
-    staff = NhanVien.objects.filter(
-        trang_thai='dang_lam') if request.user.loai_tk == 'admin' else NhanVien.objects.none()
-
-    # Nhân viên chỉ được xem lịch làm việc của chính mình
-    if request.user.loai_tk == 'nhan_vien':
-        try:
-            staff_profile = NhanVien.objects.get(tai_khoan=request.user)
-            schedules = LichLamViec.objects.filter(
-                ngay_lam__range=[first_day, last_day],
-                nhan_vien=staff_profile
-            ).select_related('nhan_vien')
-        except NhanVien.DoesNotExist:
-            schedules = LichLamViec.objects.none()
+    staff = []
+    staff_profile = None
+    if request.user.loai_tk == 'admin':
+        # Chỉ admin được phép xem lịch của mọi nhân viên
+        staff = list(NhanVien.objects.filter(trang_thai='dang_lam').only('ma_nv', 'ten_nv'))
+        schedule_grid = staff_grid(staff, month_schedules, weeks)
     else:
-        schedules = LichLamViec.objects.filter(
-            ngay_lam__range=[first_day, last_day]
-        ).select_related('nhan_vien')
-
-    try:
-        staff_profile = NhanVien.objects.get(tai_khoan=request.user) if request.user.loai_tk == 'nhan_vien' else None
-    except NhanVien.DoesNotExist:
-        staff_profile = None
+        # Nhân viên chỉ được xem lịch làm việc của chính mình
+        staff_profile = NhanVien.objects.filter(tai_khoan=request.user).first()
+        schedule_grid = calendar_grid(
+            month_schedules.filter(nhan_vien=staff_profile) if staff_profile else LichLamViec.objects.none(), weeks
+        )
 
     # Chỉ admin được phép thêm ca làm việc
     form = None
     if request.user.loai_tk == 'admin':
         form = LichLamViecForm(request.POST or None, initial={'ngay_lam': today})
         if request.method == 'POST' and form.is_valid():
+            # Trùng lịch đã được kiểm tra trong LichLamViecForm.clean(); IntegrityError chỉ xảy ra khi có người thêm xen giữa
             try:
-                existing = LichLamViec.objects.filter(
-                    nhan_vien=form.cleaned_data['nhan_vien'],
-                    ngay_lam=form.cleaned_data['ngay_lam'],
-                    ca_lam=form.cleaned_data['ca_lam']
-                ).exists()
-
-                if existing:
-                    messages.error(request, "Nhân viên đã có lịch làm việc này")
-                else:
+                with transaction.atomic():
                     form.save()
-                    messages.success(request, "Đã thêm lịch làm việc")
-                    return redirect('admin_schedule_management')
+                messages.success(request, "Đã thêm lịch làm việc")
+                return redirect('admin_schedule_management')
+            except IntegrityError:
+                messages.error(request, "Nhân viên đã có lịch làm việc này")
             except Exception as e:
                 messages.error(request, f"Có lỗi xảy ra: {str(e)}")
         elif request.method == 'POST':
@@ -1277,13 +1702,125 @@ def admin_schedule_management(request):
         'next_month': next_month,
         'weeks': weeks,
         'staff': staff,
-        'schedules': schedules,
+        'schedule_grid': schedule_grid,
+        'feed_links': schedule_feed_links(request, staff_profile),
         'form': form,
         'is_admin': request.user.loai_tk == 'admin',
         'is_staff': request.user.loai_tk == 'nhan_vien',
         'staff_profile': staff_profile,
     }
     return render(request, 'admin/schedule_management.html', context)
+# Feed ICS/JSON lịch làm việc theo nhân viên hoặc bộ phận cho ứng dụng lịch (không đăng nhập, xác thực bằng token ký).
+# If-None-Match khớp version các tháng trong cache thì trả 304 mà không truy vấn DB.
+def schedule_feed(request, token, fmt):
+    parsed = read_feed_token(token)
+    if fmt not in ('ics', 'json') or parsed is None:
+        raise Http404("Feed không tồn tại")
+    scope, value = parsed
+    month = None
+    if request.GET.get('month'):
+        try:
+            month = datetime.strptime(request.GET['month'], '%Y-%m').date()
+        except ValueError:
+            return JsonResponse({'status': 'error', 'message': 'Tham số tháng không hợp lệ.'}, status=400)
+    months = feed_months(month)
+
+    versions, staff_version = feed_versions(months)
+    etag_source = f"{token}:{fmt}:{staff_version}:" + ",".join(f"{key}.{version}" for key, version in versions.items())
+    etag = quote_etag(hashlib.md5(etag_source.encode()).hexdigest())
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+    else:
+        shifts = feed_shifts(scope, value, months)
+        if scope == 'nv':
+            name = NhanVien.objects.filter(pk=value).values_list('ten_nv', flat=True).first() or value
+        else:
+            name = dict(NhanVien.VI_TRI_CHOICES).get(value, value)
+        if fmt == 'ics':
+            response = HttpResponse(to_ics(shifts, f"Lịch làm việc - {name}"), content_type='text/calendar; charset=utf-8')
+        else:
+            response = JsonResponse({
+                'name': name,
+                'months': list(versions),
+                'shifts': [
+                    {
+                        'ma_lich': shift['ma_lich'],
+                        'ma_nv': shift['nhan_vien_id'],
+                        'ten_nv': shift['nhan_vien__ten_nv'],
+                        'ngay_lam': shift['ngay_lam'].isoformat(),
+                        'ca_lam': shift['ca_lam'],
+                        'bat_dau': shift['bat_dau'].isoformat(),
+                        'ket_thuc': shift['ket_thuc'].isoformat(),
+                        'ghi_chu': shift['ghi_chu'],
+                    }
+                    for shift in shifts
+                ],
+            })
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def schedule_feed_links(request, staff_profile):
+    """[(nhãn, url ICS, url JSON)]: nhân viên thấy feed của mình, admin thấy feed từng bộ phận."""
+    if staff_profile is not None:
+        targets = [('Lịch của tôi', feed_token('nv', staff_profile.ma_nv))]
+    elif request.user.loai_tk == 'admin':
+        targets = [(label, feed_token('bp', code)) for code, label in NhanVien.VI_TRI_CHOICES]
+    else:
+        targets = []
+    return [
+        (
+            label,
+            request.build_absolute_uri(reverse('schedule_feed', args=[token, 'ics'])),
+            request.build_absolute_uri(reverse('schedule_feed', args=[token, 'json'])),
+        )
+        for label, token in targets
+    ]
+
+
+# Chỉ admin được xếp lịch hàng loạt theo mẫu ca xoay vòng
+@login_required
+@user_passes_test(is_admin)
+def admin_schedule_roster(request):
+    logger.debug(f"User accessing admin_schedule_roster: {request.user.username}, Role: {getattr(request.user, 'loai_tk', 'N/A')}, Authenticated: {request.user.is_authenticated}")
+    form = RosterForm(request.POST or None, initial={'ngay_bat_dau': timezone.now().date()})
+    result = None
+    conflicts = []
+    if request.method == 'POST' and form.is_valid():
+        staff_ids = form.staff_ids()
+        if not staff_ids:
+            messages.error(request, "Không có nhân viên nào phù hợp để xếp lịch")
+        else:
+            result = roster.apply(
+                staff_ids, form.cleaned_data['ngay_bat_dau'], form.cleaned_data['ngay_ket_thuc'],
+                form.cleaned_data['pattern'], stagger=form.cleaned_data['lech_ca'], ghi_chu=form.cleaned_data['ghi_chu'],
+            )
+            names = dict(NhanVien.objects.filter(
+                ma_nv__in={conflict.nhan_vien_id for conflict in result.conflicts[:ROSTER_CONFLICTS_SHOWN]}
+            ).values_list('ma_nv', 'ten_nv'))
+            conflicts = [
+                (names.get(conflict.nhan_vien_id, conflict.nhan_vien_id), conflict.ngay_lam, CA_LAM_LABELS.get(conflict.ca_lam, conflict.ca_lam))
+                for conflict in result.conflicts[:ROSTER_CONFLICTS_SHOWN]
+            ]
+            logger.info(f"Roster by {request.user.username}: {len(staff_ids)} staff, {result.created} shifts created, {len(result.conflicts)} conflicts")
+            messages.success(request, f"Đã tạo {result.created} ca làm việc cho {len(staff_ids)} nhân viên"
+                                      + (f", bỏ qua {len(result.conflicts)} ca đã có" if result.conflicts else ""))
+    elif request.method == 'POST':
+        for field, errors in form.errors.items():
+            for error in errors:
+                messages.error(request, f"{field}: {error}" if field != '__all__' else error)
+
+    context = {
+        'form': form,
+        'result': result,
+        'conflicts': conflicts,
+        'conflicts_hidden': len(result.conflicts) - len(conflicts) if result else 0,
+        'is_admin': True,
+        'is_staff': False,
+    }
+    return render(request, 'admin/schedule_roster.html', context)
+
 @login_required
 @user_passes_test(lambda u: u.is_authenticated and getattr(u, 'loai_tk', '').strip().lower() in ['admin', 'nhan_vien'])
 def delete_schedule(request, pk):
@@ -1295,9 +1832,11 @@ def delete_schedule(request, pk):
     schedule = get_object_or_404(LichLamViec, pk=pk)
 
     if request.method == 'POST':
+        ngay_lam = schedule.ngay_lam
         schedule.delete()
         messages.success(request, "Đã xóa lịch làm việc")
-        return redirect('admin_schedule_management')
+        # Quay lại đúng tháng vừa sửa (signal chỉ tăng version feed của tháng này)
+        return redirect(f"{reverse('admin_schedule_management')}?year={ngay_lam.year}&month={ngay_lam.month}")
 
     context = {
         'schedule': schedule,
@@ -1321,10 +1860,7 @@ def admin_service_booking(request):
     end_date_str = request.GET.get('end_date', '')
 
     if search_query:
-        service_bookings = service_bookings.filter(
-            Q(don_dat_phong__khach_hang__ten_kh__icontains=search_query) |
-            Q(dich_vu__ten_dv__icontains=search_query) |
-            Q(don_dat_phong__phong__ten_p__icontains=search_query))
+        service_bookings = apply_search(service_bookings, search_query, SERVICE_BOOKING_SCHEMA)
 
     if service_id:
         service_bookings = service_bookings.filter(dich_vu__ma_dv=service_id)
@@ -1343,9 +1879,14 @@ def admin_service_booking(request):
         except ValueError:
             pass
 
-    paginator = Paginator(service_bookings, 10)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    if request.GET.get('export') == 'csv':
+        return export_service_bookings(service_bookings)
+
+    paginator = KeysetPaginator(
+        service_bookings.select_related('don_dat_phong__khach_hang', 'don_dat_phong__phong', 'dich_vu'),
+        ('-ngay_su_dung', '-ma_ddv'), 10,
+    )
+    page_obj = paginator.get_page(request.GET)
 
     context = {
         'page_obj': page_obj,
@@ -1359,30 +1900,82 @@ def admin_service_booking(request):
     }
     return render(request, 'admin/service_booking.html', context)
 
+# Lịch sử đặt phòng / yêu cầu hỗ trợ: trang đầu render sẵn cửa sổ đầu tiên, các cửa sổ sau tải qua JSON khi cuộn.
+# Mỗi cửa sổ là một truy vấn select_related với tập cột cố định (only), sắp theo khóa (ngày, mã).
+HISTORY_WINDOW_SIZE = 50
+
+
+def booking_history_window(params):
+    bookings = DonDatPhong.objects.select_related('khach_hang', 'phong').only(
+        'ma_ddp', 'ngay_dat', 'ngay_nhan', 'ngay_tra', 'gia_ddp', 'tong_tien', 'trang_thai',
+        'khach_hang__ten_kh', 'phong__ten_p',
+    )
+    search_query = params.get('q', '').strip()
+    status = params.get('status', '')
+    if search_query:
+        bookings = apply_search(bookings, search_query, BOOKING_SCHEMA)
+    if status:
+        bookings = bookings.filter(trang_thai=status)
+    return KeysetPaginator(bookings, ('-ngay_dat', '-ma_ddp'), HISTORY_WINDOW_SIZE).get_page(params)
+
+
+def support_window(params):
+    support_requests = YeuCau.objects.select_related('khach_hang', 'phong', 'nhan_vien').only(
+        'ma_yc', 'loai_yc', 'ngay_tao', 'tinh_trang',
+        'khach_hang__ten_kh', 'phong__ten_p', 'nhan_vien__ten_nv',
+    )
+    search_query = params.get('q', '').strip()
+    loai_yc = params.get('loai', '')
+    if search_query:
+        support_requests = apply_search(support_requests, search_query, REQUEST_SCHEMA)
+    if loai_yc:
+        support_requests = support_requests.filter(loai_yc=loai_yc)
+    return KeysetPaginator(support_requests, ('-ngay_tao', '-ma_yc'), HISTORY_WINDOW_SIZE).get_page(params)
+
+
 @login_required
 @user_passes_test(lambda u: u.is_authenticated and getattr(u, 'loai_tk', '').strip().lower() in ['admin', 'nhan_vien'])
 def admin_booking_history(request):
     logger.debug(f"User accessing admin_booking_history: {request.user.username}, Role: {getattr(request.user, 'loai_tk', 'N/A')}, Authenticated: {request.user.is_authenticated}")
-    bookings = DonDatPhong.objects.all().order_by('-ngay_dat')
+    window = booking_history_window(request.GET)
     context = {
-        'bookings': bookings,
+        'bookings': window,
+        'next_cursor': window.next_token,
         'is_admin': request.user.loai_tk == 'admin',
         'is_staff': request.user.loai_tk == 'nhan_vien',
     }
     return render(request, 'admin/booking_history.html', context)
 
+
+@login_required
+@user_passes_test(lambda u: u.is_authenticated and getattr(u, 'loai_tk', '').strip().lower() in ['admin', 'nhan_vien'])
+def admin_booking_history_window(request):
+    window = booking_history_window(request.GET)
+    html = render_to_string('admin/booking_history_rows.html', {'bookings': window}, request=request)
+    return JsonResponse({'html': html, 'next': window.next_token})
+
+
 @login_required
 @user_passes_test(lambda u: u.is_authenticated and getattr(u, 'loai_tk', '').strip().lower() in ['admin', 'nhan_vien'])
 def admin_support_management(request):
     logger.debug(f"User accessing admin_support_management: {request.user.username}, Role: {getattr(request.user, 'loai_tk', 'N/A')}, Authenticated: {request.user.is_authenticated}")
-    support_requests = YeuCau.objects.all().order_by('-ngay_tao')
+    window = support_window(request.GET)
     context = {
-        'requests': support_requests,
+        'requests': window,
+        'next_cursor': window.next_token,
         'is_admin': request.user.loai_tk == 'admin',
         'is_staff': request.user.loai_tk == 'nhan_vien',
     }
     return render(request, 'admin/support_management.html', context)
 
+
+@login_required
+@user_passes_test(lambda u: u.is_authenticated and getattr(u, 'loai_tk', '').strip().lower() in ['admin', 'nhan_vien'])
+def admin_support_management_window(request):
+    window = support_window(request.GET)
+    html = render_to_string('admin/support_management_rows.html', {'requests': window}, request=request)
+    return JsonResponse({'html': html, 'next': window.next_token})
+
 @login_required
 @user_passes_test(lambda u: u.is_authenticated and (getattr(u, 'loai_tk', '').strip().lower() in ['admin', 'nhan_vien'] or is_customer(u)))
 def booking_detail(request, pk):
@@ -1438,7 +2031,9 @@ def booking_detail(request, pk):
                         ghi_chu=note
                     )
                     don_dat_dich_vu.full_clean()
-                    don_dat_dich_vu.save()
+                    with transaction.atomic():
+                        # signals cộng thành tiền vào tong_dich_vu/tong_tien của đơn trong cùng transaction
+                        don_dat_dich_vu.save()
 
                     messages.success(request, "Đã thêm dịch vụ thành công.")
                     return redirect('booking_detail', pk=pk)
@@ -1453,7 +2048,10 @@ def booking_detail(request, pk):
 
             elif action == 'cancel' and booking.trang_thai == 'cho_xac_nhan':
                 booking.trang_thai = 'da_huy'
-                booking.save()
+                with transaction.atomic():
+                    booking.save()
+                    sync_nights(booking)
+                    record_cancellation(booking)
                 messages.success(request, "Đã hủy đặt phòng.")
                 return redirect('booking_detail', pk=pk)
 
@@ -1482,20 +2080,18 @@ def customer_bookings(request):
     bookings_qs = DonDatPhong.objects.filter(khach_hang=request.user.khachhang)
 
     if search_query:
-        bookings_qs = bookings_qs.filter(
-            Q(ma_ddp__icontains=search_query) |
-            Q(phong__ten_p__icontains=search_query) |
-            Q(phong__loai_p__icontains=search_query)
-        )
-
-    if sort_by in ['ngay_dat', '-ngay_dat', 'ngay_nhan', '-ngay_nhan', 'trang_thai']:
-        bookings_qs = bookings_qs.order_by(sort_by)
-    else:
-        bookings_qs = bookings_qs.order_by('-ngay_dat')
-
-    paginator = Paginator(bookings_qs, 10)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+        condition = search_related(search_query, phong=Phong)
+        if is_number(search_query.strip()):
+            condition |= Q(ma_ddp=int(search_query))
+        bookings_qs = bookings_qs.filter(condition)
+
+    if sort_by not in ['ngay_dat', '-ngay_dat', 'ngay_nhan', '-ngay_nhan', 'trang_thai']:
+        sort_by = '-ngay_dat'
+    # Thêm mã đơn làm khóa phụ cùng chiều để thứ tự là duy nhất
+    tie_breaker = '-ma_ddp' if sort_by.startswith('-') else 'ma_ddp'
+
+    paginator = KeysetPaginator(bookings_qs.select_related('khach_hang', 'phong'), (sort_by, tie_breaker), 10)
+    page_obj = paginator.get_page(request.GET)
 
     context = {
         'page_obj': page_obj,
@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'hotel_management.settings')
 
 application = get_asgi_application()
+
+# Dựng sẵn chỉ mục gợi ý khách hàng để lượt tra đầu tiên không phải chờ
+from core.typeahead import customer_index  # noqa: E402
+
+customer_index.warm()
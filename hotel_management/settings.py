@@ -47,6 +47,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.QueryBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -88,6 +89,13 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            'timeout': 20,  # số giây writer chờ khóa ghi trước khi báo "database is locked"
+        },
+        'TEST': {
+            # CSDL test dạng file để các test đồng thời (nhiều thread) dùng khóa SQLite thật
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
@@ -125,6 +133,23 @@ THOUSAND_SEPARATOR = '.'
 DECIMAL_SEPARATOR = ','
 
 
+# Thời gian giữ chỗ tạm (bước 1 đặt phòng) trước khi bị thu hồi
+BOOKING_HOLD_SECONDS = 10 * 60
+
+# Yêu cầu khách gửi được tự động giao cho nhân viên đúng bộ phận, đang trong ca và ít việc nhất (core/dispatch.py)
+REQUEST_AUTO_DISPATCH = True
+
+# Backend chuyển sự kiện trạng thái tới các kết nối /admin-dashboard/events/ (core/events.py).
+# LocalBackend chỉ giao trong tiến trình; chạy nhiều worker ASGI thì thay bằng backend dùng chung (vd. Redis pub/sub).
+EVENTS_BACKEND = 'core.events.LocalBackend'
+
+# Đếm truy vấn theo request (core/middleware.py): 'off', 'log' (lấy mẫu, ghi log) hoặc 'raise' (dùng trong test).
+# Ngân sách theo tên URL khai báo trong QUERY_BUDGETS ở hotel_management/urls.py.
+QUERY_BUDGET_MODE = 'log'
+QUERY_BUDGET_SAMPLE_RATE = 0.02
+QUERY_BUDGET_REPEAT_THRESHOLD = 5
+
+
 SESSION_COOKIE_AGE = 60 * 60 * 24 * 7 * 2
 SESSION_SAVE_EVERY_REQUEST = True
 SESSION_EXPIRE_AT_BROWSER_CLOSE = False
@@ -136,12 +161,28 @@ SESSION_COOKIE_HTTPONLY = True
 SESSION_COOKIE_SAMESITE = 'Lax'
 
 
+# 'default': cache riêng của từng tiến trình cho dữ liệu dựng sẵn (trang, ma trận phòng), khóa theo version.
+# 'shared': version, bộ đếm, lượt giữ chỗ theo tài khoản - phải dùng chung giữa các worker và lệnh quản trị chạy
+# từ cron (core/cache_backend.py). Mặc định là bảng core_cache trong CSDL chính (tạo bởi migrate); đặt REDIS_URL
+# để dùng Redis.
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
         'LOCATION': 'unique-snowflake',
-    }
+    },
+    'shared': {
+        'BACKEND': 'core.cache_backend.DatabaseCache',
+        'LOCATION': 'core_cache',
+        'TIMEOUT': None,
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
 }
+if os.environ.get('REDIS_URL'):
+    CACHES['shared'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+        'TIMEOUT': None,
+    }
 
 
 # Static files (CSS, JavaScript, Images)
@@ -192,5 +233,10 @@ LOGGING = {
             'level': 'DEBUG',
             'propagate': True,
         },
+        'core.middleware': {
+            'handlers': ['file'],
+            'level': 'WARNING',
+            'propagate': True,
+        },
     },
 }
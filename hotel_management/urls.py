@@ -37,6 +37,7 @@ urlpatterns = [
     # Core URLs
     path('', core_views.home, name='home'),
     path('rooms/', core_views.room_search, name='room_search'),
+    path('rooms/availability/', core_views.room_availability, name='room_availability'),
     path('rooms/<int:pk>/', RoomDetailView.as_view(), name='room_detail'),
     path('services/', core_views.service_list, name='service_list'),
     path('services/<int:pk>/', core_views.service_detail, name='service_detail'),
@@ -50,13 +51,19 @@ urlpatterns = [
 
     # Admin URLs
     path('admin-dashboard/', core_views.admin_dashboard, name='admin_dashboard'),
+    path('admin-dashboard/reports/revenue/', core_views.admin_revenue_report, name='admin_revenue_report'),
+    path('admin-dashboard/reports/sla/', core_views.admin_sla_report, name='admin_sla_report'),
     path('admin-dashboard/rooms/', core_views.admin_room_management, name='admin_room_management'),
     path('admin/rooms/add/', core_views.add_room, name='add_room'),
     path('admin-dashboard/rooms/<int:pk>/edit/', core_views.edit_room, name='edit_room'),
     path('admin-dashboard/rooms/<int:pk>/delete/', core_views.delete_room, name='delete_room'),
     path('admin-dashboard/bookings/', core_views.admin_booking_management, name='admin_booking_management'),
     path('admin-dashboard/bookings/<int:pk>/', core_views.process_booking, name='process_booking'),
+    path('admin-dashboard/bookings/bulk/', core_views.bulk_bookings, name='bulk_bookings'),
+    path('admin-dashboard/bookings/history/', core_views.admin_booking_history, name='admin_booking_history'),
+    path('admin-dashboard/bookings/history/window/', core_views.admin_booking_history_window, name='admin_booking_history_window'),
     path('admin-dashboard/customers/', core_views.admin_customer_management, name='admin_customer_management'),
+    path('admin-dashboard/customers/typeahead/', core_views.admin_customer_typeahead, name='admin_customer_typeahead'),
     path('admin-dashboard/customers/<int:pk>/', core_views.customer_detail, name='customer_detail'),
     path('customers/<int:pk>/edit/', core_views.edit_customer, name='edit_customer'),
     path('customers/<int:pk>/delete/', core_views.delete_customer, name='delete_customer'),
@@ -65,9 +72,16 @@ urlpatterns = [
     path('admin-dashboard/staff/<int:pk>/edit/', core_views.edit_staff, name='edit_staff'),
     path('admin-dashboard/staff/<int:pk>/delete/', core_views.delete_staff, name='delete_staff'),
     path('admin-dashboard/schedule/', core_views.admin_schedule_management, name='admin_schedule_management'),
+    path('admin-dashboard/schedule/roster/', core_views.admin_schedule_roster, name='admin_schedule_roster'),
     path('admin-dashboard/schedule/<int:pk>/delete/', core_views.delete_schedule, name='delete_schedule'),
+    path('schedule/feed/<str:token>.<str:fmt>', core_views.schedule_feed, name='schedule_feed'),
     path('admin-dashboard/requests/', core_views.admin_request_management, name='admin_request_management'),
+    path('admin-dashboard/events/', core_views.request_events, name='request_events'),
+    path('admin-dashboard/requests/dispatch/', core_views.dispatch_requests, name='dispatch_requests'),
+    path('admin-dashboard/requests/bulk/', core_views.bulk_requests, name='bulk_requests'),
     path('admin-dashboard/requests/<int:pk>/', core_views.process_request, name='process_request'),
+    path('admin-dashboard/support/', core_views.admin_support_management, name='admin_support_management'),
+    path('admin-dashboard/support/window/', core_views.admin_support_management_window, name='admin_support_management_window'),
     path('admin-dashboard/services/', core_views.admin_service_management, name='admin_service_management'),
     path('admin/services/add/', core_views.add_service, name='add_service'),
     path('admin-dashboard/services/<int:pk>/edit/', core_views.edit_service, name='edit_service'),
@@ -77,4 +91,40 @@ urlpatterns = [
 
 if settings.DEBUG:
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
-    urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
\ No newline at end of file
+    urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
+# Số truy vấn SQL tối đa cho mỗi request theo tên URL, kiểm tra bởi core.middleware.QueryBudgetMiddleware
+# (QueryBudgetTests chạy ở chế độ 'raise'; production lấy mẫu và ghi log). Tính cả lượt đọc version/bộ đếm
+# trong cache dùng chung khi cache đó là bảng core_cache (settings.CACHES['shared']).
+QUERY_BUDGETS = {
+    # Khách hàng
+    'home': 8,
+    'room_search': 6,
+    'room_detail': 10,
+    'service_list': 8,
+    'service_detail': 6,
+    'customer_requests': 8,
+    'customer_bookings': 8,
+    'booking_detail': 12,
+
+    # Admin / nhân viên
+    'admin_dashboard': 12,
+    'admin_revenue_report': 7,
+    'admin_sla_report': 6,
+    'admin_room_management': 8,
+    'admin_booking_management': 7,
+    'process_booking': 8,
+    'admin_booking_history': 6,
+    'admin_booking_history_window': 6,
+    'admin_customer_management': 7,
+    'admin_customer_typeahead': 5,
+    'customer_detail': 8,
+    'admin_staff_management': 8,
+    'admin_schedule_management': 9,
+    'admin_schedule_roster': 6,
+    'schedule_feed': 5,
+    'admin_request_management': 7,
+    'admin_support_management': 6,
+    'admin_support_management_window': 6,
+    'admin_service_management': 8,
+    'admin_service_booking': 8,
+}
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'hotel_management.settings')
 
 application = get_wsgi_application()
+
+# Dựng sẵn chỉ mục gợi ý khách hàng để lượt tra đầu tiên không phải chờ
+from core.typeahead import customer_index  # noqa: E402
+
+customer_index.warm()
@@ -0,0 +1,39 @@
+// Vẽ lịch phòng trống từ endpoint room_availability (encoding=rle: các đoạn trống/đã đặt xen kẽ)
+function decodeAvailabilityRuns(runs) {
+  const bits = [];
+  runs.forEach((length, i) => {
+    for (let k = 0; k < length; k++) bits.push(i % 2 === 1);
+  });
+  return bits;
+}
+
+function drawAvailabilityCalendar(container, runs, start, compact) {
+  const busy = decodeAvailabilityRuns(runs);
+  const first = new Date(start + 'T00:00:00');
+  container.innerHTML = '';
+  container.classList.add('availability-calendar');
+  busy.forEach((isBusy, i) => {
+    const day = new Date(first);
+    day.setDate(first.getDate() + i);
+    const cell = document.createElement('span');
+    cell.className = 'availability-day ' + (isBusy ? 'busy' : 'free');
+    cell.title = day.toLocaleDateString('vi-VN') + (isBusy ? ' - Đã có khách' : ' - Còn trống');
+    if (!compact) cell.textContent = day.getDate();
+    container.appendChild(cell);
+  });
+}
+
+function loadAvailabilityCalendars(url, selector, compact) {
+  const containers = document.querySelectorAll(selector);
+  if (!containers.length) return;
+  const ids = Array.from(containers, el => el.dataset.roomId).join(',');
+  fetch(`${url}?rooms=${ids}&days=90`, { credentials: 'same-origin' })
+    .then(response => response.json())
+    .then(data => {
+      containers.forEach(el => {
+        const runs = data.rooms[el.dataset.roomId];
+        if (runs) drawAvailabilityCalendar(el, runs, data.start, compact);
+      });
+    })
+    .catch(err => console.error('Không tải được lịch phòng trống', err));
+}
@@ -0,0 +1,36 @@
+// Form thao tác hàng loạt (#bulkForm) trên trang danh sách: ô "chọn tất cả" đánh dấu các dòng đang hiển thị,
+// chọn "mọi dòng khớp bộ lọc" thì bỏ qua ô đã chọn; chỉ hiện ô chọn nhân viên khi hành động là phân công.
+(function () {
+  const form = document.getElementById('bulkForm');
+  if (!form) return;
+  const boxes = () => document.querySelectorAll('input[name="ids"][form="bulkForm"]');
+  const selectAll = document.querySelector('[data-bulk-select-all]');
+  const count = form.querySelector('[data-bulk-count]');
+  const staff = form.querySelector('[data-bulk-staff]');
+  const action = form.querySelector('select[name="action"]');
+
+  function refresh() {
+    const checked = Array.from(boxes()).filter(box => box.checked).length;
+    if (count) count.textContent = checked;
+    if (selectAll) selectAll.checked = checked > 0 && checked === boxes().length;
+  }
+
+  if (selectAll) {
+    selectAll.addEventListener('change', () => {
+      boxes().forEach(box => { box.checked = selectAll.checked; });
+      refresh();
+    });
+  }
+  boxes().forEach(box => box.addEventListener('change', refresh));
+  if (staff && action) {
+    const toggleStaff = () => staff.classList.toggle('d-none', action.value !== 'assign');
+    action.addEventListener('change', toggleStaff);
+    toggleStaff();
+  }
+  form.addEventListener('submit', event => {
+    const filtered = form.querySelector('input[name="scope"]:checked');
+    const selected = filtered && filtered.value === 'filtered' ? 'mọi dòng khớp bộ lọc' : `${count ? count.textContent : ''} dòng đã chọn`;
+    if (!window.confirm(`Áp dụng "${action.options[action.selectedIndex].text}" cho ${selected}?`)) event.preventDefault();
+  });
+  refresh();
+})();
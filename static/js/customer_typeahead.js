@@ -0,0 +1,67 @@
+// Gợi ý khách hàng dưới ô tìm kiếm: <input data-typeahead-url="..."> gọi endpoint JSON {results: [...], more}
+// sau khi ngừng gõ 150ms; bấm một gợi ý để mở trang chi tiết khách hàng.
+function initCustomerTypeahead(input) {
+  const url = input.dataset.typeaheadUrl;
+  const menu = document.createElement('div');
+  menu.className = 'dropdown-menu shadow-sm';
+  menu.style.minWidth = '100%';
+  input.parentElement.style.position = 'relative';
+  input.after(menu);
+  let timer = null;
+  let generation = 0;
+
+  function hide() {
+    menu.classList.remove('show');
+  }
+
+  function render(results, more) {
+    menu.innerHTML = '';
+    results.forEach(item => {
+      const link = document.createElement('a');
+      link.className = 'dropdown-item small';
+      link.href = item.url;
+      const name = document.createElement('strong');
+      name.textContent = item.ten_kh;
+      const detail = document.createElement('span');
+      detail.className = 'text-muted ms-2';
+      detail.textContent = `${item.sdt} · ${item.email}`;
+      link.append(name, detail);
+      menu.append(link);
+    });
+    if (more) {
+      // Chỉ mục dừng sớm: có thể còn khách khớp chưa hiện
+      const hint = document.createElement('span');
+      hint.className = 'dropdown-item-text small text-muted';
+      hint.textContent = results.length ? 'Còn kết quả khác, gõ thêm để thu hẹp' : 'Quá nhiều khách khớp, gõ thêm để thu hẹp';
+      menu.append(hint);
+    }
+    menu.classList.toggle('show', results.length > 0 || more);
+  }
+
+  function lookup() {
+    const query = input.value.trim();
+    const current = ++generation;
+    if (query.length < 2) return hide();
+    // Giữ nguyên URL cho cùng một chuỗi để trình duyệt dùng lại cache (Cache-Control max-age)
+    fetch(`${url}?${new URLSearchParams({ q: query })}`, { credentials: 'same-origin' })
+      .then(response => response.json())
+      .then(data => {
+        if (current === generation) render(data.results, data.more);
+      })
+      .catch(err => console.error(err));
+  }
+
+  input.setAttribute('autocomplete', 'off');
+  input.addEventListener('input', () => {
+    clearTimeout(timer);
+    timer = setTimeout(lookup, 150);
+  });
+  input.addEventListener('keydown', event => {
+    if (event.key === 'Escape') hide();
+  });
+  input.addEventListener('blur', () => setTimeout(hide, 200));
+}
+
+document.addEventListener('DOMContentLoaded', () => {
+  document.querySelectorAll('input[data-typeahead-url]').forEach(initCustomerTypeahead);
+});
@@ -0,0 +1,45 @@
+// Cập nhật bảng điều khiển theo luồng sự kiện (request_events): đổi nhãn trạng thái của các dòng đang hiển thị,
+// có yêu cầu/đặt phòng chưa có trên trang thì hiện nút "tải lại" thay vì tải lại cả trang mỗi lần.
+(function () {
+  const container = document.querySelector('[data-events-url]');
+  if (!container || !window.EventSource) return;
+  const notice = container.querySelector('[data-events-notice]');
+  const BADGES = {
+    yeu_cau: {
+      cho_phan_cong: 'badge-waiting', da_phan_cong: 'badge-checked-in', dang_xu_ly: 'badge-confirmed',
+    },
+    don_dat_phong: {
+      cho_xac_nhan: 'badge-waiting', da_xac_nhan: 'badge-confirmed', da_checkin: 'badge-checked-in',
+      da_checkout: 'badge-checked-out',
+    },
+  };
+  const BADGE_CLASSES = ['badge-waiting', 'badge-confirmed', 'badge-checked-in', 'badge-checked-out', 'badge-cancelled'];
+
+  function showNotice() {
+    if (notice) notice.classList.remove('d-none');
+  }
+
+  function apply(event) {
+    const data = JSON.parse(event.data);
+    data.pks.forEach(pk => {
+      const row = document.querySelector(`[data-event-pk="${data.type}-${pk}"]`);
+      if (!row) return showNotice();
+      const badge = row.querySelector('[data-event-status]');
+      if (!badge) return;
+      badge.classList.remove(...BADGE_CLASSES);
+      badge.classList.add(BADGES[data.type][data.status] || 'badge-cancelled');
+      badge.textContent = data.label;
+      // Đã xử lý/hủy hoặc giao cho người khác: các cột còn lại (nhân viên, nút xử lý) đã cũ
+      if (data.type === 'yeu_cau') showNotice();
+    });
+  }
+
+  const source = new EventSource(container.dataset.eventsUrl);
+  source.addEventListener('yeu_cau', apply);
+  source.addEventListener('don_dat_phong', apply);
+  // Không theo kịp luồng sự kiện: dữ liệu trên trang không còn đúng
+  source.addEventListener('reload', () => {
+    source.close();
+    window.location.reload();
+  });
+})();
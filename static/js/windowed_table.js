@@ -0,0 +1,64 @@
+// Tải dần các cửa sổ dòng của bảng khi cuộn tới cuối (endpoint trả JSON {html, next}).
+// <tbody data-window-url="..." data-next="..."> và các ô lọc có data-window-filter="tên tham số".
+function initWindowedTable(tbody) {
+  const url = tbody.dataset.windowUrl;
+  const sentinel = document.createElement('div');
+  const status = document.createElement('div');
+  status.className = 'text-center text-muted small py-2';
+  tbody.closest('table').after(sentinel, status);
+  let next = tbody.dataset.next || null;
+  let loading = false;
+  let generation = 0;
+
+  function filterParams() {
+    const params = new URLSearchParams();
+    document.querySelectorAll('[data-window-filter]').forEach(el => {
+      if (el.value) params.set(el.dataset.windowFilter, el.value);
+    });
+    return params;
+  }
+
+  function load(replace) {
+    if (loading && !replace) return;
+    if (!replace && !next) return;
+    const params = filterParams();
+    if (!replace) params.set('cursor', next);
+    const current = ++generation;
+    loading = true;
+    status.textContent = 'Đang tải...';
+    fetch(`${url}?${params}`, { credentials: 'same-origin' })
+      .then(response => response.json())
+      .then(data => {
+        // Bỏ kết quả cũ nếu bộ lọc đã đổi trong lúc chờ
+        if (current !== generation) return;
+        if (replace) tbody.innerHTML = '';
+        tbody.insertAdjacentHTML('beforeend', data.html);
+        next = data.next;
+        status.textContent = next ? '' : (tbody.children.length ? 'Đã hiển thị tất cả' : 'Không có dữ liệu');
+      })
+      .catch(err => {
+        status.textContent = 'Không tải được dữ liệu';
+        console.error(err);
+      })
+      .finally(() => {
+        if (current === generation) loading = false;
+      });
+  }
+
+  new IntersectionObserver(entries => {
+    if (entries.some(entry => entry.isIntersecting)) load(false);
+  }, { rootMargin: '400px' }).observe(sentinel);
+
+  let timer = null;
+  document.querySelectorAll('[data-window-filter]').forEach(el => {
+    el.addEventListener(el.tagName === 'SELECT' ? 'change' : 'input', () => {
+      clearTimeout(timer);
+      timer = setTimeout(() => load(true), 300);
+    });
+  });
+  if (!next) status.textContent = tbody.children.length ? 'Đã hiển thị tất cả' : 'Không có dữ liệu';
+}
+
+document.addEventListener('DOMContentLoaded', () => {
+  document.querySelectorAll('tbody[data-window-url]').forEach(initWindowedTable);
+});